@@ -1,157 +1,196 @@
+import atexit
 from datetime import date
 import os
+import threading
 
-from flask import Flask, request, abort
-from linebot import LineBotApi, WebhookHandler
-from linebot.exceptions import InvalidSignatureError
-from linebot.models import (
-    MessageEvent, TextMessage, TextSendMessage, 
-)
+from flask import Flask, Response, request, abort
 
-from core.ui import create_main_menu, create_roommate_selection, create_schedule_flex_message
-from core.utils import generate_schedule, set_next_roommate_index, update_schedules_for_weeks
-from config import LINE_CHANNEL_ACCESS_TOKEN, LINE_CHANNEL_SECRET, ROOMMATES
+from core.admission import BUSY_TEXT, get_admission
+from core.dedup import is_duplicate
+from core.delivery import LineDelivery
+from core.ingest import EventQueue
+from core import metrics
+from core import tracing
+from core import warmup
+from config import (
+    LINE_CHANNEL_ACCESS_TOKEN, LINE_CHANNEL_SECRET, LINE_API_ENDPOINT,
+    LINE_API_POOL_SIZE, LINE_API_CONNECT_TIMEOUT, LINE_API_READ_TIMEOUT, LINE_API_MAX_RETRIES,
+    WEBHOOK_ASYNC, WEBHOOK_WORKERS, WEBHOOK_QUEUE_SIZE, WEBHOOK_ENQUEUE_TIMEOUT, REMINDER_ENABLED,
+    ROLLOVER_ENABLED, FAST_START,
+)
 
 
 app = Flask(__name__)
 
-line_bot_api = LineBotApi(LINE_CHANNEL_ACCESS_TOKEN)
-handler = WebhookHandler(LINE_CHANNEL_SECRET)
+delivery = LineDelivery(
+    LINE_CHANNEL_ACCESS_TOKEN,
+    endpoint=LINE_API_ENDPOINT,
+    timeout=(LINE_API_CONNECT_TIMEOUT, LINE_API_READ_TIMEOUT),
+    max_retries=LINE_API_MAX_RETRIES,
+    pool_size=LINE_API_POOL_SIZE,
+)
+
+# LINE SDK（linebot 與 linebot.models）在第一次使用時才載入，程序可以更早開始接受連線
+_handler = None
+_handler_lock = threading.Lock()
+
+def get_handler():
+    global _handler
+    if _handler is None:
+        with _handler_lock:
+            if _handler is None:
+                from linebot import WebhookHandler
+                from linebot.models import MessageEvent, TextMessage
+
+                handler = WebhookHandler(LINE_CHANNEL_SECRET)
+                validator = handler.parser.signature_validator
+                validator.validate = metrics.timed(metrics.stage('signature'))(validator.validate)
+                handler.add(MessageEvent, message=TextMessage)(handle_message)
+                _handler = handler
+    return _handler
+
+def handle_webhook(body, signature, trace_id=None):
+    # 非同步模式在背景執行緒處理，以 /callback 的追蹤 ID 另外開始一個追蹤
+    with tracing.trace('webhook', trace_id):
+        get_handler().handle(body, signature)
+
+event_queue = None
+if WEBHOOK_ASYNC:
+    event_queue = EventQueue(
+        handle_webhook,
+        workers=WEBHOOK_WORKERS,
+        maxsize=WEBHOOK_QUEUE_SIZE,
+        put_timeout=WEBHOOK_ENQUEUE_TIMEOUT,
+    )
+    atexit.register(event_queue.shutdown)
+
+reminder_scheduler = None
+if REMINDER_ENABLED:
+    from core.reminders import ReminderScheduler
+
+    reminder_scheduler = ReminderScheduler(delivery)
+    reminder_scheduler.start()
+    atexit.register(reminder_scheduler.stop)
+
+rollover_scheduler = None
+if ROLLOVER_ENABLED:
+    from core.rollover import RolloverScheduler
+
+    rollover_scheduler = RolloverScheduler()
+    rollover_scheduler.start()
+    atexit.register(rollover_scheduler.stop)
+
+@app.route("/metrics")
+def metrics_endpoint():
+    return metrics.render(), 200, {'Content-Type': metrics.CONTENT_TYPE}
+
+@app.route("/export/schedule.<kind>")
+def export_schedule(kind):
+    from core import export
+
+    if kind not in export.CONTENT_TYPES:
+        abort(404)
+    if not export.check_token(request.args.get('token')):
+        abort(403)
+    try:
+        status, headers, body = export.export_feed(
+            kind, request.args.get('tenant', ''), request.args.get('roommate') or None,
+            request.headers.get('If-None-Match'), request.headers.get('If-Modified-Since')
+        )
+    except ValueError:
+        abort(400)
+    return Response(body, status=status, headers=headers)
+
+@app.route("/import/schedule.csv", methods=['POST'])
+def import_schedule():
+    from core import export
+
+    if not export.check_token(request.args.get('token')):
+        abort(403)
+    if (request.content_length or 0) > export.MAX_IMPORT_BYTES:
+        abort(413)
+    try:
+        months, weeks = export.import_csv(request.get_data(as_text=True), request.args.get('tenant', ''))
+    except ValueError as e:
+        return f"{e}\n", 400
+    return f"已匯入 {months} 個月，變更 {weeks} 週\n"
+
+@app.route("/debug/profile")
+def profile_endpoint():
+    from core import profiler
+
+    if not profiler.check_token(request.args.get('token')):
+        abort(403)
+    try:
+        counts = profiler.sample(float(request.args.get('seconds', 5)))
+    except ValueError:
+        abort(400)
+    except RuntimeError:
+        abort(409)
+    return profiler.collapsed(counts), 200, {'Content-Type': 'text/plain; charset=utf-8'}
 
 @app.route("/callback", methods=['POST'])
+@metrics.timed(metrics.REQUEST_SECONDS)
 def callback():
+    with tracing.trace('callback', tracing.trace_id_from(request.headers.get)) as trace:
+        _callback()
+    return 'OK', 200, {'X-Request-Id': trace.trace_id}
+
+def _callback():
     signature = request.headers['X-Line-Signature']
     body = request.get_data(as_text=True)
     
+    if event_queue is not None:
+        # 非同步模式：只驗證簽章就排入佇列，立即回應 200
+        if not get_handler().parser.signature_validator.validate(body, signature):
+            abort(400)
+        if not event_queue.submit(body, signature, tracing.current_trace_id()):
+            abort(503)
+        return
+
+    from linebot.exceptions import InvalidSignatureError
+
     try:
-        handler.handle(body, signature)
+        handle_webhook(body, signature)
     except InvalidSignatureError:
         abort(400)
-    
-    return 'OK'
 
-@handler.add(MessageEvent, message=TextMessage)
 def handle_message(event):
+    from core.commands import handle_text, router, tenant_id_of
+
     text = event.message.text.strip()
+    # 不是指令的一般聊天直接略過，不做去重也不扣流量額度
+    if router.match(text) is None:
+        return
+    tracing.annotate(webhook_event_id=getattr(event, 'webhook_event_id', None))
     today = date.today()
     try:
-        if text in ["倒垃圾咪狗"]:
-            reply_text = "🏠 室友輪值排程系統\n\n請選擇功能："
-            line_bot_api.reply_message(
-                event.reply_token,
-                TextSendMessage(text=reply_text, quick_reply=create_main_menu())
-            )
-            
-        elif text == "查看本月排程":
-            schedules, config = generate_schedule(today.year, today.month)
-            
-            if isinstance(schedules, str):  # 錯誤訊息
-                line_bot_api.reply_message(
-                    event.reply_token,
-                    TextSendMessage(text=schedules, quick_reply=create_main_menu())
-                )
-            else:
-                next_roommate = ROOMMATES[config['next_roommate_index']]
-                flex_msg = create_schedule_flex_message(schedules, today.year, today.month)
-                status_msg = TextSendMessage(
-                    text=f"✅ 排程已更新！\n下個月將從 {next_roommate} 開始",
-                    quick_reply=create_main_menu()
-                )
-                line_bot_api.reply_message(
-                    event.reply_token,
-                    [flex_msg, status_msg]
-                )
-            
-        elif text == "設定下個室友":
-            line_bot_api.reply_message(
-                event.reply_token,
-                TextSendMessage(text="請選擇下一個輪到的室友：", quick_reply=create_roommate_selection())
-            )
-            
-        elif text.startswith("選擇室友"):
-            roommate_index = int(text.replace("選擇室友", ""))
-            set_next_roommate_index(roommate_index)
-            
-            selected_roommate = ROOMMATES[roommate_index]
-            line_bot_api.reply_message(
-                event.reply_token,
-                TextSendMessage(
-                    text=f"✅ 已設定下一個輪到的室友為：{selected_roommate}",
-                    quick_reply=create_main_menu()
-                )
-            )
-            
-        elif text == "更改本月排程":
-            schedules, config = generate_schedule(today.year, today.month)
-            
-            if isinstance(schedules, str):  # 錯誤訊息
-                line_bot_api.reply_message(
-                    event.reply_token,
-                    TextSendMessage(text=schedules, quick_reply=create_main_menu())
-                )
-            else:
-                hint_msg = TextSendMessage(
-                    text=(
-                        "請輸入新的排程格式\n"
-                        "每一行代表一週的排程，格式為「週數 室友名稱」\n"
-                        "格式範例：\n"
-                        "!更改排程\n"
-                        "1 思妤\n"
-                        "3 怡彣\n"
-                        f"可用室友名稱：{', '.join(ROOMMATES)}"
-                    ),
-                )
-                flex_msg = create_schedule_flex_message(schedules, today.year, today.month)
-                line_bot_api.reply_message(
-                    event.reply_token,
-                    [flex_msg, hint_msg]
-                )
-        elif text.startswith("!更改排程"):
-            # 處理排程更改
-            schedules, config = generate_schedule(today.year, today.month)
-            
-            if isinstance(schedules, str):  # 錯誤訊息
-                line_bot_api.reply_message(
-                    event.reply_token,
-                    TextSendMessage(text=schedules, quick_reply=create_main_menu())
-                )
-                return
-                
-            next_roommate = ROOMMATES[config['next_roommate_index']]
-            
-            lines = text.split("\n")[1:]
-            week_roommate_map = {}
-            for line in lines:
-                parts = line.split()
-                if len(parts) == 2:
-                    week_num = int(parts[0])
-                    roommate_name = parts[1]
-                    if roommate_name in ROOMMATES:
-                        week_roommate_map[week_num] = roommate_name
-                    else:
-                        line_bot_api.reply_message(
-                            event.reply_token,
-                            TextSendMessage(text=f"❌ 無效的室友名稱：{roommate_name}")
-                        )
-                        return
-                    
-            schedules = update_schedules_for_weeks(today.year, today.month, week_roommate_map)
-            
-            flex_msg = create_schedule_flex_message(schedules, today.year, today.month)
-            status_msg = TextSendMessage(
-                text=f"✅ 排程已更新！\n下個月將從 {next_roommate} 開始",
-                quick_reply=create_main_menu()
-            )
-            line_bot_api.reply_message(
-                event.reply_token,
-                [flex_msg, status_msg]
-            )
+        # LINE 重送的事件已經處理過，不再讀寫排程或回覆
+        if is_duplicate(event):
+            return
+        admission = get_admission()
+        if not admission.allow(event.source):
+            return
 
+        if admission.acquire():
+            try:
+                messages = handle_text(text, today, tenant_id_of(event.source))
+            finally:
+                # 名額只涵蓋讀寫儲存與產生訊息，不包含等待 LINE API 回應
+                admission.release()
         else:
-            pass
+            from linebot.models import TextSendMessage
+            messages = [TextSendMessage(text=BUSY_TEXT)]
+        if messages:
+            delivery.reply(event.reply_token, messages)
             
     except Exception as e:
-        pass
+        metrics.ERRORS.labels('handle_message').inc()
+        tracing.warn("訊息處理失敗", e, webhook_event_id=getattr(event, 'webhook_event_id', None))
+
+if FAST_START:
+    # 開始接受連線的同時預先載入 SDK 與指令處理，並從快照還原儲存快取
+    warmup.start(get_handler, warmup.prepare_commands)
 
 if __name__ == "__main__":
     # app.run(debug=True, port=5000)
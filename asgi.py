@@ -0,0 +1,337 @@
+"""ASGI 入口：與 app.py 使用相同的指令處理，但以 asyncio 與 v3 非同步 API 客戶端回覆
+
+部署方式：uvicorn asgi:app --port 5000
+沒有安裝 ASGI 伺服器時可直接 python asgi.py，會以 aiohttp 提供服務。
+"""
+import asyncio
+from datetime import date
+import os
+from urllib.parse import parse_qs
+
+from linebot import WebhookParser
+from linebot.exceptions import InvalidSignatureError
+from linebot.models import MessageEvent, TextMessage, TextSendMessage
+
+from core.admission import BUSY_TEXT, get_admission
+from core.commands import handle_text, router, tenant_id_of
+from core.dedup import is_duplicate
+from core.delivery import LineDelivery, to_payload
+from core.reminders import ReminderScheduler
+from core.rollover import RolloverScheduler
+from core import metrics, tracing, warmup
+from config import (
+    LINE_CHANNEL_ACCESS_TOKEN, LINE_CHANNEL_SECRET, LINE_API_ENDPOINT, LINE_API_POOL_SIZE, REMINDER_ENABLED,
+    ROLLOVER_ENABLED, FAST_START,
+)
+
+
+parser = WebhookParser(LINE_CHANNEL_SECRET)
+parser.signature_validator.validate = metrics.timed(metrics.stage('signature'))(parser.signature_validator.validate)
+_LINE_API = metrics.stage('line_api')
+
+# 整個程序共用一個 aiohttp 連線池
+api_client = None
+messaging_api = None
+# v3 SDK 載入需要一秒以上；FAST_START 時在背景載入，載入完成前的回覆改用同步的發送層
+_client_loading = None
+fallback_delivery = None
+# 每週提醒在背景執行緒發送，使用同步的發送層
+reminder_scheduler = None
+# 月份排程在背景執行緒預先產生
+rollover_scheduler = None
+
+def _import_messaging():
+    import linebot.v3.messaging
+    return linebot.v3.messaging
+
+async def _create_client():
+    global api_client, messaging_api
+    loop = asyncio.get_running_loop()
+    messaging = await loop.run_in_executor(None, _import_messaging)
+    if api_client is None:
+        configuration = messaging.Configuration(host=LINE_API_ENDPOINT, access_token=LINE_CHANNEL_ACCESS_TOKEN)
+        # SDK 預設的連線上限是 CPU 數 × 5，在 shared-cpu-1x 上只有 5 條，會限制同時回覆的數量
+        configuration.connection_pool_maxsize = LINE_API_POOL_SIZE
+        api_client = messaging.AsyncApiClient(configuration)
+        messaging_api = messaging.AsyncMessagingApi(api_client)
+
+async def startup():
+    global _client_loading, fallback_delivery, reminder_scheduler, rollover_scheduler
+    if api_client is None:
+        if not FAST_START:
+            await _create_client()
+        elif _client_loading is None:
+            fallback_delivery = LineDelivery(LINE_CHANNEL_ACCESS_TOKEN, endpoint=LINE_API_ENDPOINT)
+            _client_loading = asyncio.ensure_future(_create_client())
+            warmup.start(warmup.prepare_commands)
+    if REMINDER_ENABLED and reminder_scheduler is None:
+        reminder_scheduler = ReminderScheduler(LineDelivery(LINE_CHANNEL_ACCESS_TOKEN, endpoint=LINE_API_ENDPOINT))
+        reminder_scheduler.start()
+    if ROLLOVER_ENABLED and rollover_scheduler is None:
+        rollover_scheduler = RolloverScheduler()
+        rollover_scheduler.start()
+
+async def shutdown():
+    global api_client, messaging_api, _client_loading, reminder_scheduler, rollover_scheduler
+    if _client_loading is not None:
+        await _client_loading
+        _client_loading = None
+    if api_client is not None:
+        await api_client.close()
+        api_client = None
+        messaging_api = None
+    if reminder_scheduler is not None:
+        reminder_scheduler.stop()
+        reminder_scheduler = None
+    if rollover_scheduler is not None:
+        rollover_scheduler.stop()
+        rollover_scheduler = None
+
+async def reply(reply_token, messages):
+    if messaging_api is None:
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, fallback_delivery.reply, reply_token, messages)
+        return
+    messaging = _import_messaging()
+    with _LINE_API.time():
+        await messaging_api.reply_message(messaging.ReplyMessageRequest(
+            reply_token=reply_token,
+            messages=[messaging.Message.from_dict(to_payload(message)) for message in messages]
+        ))
+
+async def handle_message(event):
+    text = event.message.text.strip()
+    # 不是指令的一般聊天直接略過，不做去重也不扣流量額度
+    if router.match(text) is None:
+        return
+    tracing.annotate(webhook_event_id=getattr(event, 'webhook_event_id', None))
+    today = date.today()
+    try:
+        # LINE 重送的事件已經處理過，不再讀寫排程或回覆
+        if is_duplicate(event):
+            return
+        admission = get_admission()
+        if not admission.allow(event.source):
+            return
+
+        # 事件迴圈中不等待名額，沒有空位就直接回覆忙碌中
+        if admission.acquire(blocking=False):
+            try:
+                # 指令處理會讀寫儲存檔，放到執行緒池執行，避免卡住事件迴圈
+                loop = asyncio.get_running_loop()
+                messages = await loop.run_in_executor(
+                    None, tracing.bind(handle_text), text, today, tenant_id_of(event.source)
+                )
+            finally:
+                admission.release()
+        else:
+            messages = [TextSendMessage(text=BUSY_TEXT)]
+        if messages:
+            await reply(event.reply_token, messages)
+
+    except Exception as e:
+        metrics.ERRORS.labels('handle_message').inc()
+        tracing.warn("訊息處理失敗", e, webhook_event_id=getattr(event, 'webhook_event_id', None))
+
+async def callback(body, signature, trace_id=None):
+    with metrics.REQUEST_SECONDS.time(), tracing.trace('callback', trace_id):
+        return await _callback(body, signature)
+
+async def _callback(body, signature):
+    try:
+        events = parser.parse(body, signature)
+    except InvalidSignatureError:
+        return 400, b'Bad Request'
+
+    await startup()
+    await asyncio.gather(*(
+        handle_message(event) for event in events
+        if isinstance(event, MessageEvent) and isinstance(event.message, TextMessage)
+    ))
+    return 200, b'OK'
+
+async def _read_body(receive):
+    body = b''
+    while True:
+        message = await receive()
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            return body
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await startup()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await shutdown()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+def _query(scope):
+    return {key: values[-1] for key, values in parse_qs(scope.get('query_string', b'').decode('latin-1')).items()}
+
+async def _export(scope, send):
+    """串流輸出 iCalendar／CSV；讀取儲存與產生內容都在執行緒池中進行"""
+    from core import export
+
+    kind = scope['path'][len('/export/schedule.'):] if scope['path'].startswith('/export/schedule.') else ''
+    query = _query(scope)
+    headers = dict(scope['headers'])
+    loop = asyncio.get_running_loop()
+    body = iter(())
+    if kind not in export.CONTENT_TYPES:
+        status, response_headers = 404, {}
+    elif not export.check_token(query.get('token')):
+        status, response_headers = 403, {}
+    else:
+        try:
+            status, response_headers, body = await loop.run_in_executor(
+                None, export.export_feed, kind, query.get('tenant', ''), query.get('roommate') or None,
+                headers.get(b'if-none-match', b'').decode('latin-1') or None,
+                headers.get(b'if-modified-since', b'').decode('latin-1') or None,
+            )
+        except ValueError:
+            status, response_headers = 400, {}
+
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [
+            (key.lower().encode('latin-1'), value.encode('latin-1')) for key, value in response_headers.items()
+        ],
+    })
+    while True:
+        chunk = await loop.run_in_executor(None, next, body, None)
+        if chunk is None:
+            break
+        await send({'type': 'http.response.body', 'body': chunk.encode('utf-8'), 'more_body': True})
+    await send({'type': 'http.response.body', 'body': b''})
+
+async def _import(scope, receive):
+    from core import export
+
+    query = _query(scope)
+    if not export.check_token(query.get('token')):
+        return 403, b'Forbidden'
+    body = await _read_body(receive)
+    if len(body) > export.MAX_IMPORT_BYTES:
+        return 413, b'Payload Too Large'
+    loop = asyncio.get_running_loop()
+    try:
+        months, weeks = await loop.run_in_executor(
+            None, export.import_csv, body.decode('utf-8'), query.get('tenant', '')
+        )
+    except ValueError as e:
+        return 400, f"{e}\n".encode('utf-8')
+    return 200, f"已匯入 {months} 個月，變更 {weeks} 週\n".encode('utf-8')
+
+async def _profile(scope):
+    """取樣式效能分析，取樣在執行緒池中進行，期間事件迴圈照常處理請求"""
+    from core import profiler
+
+    query = _query(scope)
+    if not profiler.check_token(query.get('token')):
+        return 403, b'Forbidden'
+    try:
+        seconds = float(query.get('seconds', 5))
+    except ValueError:
+        return 400, b'Bad Request'
+    loop = asyncio.get_running_loop()
+    try:
+        counts = await loop.run_in_executor(None, profiler.sample, seconds)
+    except RuntimeError:
+        return 409, b'Conflict'
+    return 200, profiler.collapsed(counts).encode('utf-8')
+
+async def app(scope, receive, send):
+    """ASGI 3 應用程式"""
+    if scope['type'] == 'lifespan':
+        await _lifespan(receive, send)
+        return
+
+    if scope['path'].startswith('/export/') and scope['method'] == 'GET':
+        await _export(scope, send)
+        return
+
+    content_type = b'text/plain; charset=utf-8'
+    extra_headers = []
+    if scope['path'] == '/callback' and scope['method'] == 'POST':
+        headers = dict(scope['headers'])
+        signature = headers.get(b'x-line-signature', b'').decode('latin-1')
+        body = (await _read_body(receive)).decode('utf-8')
+        trace_id = tracing.trace_id_from(
+            lambda name: headers.get(name.lower().encode('latin-1'), b'').decode('latin-1')
+        ) or tracing.Trace.new_id()
+        status, content = await callback(body, signature, trace_id)
+        extra_headers.append((b'x-request-id', trace_id.encode('latin-1')))
+    elif scope['path'] == '/debug/profile' and scope['method'] == 'GET':
+        status, content = await _profile(scope)
+    elif scope['path'] == '/import/schedule.csv' and scope['method'] == 'POST':
+        status, content = await _import(scope, receive)
+    elif scope['path'] == '/metrics' and scope['method'] == 'GET':
+        status, content = 200, metrics.render().encode('utf-8')
+        content_type = metrics.CONTENT_TYPE.encode('latin-1')
+    else:
+        status, content = 404, b'Not Found'
+
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', content_type)] + extra_headers,
+    })
+    await send({'type': 'http.response.body', 'body': content})
+
+def serve_with_aiohttp(port):
+    """以 aiohttp 的伺服器執行上面的 ASGI 應用程式"""
+    from aiohttp import web
+
+    async def bridge(request):
+        body = await request.read()
+        scope = {
+            'type': 'http',
+            'asgi': {'version': '3.0'},
+            'http_version': '1.1',
+            'method': request.method,
+            'path': request.path,
+            'query_string': request.query_string.encode('latin-1'),
+            'headers': [
+                (key.lower().encode('latin-1'), value.encode('latin-1'))
+                for key, value in request.headers.items()
+            ],
+        }
+
+        async def receive():
+            return {'type': 'http.request', 'body': body, 'more_body': False}
+
+        response = {'body': b''}
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                response['status'] = message['status']
+                response['headers'] = [
+                    (key.decode('latin-1'), value.decode('latin-1'))
+                    for key, value in message.get('headers', [])
+                ]
+            else:
+                response['body'] += message.get('body', b'')
+
+        await app(scope, receive, send)
+        return web.Response(status=response['status'], body=response['body'], headers=response['headers'])
+
+    async def on_startup(_):
+        await startup()
+
+    async def on_cleanup(_):
+        await shutdown()
+
+    web_app = web.Application()
+    web_app.router.add_route('*', '/{tail:.*}', bridge)
+    web_app.on_startup.append(on_startup)
+    web_app.on_cleanup.append(on_cleanup)
+    web.run_app(web_app, host="0.0.0.0", port=port, print=None)
+
+
+if __name__ == "__main__":
+    serve_with_aiohttp(int(os.environ.get("PORT", 5000)))
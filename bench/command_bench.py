@@ -0,0 +1,37 @@
+"""指令派送與「!更改排程」解析的微基準測試（每則訊息的成本）
+
+python -m bench.command_bench
+"""
+import timeit
+
+from core.commands import parse_bulk_edit, roster_index, router
+
+
+TEXTS = [
+    '查看本月排程',
+    '查看未來排程 3',
+    '選擇室友2',
+    '!更改排程\n1 室友A',
+    '今天晚餐吃什麼？',  # 一般聊天，不是指令
+    '哈哈',
+]
+ROSTER = roster_index(tuple(f'室友{c}' for c in 'ABCDEFGH'))
+VALID_BODY = "\n".join(f"{week} 室友{'ABCDE'[week - 1]}" for week in range(1, 6))
+INVALID_BODY = "1 室友A\n2 不存在\n九 室友B\n7 室友C\n3 室友D"
+
+
+def report(name, stmt, number):
+    seconds = min(timeit.repeat(stmt, number=number, repeat=5))
+    print(f"{name:28} {seconds / number * 1e6:8.3f} µs/次")
+
+
+def main():
+    for text in TEXTS:
+        report(f"派送 {text.splitlines()[0][:10]!r}", lambda: router.match(text), 200000)
+    report("解析 5 行（全部正確）", lambda: parse_bulk_edit(VALID_BODY, ROSTER, 5), 50000)
+    report("解析 5 行（4 個錯誤）", lambda: parse_bulk_edit(INVALID_BODY, ROSTER, 5), 50000)
+    print(parse_bulk_edit(INVALID_BODY, ROSTER, 5)[1])
+
+
+if __name__ == "__main__":
+    main()
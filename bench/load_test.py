@@ -0,0 +1,98 @@
+"""webhook 負載測試：依指令分別量測吞吐量與 p50/p95/p99 延遲
+
+以子程序啟動 app.py 或 asgi.py，LINE API 由本機的模擬伺服器代替，
+送出帶正確簽章的 webhook 到 /callback。最後讀取伺服器的 /metrics，列出各處理階段的平均耗時。
+
+python -m bench.load_test --script app.py --requests 300 --concurrency 20
+python -m bench.load_test --script asgi.py --env STORAGE_BACKEND=sqlite --tenants 50
+"""
+import argparse
+import asyncio
+import random
+import re
+import urllib.request
+
+from bench.webhook import MockLineApi, Server, percentile, post_webhooks, text_event_body
+
+
+COMMANDS = {
+    '主選單': '主選單',
+    '查看本月排程': '查看本月排程',
+    '查看未來排程': '查看未來排程 3',
+    '設定下個室友': '設定下個室友',
+    '選擇室友': '選擇室友1',
+    '更改本月排程': '更改本月排程',
+    '!更改排程': '!更改排程\n1 室友B\n2 室友C',
+    '一般聊天': '今天晚餐吃什麼？',
+}
+
+_STAGE_LINE = re.compile(r'^tottmigo_stage_seconds_(sum|count)\{stage="([^"]+)"\} (\S+)$')
+
+
+def bodies_for(text, count, tenants):
+    if not tenants:
+        return [text_event_body(text) for _ in range(count)]
+    return [text_event_body(text, f'C{random.randrange(tenants):032x}') for _ in range(count)]
+
+def report(name, rps, latencies, failures):
+    print(f"{name:12} {rps:8.1f} req/s  p50 {percentile(latencies, 50) * 1000:7.1f} ms"
+          f"  p95 {percentile(latencies, 95) * 1000:7.1f} ms  p99 {percentile(latencies, 99) * 1000:7.1f} ms"
+          f"  失敗 {failures}")
+
+def stage_means(url):
+    """從 /metrics 的直方圖算出各階段的平均耗時（毫秒）"""
+    with urllib.request.urlopen(url + '/metrics', timeout=10) as response:
+        text = response.read().decode('utf-8')
+    totals = {}
+    for line in text.splitlines():
+        matched = _STAGE_LINE.match(line)
+        if matched:
+            kind, stage, value = matched.groups()
+            totals.setdefault(stage, {})[kind] = float(value)
+    return {
+        stage: (values['sum'] / values['count'] * 1000, int(values['count']))
+        for stage, values in sorted(totals.items()) if values.get('count')
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--script', default='app.py', help='app.py 或 asgi.py')
+    parser.add_argument('--requests', type=int, default=300, help='每個指令送出的 webhook 數')
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--api-latency', type=float, default=0.05, help='模擬 LINE API 每次呼叫的延遲（秒）')
+    parser.add_argument('--tenants', type=int, default=0, help='分散到多少個群組（0 為單一家庭，大於 0 時開啟 MULTI_TENANT）')
+    parser.add_argument('--commands', nargs='+', choices=list(COMMANDS), default=list(COMMANDS))
+    parser.add_argument('--env', nargs='*', default=[], metavar='KEY=VALUE', help='傳給伺服器的環境變數')
+    args = parser.parse_args()
+
+    env = dict(item.split('=', 1) for item in args.env)
+    if args.tenants:
+        env['MULTI_TENANT'] = '1'
+
+    api = MockLineApi(latency=args.api_latency).start()
+    server = Server(args.script, api.endpoint, env).start()
+    try:
+        # 先產生本月排程，之後量測的是穩定狀態
+        asyncio.run(post_webhooks(server.url, bodies_for('查看本月排程', max(args.tenants, 1), args.tenants), 1))
+
+        print(f"{args.script}  每個指令 {args.requests} 次、並行 {args.concurrency}、"
+              f"LINE API 延遲 {args.api_latency * 1000:.0f} ms")
+        mixed = []
+        for name in args.commands:
+            bodies = bodies_for(COMMANDS[name], args.requests, args.tenants)
+            mixed.extend(bodies_for(COMMANDS[name], args.requests // len(args.commands) + 1, args.tenants))
+            report(name, *asyncio.run(post_webhooks(server.url, bodies, args.concurrency)))
+        random.shuffle(mixed)
+        report('混合', *asyncio.run(post_webhooks(server.url, mixed, args.concurrency)))
+
+        print("\n各階段平均耗時（伺服器 /metrics）：")
+        for stage, (mean_ms, count) in stage_means(server.url).items():
+            print(f"  {stage:18} {mean_ms:8.3f} ms  × {count}")
+    finally:
+        server.stop()
+    print(f"LINE API 共收到 {api.requests} 次呼叫")
+
+
+if __name__ == "__main__":
+    main()
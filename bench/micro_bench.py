@@ -0,0 +1,87 @@
+"""排程核心的微基準：歷史月份越多時，generate_schedule、update_schedules_for_weeks 與
+create_schedule_flex_message 的每次耗時，用來抓效能退化
+
+python -m bench.micro_bench --history 12 120 1200 --backend json sqlite binary
+python -m bench.micro_bench --history 1200 --backend json --hot-months 24
+"""
+import argparse
+import os
+import tempfile
+import time
+from datetime import date
+
+from bench.webhook import ROOMMATES
+
+
+def per_call(func, iterations):
+    started = time.perf_counter()
+    for i in range(iterations):
+        func(i)
+    return (time.perf_counter() - started) / iterations * 1e6
+
+def seed_history(months, start_year=2020):
+    """直接寫入 months 個月份的排程，當作已累積的歷史"""
+    from core.db import load_config, save_config, save_schedules, month_key
+    from core.utils import add_months, project_schedules
+
+    config = load_config()
+    config['roommates'] = ROOMMATES.split(',')
+    history = project_schedules(config, start_year, 1, months)
+    save_schedules({month_key(year, month): {'schedules': schedules} for year, month, schedules in history})
+    last_year, last_month = add_months(start_year, 1, months - 1)
+    config['last_updated_year'] = last_year
+    config['last_updated_month'] = last_month
+    save_config(config)
+    return last_year, last_month
+
+
+def run(backend_name, cached, history, iterations, hot_months=0):
+    from core import db
+    from core.ui import create_schedule_flex_message
+    from core.utils import add_months, generate_schedule, update_schedules_for_weeks
+
+    os.chdir(tempfile.mkdtemp(prefix='tottmigo-micro-'))
+    backend = db.BACKENDS[backend_name](**({'path': 'bench.db'} if backend_name == 'sqlite' else {}))
+    if hot_months:
+        from core.archive import ArchivedBackend
+        backend = ArchivedBackend(backend)
+    db.set_backend(db.CachedBackend(backend) if cached else backend)
+    last_year, last_month = seed_history(history)
+    if hot_months:
+        from core.archive import archive_old_months
+        archive_old_months(date(last_year, last_month, 1), keep=hot_months)
+    roommates = ROOMMATES.split(',')
+
+    read = per_call(lambda i: generate_schedule(last_year, last_month), iterations)
+    # 每次產生一個新的月份（寫入路徑）
+    write = per_call(lambda i: generate_schedule(*add_months(last_year, last_month, i + 1)), iterations)
+    update = per_call(
+        lambda i: update_schedules_for_weeks(last_year, last_month, {1: roommates[i % len(roommates)]}),
+        iterations
+    )
+    schedules, _ = generate_schedule(last_year, last_month)
+    today = date(last_year, last_month, 10)
+    flex = per_call(lambda i: create_schedule_flex_message(schedules, last_year, last_month, today), iterations)
+
+    label = f"{backend_name}{'+cache' if cached else ''}{f'+hot{hot_months}' if hot_months else ''}"
+    print(f"{label:12} 歷史 {history:5d} 月  讀取 {read:8.1f} µs  產生新月份 {write:8.1f} µs"
+          f"  更改排程 {update:8.1f} µs  Flex {flex:7.1f} µs")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--history', type=int, nargs='+', default=[12, 120, 1200])
+    parser.add_argument('--backend', nargs='+', choices=['json', 'sqlite', 'journal', 'binary'], default=['json', 'sqlite', 'journal', 'binary'])
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--no-cache', action='store_true', help='也量測不經過快取的後端')
+    parser.add_argument('--hot-months', type=int, default=0, help='只在主要儲存保留最近幾個月，其餘封存')
+    args = parser.parse_args()
+
+    for backend_name in args.backend:
+        for cached in ([True, False] if args.no_cache else [True]):
+            for history in args.history:
+                run(backend_name, cached, history, args.iterations, args.hot_months)
+
+
+if __name__ == "__main__":
+    main()
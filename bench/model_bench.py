@@ -0,0 +1,98 @@
+"""排程儲存格式的基準：多年歷史以 JSON 檔（JsonBackend）與二進位檔（BinaryBackend）儲存時的
+檔案大小、記憶體用量、冷啟動載入與寫回的耗時
+
+python -m bench.model_bench --history 120 1200 6000
+"""
+import argparse
+import gc
+import os
+import tempfile
+import time
+import tracemalloc
+
+from bench.webhook import ROOMMATES
+
+
+def best_of(func, repeat):
+    """執行 repeat 次，回傳最快一次的毫秒數"""
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - started)
+    return best * 1000
+
+def allocated(build):
+    """build() 回傳的物件佔用的記憶體（KiB）"""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        value = build()
+        size = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    del value
+    return size / 1024
+
+def make_history(months, start_year=1990):
+    from core.db import _default_config, month_key
+    from core.utils import project_schedules
+
+    config = _default_config()
+    config['roommates'] = ROOMMATES.split(',')
+    return {
+        month_key(year, month): {'schedules': schedules}
+        for year, month, schedules in project_schedules(config, start_year, 1, months)
+    }
+
+
+def run(months, repeat):
+    from core.db import JsonBackend, SCHEDULES_FILE
+    from core.model import BinaryBackend, ScheduleHistory
+
+    os.chdir(tempfile.mkdtemp(prefix='tottmigo-model-'))
+    schedules = make_history(months)
+    last_year, last_month = (int(part) for part in list(schedules)[-1].split('-'))
+    entry = schedules[f'{last_year}-{last_month}']
+
+    json_backend = JsonBackend()
+    json_backend.save_schedules('', schedules)
+    binary = BinaryBackend()
+    binary.save_schedules('', schedules)
+    json_size = os.path.getsize(SCHEDULES_FILE) / 1024
+    binary_size = os.path.getsize(binary.schedules_file) / 1024
+
+    with open(binary.schedules_file, 'rb') as f:
+        data = f.read()
+    json_memory = allocated(lambda: json_backend.load_schedules(''))
+    binary_memory = allocated(lambda: ScheduleHistory.decode(data))
+    # 全部月份都轉成 Week 物件（例如同一個程序寫過所有月份）
+    typed_memory = allocated(lambda: ScheduleHistory.from_dict(schedules))
+
+    # 冷啟動：讀檔並解析後取出最後一個月（每次都是新的 BinaryBackend，不沿用記憶體中的內容）
+    json_load = best_of(lambda: json_backend.load_month('', last_year, last_month), repeat)
+    binary_load = best_of(lambda: BinaryBackend().load_month('', last_year, last_month), repeat)
+    json_save = best_of(lambda: json_backend.save_schedules('', schedules), repeat)
+    binary_save = best_of(lambda: binary.save_schedules('', schedules), repeat)
+    # 一般的寫入路徑：只改一個月份
+    json_month = best_of(lambda: json_backend.save_month('', last_year, last_month, entry), repeat)
+    binary_month = best_of(lambda: binary.save_month('', last_year, last_month, entry), repeat)
+
+    print(f"歷史 {months:5d} 月  檔案 JSON {json_size:8.1f} KiB / 二進位 {binary_size:7.1f} KiB"
+          f"  記憶體 dict {json_memory:8.1f} KiB / 欄位 {binary_memory:7.1f} KiB / Week {typed_memory:8.1f} KiB")
+    print(f"{'':14}載入 {json_load:8.2f} / {binary_load:6.2f} ms  全部寫回 {json_save:8.2f} / {binary_save:6.2f} ms"
+          f"  寫入一個月 {json_month:8.2f} / {binary_month:6.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--history', type=int, nargs='+', default=[120, 1200, 6000])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    for months in args.history:
+        run(months, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+"""本機的 Redis 替身：只實作 STORAGE_BACKEND=redis 與事件去重用到的指令
+
+沒有安裝 Redis 時用來測試多台機器共用狀態；WATCH/MULTI/EXEC 的語意與 Redis 相同
+（被 WATCH 的 key 在 EXEC 前被其他連線修改時，EXEC 回傳 nil）。
+
+python -m bench.redis_standin --port 6379
+"""
+import argparse
+import asyncio
+import threading
+import time
+
+from bench.webhook import free_port
+
+
+class RedisStandIn:
+
+    def __init__(self, port=None):
+        self.port = port or free_port()
+        self.data = {}
+        self.expires = {}
+        self.revisions = {}  # key -> 修改次數，供 WATCH 比對
+        self.commands = 0
+        self._ready = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    @property
+    def url(self):
+        return f'redis://127.0.0.1:{self.port}/0'
+
+    def start(self):
+        self._thread.start()
+        self._ready.wait()
+        return self
+
+    def _run(self):
+        async def main():
+            server = await asyncio.start_server(self._serve, '127.0.0.1', self.port)
+            self._ready.set()
+            async with server:
+                await server.serve_forever()
+
+        asyncio.run(main())
+
+    # 資料操作
+
+    def _alive(self, key):
+        expires_at = self.expires.get(key)
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self.data[key]
+            del self.expires[key]
+            self._touch(key)
+        return key in self.data
+
+    def _touch(self, key):
+        self.revisions[key] = self.revisions.get(key, 0) + 1
+
+    def _get(self, key, kind):
+        if not self._alive(key):
+            return None
+        value = self.data[key]
+        if not isinstance(value, kind):
+            raise TypeError
+        return value
+
+    def _apply(self, name, args):
+        if name in ('PING',):
+            return 'PONG'
+        if name in ('AUTH', 'SELECT'):
+            return 'OK'
+        if name == 'GET':
+            return self._get(args[0], bytes)
+        if name == 'SET':
+            key, value, options = args[0], args[1], [arg.upper() for arg in args[2:]]
+            if b'NX' in options and self._alive(key):
+                return None
+            self.data[key] = value
+            self.expires.pop(key, None)
+            if b'PX' in options:
+                self.expires[key] = time.monotonic() + int(options[options.index(b'PX') + 1]) / 1000
+            self._touch(key)
+            return 'OK'
+        if name == 'INCR':
+            value = int(self._get(args[0], bytes) or 0) + 1
+            self.data[args[0]] = str(value).encode()
+            self._touch(args[0])
+            return value
+        if name == 'DEL':
+            count = 0
+            for key in args:
+                if self._alive(key):
+                    del self.data[key]
+                    self.expires.pop(key, None)
+                    self._touch(key)
+                    count += 1
+            return count
+        if name == 'HGET':
+            return (self._get(args[0], dict) or {}).get(args[1])
+        if name == 'HGETALL':
+            return [item for pair in (self._get(args[0], dict) or {}).items() for item in pair]
+        if name == 'HSET':
+            hash_ = self._get(args[0], dict)
+            if hash_ is None:
+                hash_ = self.data[args[0]] = {}
+            added = sum(1 for field in args[1::2] if field not in hash_)
+            hash_.update(zip(args[1::2], args[2::2]))
+            self._touch(args[0])
+            return added
+        if name == 'HDEL':
+            hash_ = self._get(args[0], dict) or {}
+            removed = sum(1 for field in args[1:] if hash_.pop(field, None) is not None)
+            self._touch(args[0])
+            return removed
+        if name == 'SADD':
+            members = self._get(args[0], set)
+            if members is None:
+                members = self.data[args[0]] = set()
+            added = len(set(args[1:]) - members)
+            members.update(args[1:])
+            self._touch(args[0])
+            return added
+        if name == 'SMEMBERS':
+            return list(self._get(args[0], set) or ())
+        raise KeyError(name)
+
+    # RESP 協定
+
+    @staticmethod
+    def _encode(value):
+        if value is None:
+            return b'$-1\r\n'
+        if isinstance(value, Exception):
+            return b'-ERR ' + str(value).encode() + b'\r\n'
+        if isinstance(value, str):
+            return b'+' + value.encode() + b'\r\n'
+        if isinstance(value, int):
+            return b':%d\r\n' % value
+        if isinstance(value, bytes):
+            return b'$%d\r\n%s\r\n' % (len(value), value)
+        return b'*%d\r\n' % len(value) + b''.join(RedisStandIn._encode(item) for item in value)
+
+    async def _serve(self, reader, writer):
+        watched = {}
+        queued = None
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                args = []
+                for _ in range(int(line[1:-2])):
+                    length = int((await reader.readline())[1:-2])
+                    args.append((await reader.readexactly(length + 2))[:-2])
+                self.commands += 1
+                name, args = args[0].decode().upper(), args[1:]
+
+                if name == 'WATCH':
+                    watched.update({key: self.revisions.get(key, 0) for key in args})
+                    reply = 'OK'
+                elif name == 'UNWATCH':
+                    watched = {}
+                    reply = 'OK'
+                elif name == 'MULTI':
+                    queued = []
+                    reply = 'OK'
+                elif name == 'DISCARD':
+                    queued, watched = None, {}
+                    reply = 'OK'
+                elif name == 'EXEC':
+                    # 單一執行緒的事件迴圈：比對與執行之間不會穿插其他連線的指令
+                    if any(self.revisions.get(key, 0) != revision for key, revision in watched.items()):
+                        reply = None
+                    else:
+                        reply = [self._call(command, command_args) for command, command_args in queued or ()]
+                    queued, watched = None, {}
+                elif queued is not None:
+                    queued.append((name, args))
+                    reply = 'QUEUED'
+                else:
+                    reply = self._call(name, args)
+                writer.write(self._encode(reply))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    def _call(self, name, args):
+        try:
+            return self._apply(name, args)
+        except KeyError:
+            return Exception(f"unknown command '{name}'")
+        except TypeError:
+            return Exception('WRONGTYPE Operation against a key holding the wrong kind of value')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--port', type=int, default=6379)
+    args = parser.parse_args()
+    standin = RedisStandIn(args.port).start()
+    print(f"Redis 替身：{standin.url}")
+    threading.Event().wait()
+
+
+if __name__ == "__main__":
+    main()
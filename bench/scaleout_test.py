@@ -0,0 +1,94 @@
+"""多台機器共用狀態的一致性測試：多個程序同時對同一個租戶產生與修改排程，
+檢查沒有遺失的更新（樂觀並行控制的版本比對有效）
+
+每個程序模擬一台 app 機器，STORAGE_BACKEND=redis 連線到同一個 Redis（預設使用 bench/redis_standin.py）。
+結束後累計週數的總和必須等於已產生月份的總週數，next_roommate_index 必須與依序輪流的結果相符。
+
+python -m bench.scaleout_test --replicas 4 --months 48
+python -m bench.scaleout_test --redis redis://127.0.0.1:6379/15
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+
+from bench.redis_standin import RedisStandIn
+from bench.webhook import ROOMMATES
+
+
+def replica(months, edits, seed):
+    from core.utils import generate_schedule, update_schedules_for_weeks
+
+    # 各自的工作目錄，就像不同機器一樣沒有共用的檔案（包括鎖檔）
+    os.chdir(tempfile.mkdtemp(prefix='tottmigo-replica-'))
+    rng = random.Random(seed)
+    roommates = ROOMMATES.split(',')
+    # 每台機器以不同順序產生同一批月份，同一個月份會有多台同時嘗試
+    for year, month in rng.sample(months, len(months)):
+        generate_schedule(year, month)
+    for _ in range(edits):
+        year, month = rng.choice(months)
+        update_schedules_for_weeks(year, month, {1: rng.choice(roommates)})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--replicas', type=int, default=4)
+    parser.add_argument('--months', type=int, default=24)
+    parser.add_argument('--edits', type=int, default=50)
+    parser.add_argument('--redis', help='使用現有的 Redis（會寫入 --prefix 底下的 key）')
+    parser.add_argument('--prefix', default=f'tottmigo-scaleout-{os.getpid()}')
+    args = parser.parse_args()
+
+    standin = None
+    url = args.redis
+    if url is None:
+        standin = RedisStandIn().start()
+        url = standin.url
+    # 子程序在匯入 config 時讀取這些設定
+    os.environ.update({
+        'STORAGE_BACKEND': 'redis', 'REDIS_URL': url, 'REDIS_PREFIX': args.prefix, 'ROOMMATES': ROOMMATES,
+    })
+
+    from core.db import load_config, load_schedules
+    from core.utils import add_months
+
+    months = [add_months(2030, 1, i) for i in range(args.months)]
+    context = multiprocessing.get_context('spawn')
+    processes = [
+        context.Process(target=replica, args=(months, args.edits, seed)) for seed in range(args.replicas)
+    ]
+    started = time.perf_counter()
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    elapsed = time.perf_counter() - started
+
+    config = load_config()
+    schedules = load_schedules()
+    total_weeks = sum(len(entry['schedules']) for entry in schedules.values())
+    assigned = {}
+    for entry in schedules.values():
+        for schedule in entry['schedules']:
+            assigned[schedule['roommate']] = assigned.get(schedule['roommate'], 0) + 1
+    counts = {name: count for name, count in config['duty_counts'].items() if count}
+
+    print(f"{args.replicas} 台 × ({args.months} 個月 + {args.edits} 次修改)：{elapsed:.2f} 秒")
+    print(f"月份 {len(schedules)}/{len(months)}  總週數 {total_weeks}  累計週數 {sum(counts.values())}")
+    if standin is not None:
+        print(f"Redis 指令數 {standin.commands}")
+    ok = (
+        all(process.exitcode == 0 for process in processes)
+        and len(schedules) == len(months)
+        and counts == assigned
+        and config['next_roommate_index'] == total_weeks % len(ROOMMATES.split(','))
+    )
+    print("一致" if ok else f"不一致！累計 {counts}，實際 {assigned}，next_roommate_index {config['next_roommate_index']}")
+    raise SystemExit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+"""比較 Flask（app.py）與 ASGI（asgi.py）入口的吞吐量與 p99 延遲
+
+python -m bench.server_bench --requests 500 --concurrency 20 --api-latency 0.05
+"""
+import argparse
+import asyncio
+
+from bench.webhook import MockLineApi, Server, percentile, post_webhooks, text_event_body
+
+
+def run(script, api, args):
+    server = Server(script, api.endpoint).start()
+    try:
+        # 先產生本月排程，量測的是穩定狀態的查詢
+        asyncio.run(post_webhooks(server.url, [text_event_body(args.command)], 1))
+        bodies = [text_event_body(args.command) for _ in range(args.requests)]
+        rps, latencies, failures = asyncio.run(post_webhooks(server.url, bodies, args.concurrency))
+    finally:
+        server.stop()
+    print(f"{script:10} {rps:9.1f} req/s  p50 {percentile(latencies, 50) * 1000:7.1f} ms"
+          f"  p99 {percentile(latencies, 99) * 1000:7.1f} ms  失敗 {failures}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--api-latency', type=float, default=0.05, help='模擬 LINE API 每次呼叫的延遲（秒）')
+    parser.add_argument('--command', default='查看本月排程')
+    args = parser.parse_args()
+
+    api = MockLineApi(latency=args.api_latency).start()
+    for script in ('app.py', 'asgi.py'):
+        run(script, api, args)
+    print(f"LINE API 共收到 {api.requests} 次呼叫")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""冷啟動量測：從啟動程序到第一則回覆送到 LINE API 的時間（time-to-first-response）
+
+模擬 Fly 機器閒置停止後被第一個 webhook 喚醒：每一輪都重新啟動程序，
+一啟動就不斷嘗試送出 webhook，分別記錄開始接受連線、/callback 回應、回覆送達 LINE API 的時間。
+
+python -m bench.startup_bench --runs 5
+"""
+import argparse
+import http.client
+import subprocess
+import sys
+import time
+
+from bench.webhook import MockLineApi, Server, percentile, sign, text_event_body
+
+
+def post_when_ready(port, body, deadline):
+    """連線被拒就立刻重試，回傳 (可連線的時間, 收到回應的時間, HTTP 狀態)"""
+    while time.perf_counter() < deadline:
+        connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        try:
+            connection.connect()
+        except OSError:
+            time.sleep(0.005)
+            continue
+        connected = time.perf_counter()
+        connection.request('POST', '/callback', body=body.encode('utf-8'), headers={
+            'X-Line-Signature': sign(body), 'Content-Type': 'application/json',
+        })
+        status = connection.getresponse().status
+        connection.close()
+        return connected, time.perf_counter(), status
+    raise RuntimeError('伺服器沒有啟動')
+
+def cold_start(server, api, command):
+    body = text_event_body(command)
+    replies = api.requests
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, server.script], cwd=server.workdir, env=server.env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        connected, responded, status = post_when_ready(server.port, body, started + 60)
+        while api.requests == replies and time.perf_counter() < started + 60:
+            time.sleep(0.001)
+        replied = time.perf_counter()
+    finally:
+        process.terminate()
+        process.wait(10)
+    return connected - started, responded - started, replied - started, status
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--command', default='查看本月排程')
+    parser.add_argument('--scripts', nargs='+', default=['app.py', 'asgi.py'])
+    args = parser.parse_args()
+
+    api = MockLineApi().start()
+    for script in args.scripts:
+        for fast_start in ('0', '1'):
+            server = Server(script, api.endpoint, {'FAST_START': fast_start})
+            # 第一次啟動產生資料檔（與快照），之後每一輪都是有既有資料的冷啟動
+            cold_start(server, api, args.command)
+            results = [cold_start(server, api, args.command) for _ in range(args.runs)]
+            accept, respond, reply = ([r[i] for r in results] for i in range(3))
+            print(f"{script:8} FAST_START={fast_start}  可連線 p50 {percentile(accept, 50) * 1000:6.0f} ms"
+                  f"  回應 p50 {percentile(respond, 50) * 1000:6.0f} ms"
+                  f"  回覆送達 p50 {percentile(reply, 50) * 1000:6.0f} ms"
+                  f"  max {max(reply) * 1000:6.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
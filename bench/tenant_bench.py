@@ -0,0 +1,54 @@
+"""多租戶負載測試：租戶數量增加時，每則訊息的延遲應維持平穩
+
+python -m bench.tenant_bench --tenants 10 100 1000 --messages 2000 --backend sqlite
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+from datetime import date
+
+from bench.webhook import percentile
+
+
+def run(backend_name, tenant_counts, messages, cache_size):
+    from core import db
+    from core.commands import handle_text
+    from core.utils import set_roommates
+
+    today = date.today()
+    commands = ['查看本月排程', '查看本月排程', '查看未來排程', '更改本月排程']
+    for count in tenant_counts:
+        os.chdir(tempfile.mkdtemp(prefix='tottmigo-tenants-'))
+        backend = db.BACKENDS[backend_name]()
+        db.set_backend(db.CachedBackend(backend, max_tenants=cache_size))
+        tenants = [f'C{i:032x}' for i in range(count)]
+        for i, tenant_id in enumerate(tenants):
+            set_roommates([f'室友{i}-{n}' for n in range(4)], tenant_id)
+
+        latencies = []
+        for _ in range(messages):
+            tenant_id = random.choice(tenants)
+            started = time.perf_counter()
+            handle_text(random.choice(commands), today, tenant_id)
+            latencies.append(time.perf_counter() - started)
+
+        stats = db.cache_stats()
+        print(f"{backend_name:6} 租戶 {count:6d}  p50 {percentile(latencies, 50) * 1000:6.2f} ms"
+              f"  p99 {percentile(latencies, 99) * 1000:6.2f} ms"
+              f"  快取命中 {stats['hits']}/{stats['hits'] + stats['misses']}  常駐租戶 {stats['tenants']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--tenants', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--backend', choices=['json', 'sqlite'], default='sqlite')
+    parser.add_argument('--cache-size', type=int, default=256)
+    args = parser.parse_args()
+    run(args.backend, args.tenants, args.messages, args.cache_size)
+
+
+if __name__ == "__main__":
+    main()
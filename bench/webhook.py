@@ -0,0 +1,173 @@
+"""壓測共用工具：產生帶正確簽章的 webhook、模擬 LINE API、啟動待測伺服器"""
+import asyncio
+import base64
+import hashlib
+import hmac
+import itertools
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CHANNEL_SECRET = 'bench-secret'
+ROOMMATES = '室友A,室友B,室友C,室友D'
+
+_event_ids = itertools.count()
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def sign(body, secret=CHANNEL_SECRET):
+    digest = hmac.new(secret.encode('utf-8'), body.encode('utf-8'), hashlib.sha256).digest()
+    return base64.b64encode(digest).decode('utf-8')
+
+def text_event_body(text, group_id=None):
+    """產生一則文字訊息的 webhook 內容，每次都有不同的事件 ID 與 reply token"""
+    n = next(_event_ids)
+    source = {'type': 'user', 'userId': 'Ubench'}
+    if group_id is not None:
+        source = {'type': 'group', 'groupId': group_id, 'userId': 'Ubench'}
+    return json.dumps({
+        'destination': 'Ubot',
+        'events': [{
+            'type': 'message',
+            'mode': 'active',
+            'timestamp': int(time.time() * 1000),
+            'source': source,
+            'webhookEventId': f'bench-{os.getpid()}-{n}',
+            'deliveryContext': {'isRedelivery': False},
+            'replyToken': f'reply-{n}',
+            'message': {'id': str(n), 'type': 'text', 'quoteToken': f'q{n}', 'text': text},
+        }],
+    }, ensure_ascii=False)
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+
+class MockLineApi:
+    """在背景執行緒跑的假 LINE Messaging API，所有請求都回 200 並計數"""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.port = free_port()
+        self.requests = 0
+        self._ready = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    @property
+    def endpoint(self):
+        return f'http://127.0.0.1:{self.port}'
+
+    def start(self):
+        self._thread.start()
+        self._ready.wait()
+        return self
+
+    def _run(self):
+        from aiohttp import web
+
+        async def handle(request):
+            await request.read()
+            self.requests += 1
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            return web.json_response({'sentMessages': []})
+
+        async def main():
+            web_app = web.Application()
+            web_app.router.add_route('*', '/{tail:.*}', handle)
+            runner = web.AppRunner(web_app)
+            await runner.setup()
+            await web.TCPSite(runner, '127.0.0.1', self.port).start()
+            self._ready.set()
+            await asyncio.Event().wait()
+
+        asyncio.run(main())
+
+
+class Server:
+    """以子程序啟動 app.py 或 asgi.py，資料檔放在暫存目錄"""
+
+    def __init__(self, script, line_endpoint, env=None):
+        self.port = free_port()
+        self.workdir = tempfile.mkdtemp(prefix='tottmigo-bench-')
+        self.env = dict(os.environ)
+        self.env.update({
+            'PORT': str(self.port),
+            'PYTHONPATH': ROOT,
+            'LINE_CHANNEL_SECRET': CHANNEL_SECRET,
+            'LINE_CHANNEL_ACCESS_TOKEN': 'bench-token',
+            'LINE_API_ENDPOINT': line_endpoint,
+            'ROOMMATES': ROOMMATES,
+            # 基準測試的訊息都來自同一個使用者，關閉 token bucket 限流（可用 --env 覆寫）
+            'RATE_LIMIT_GROUP_RATE': '0',
+            'RATE_LIMIT_USER_RATE': '0',
+        })
+        self.env.update(env or {})
+        self.script = os.path.join(ROOT, script)
+        self.process = None
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.port}'
+
+    def start(self, timeout=30):
+        self.process = subprocess.Popen(
+            [sys.executable, self.script], cwd=self.workdir, env=self.env,
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                with socket.create_connection(('127.0.0.1', self.port), timeout=0.1):
+                    return self
+            except OSError:
+                time.sleep(0.02)
+        self.stop()
+        raise RuntimeError(f'{self.script} 沒有在 {timeout} 秒內啟動')
+
+    def stop(self):
+        if self.process is not None:
+            self.process.terminate()
+            self.process.wait(10)
+            self.process = None
+
+
+async def post_webhooks(url, bodies, concurrency):
+    """以固定並行數送出所有 webhook，回傳 (每秒請求數, 各請求延遲秒數, 非 200 數量)"""
+    import aiohttp
+
+    latencies = []
+    failures = 0
+    pending = iter(bodies)
+
+    async def worker(session):
+        nonlocal failures
+        for body in pending:
+            started = time.perf_counter()
+            async with session.post(url + '/callback', data=body.encode('utf-8'),
+                                    headers={'X-Line-Signature': sign(body),
+                                             'Content-Type': 'application/json'}) as response:
+                await response.read()
+                if response.status != 200:
+                    failures += 1
+            latencies.append(time.perf_counter() - started)
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(session) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+    return len(latencies) / elapsed, latencies, failures
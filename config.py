@@ -6,5 +6,95 @@ load_dotenv()
 # LINE Bot 設定
 LINE_CHANNEL_ACCESS_TOKEN = os.getenv('LINE_CHANNEL_ACCESS_TOKEN')
 LINE_CHANNEL_SECRET = os.getenv('LINE_CHANNEL_SECRET')
+LINE_API_ENDPOINT = os.getenv('LINE_API_ENDPOINT', 'https://api.line.me')
+LINE_API_POOL_SIZE = int(os.getenv('LINE_API_POOL_SIZE', '100'))
+LINE_API_CONNECT_TIMEOUT = float(os.getenv('LINE_API_CONNECT_TIMEOUT', '3.05'))
+LINE_API_READ_TIMEOUT = float(os.getenv('LINE_API_READ_TIMEOUT', '10'))
+LINE_API_MAX_RETRIES = int(os.getenv('LINE_API_MAX_RETRIES', '3'))
 # 室友設定
-ROOMMATES = os.getenv('ROOMMATES', '').split(',')
\ No newline at end of file
+ROOMMATES = os.getenv('ROOMMATES', '').split(',')
+# 排班方式：rotation（依序輪流，預設）或 balanced（自動產生的月份優先排給累計輪值週數較少的室友）
+SCHEDULE_MODE = os.getenv('SCHEDULE_MODE', 'rotation')
+# 儲存設定：json（預設）、sqlite、journal（只追加的事件日誌，可查修改紀錄與復原）、redis（多台機器共用）
+# 或 binary（設定仍為 JSON，排程存成精簡的二進位檔 BINARY_SCHEDULES_FILE）
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'json')
+SQLITE_PATH = os.getenv('SQLITE_PATH', 'roommate.db')
+BINARY_SCHEDULES_FILE = os.getenv('BINARY_SCHEDULES_FILE', 'roommate_schedules.bin')
+STORAGE_CACHE = os.getenv('STORAGE_CACHE', '1') == '1'
+# 歷史保留：HISTORY_HOT_MONTHS > 0 時主要儲存只保留最近這麼多個月，更早的月份移到 ARCHIVE_DIR 下各年度的壓縮封存檔
+# 預設 0 為全部保留。封存檔在本機檔案系統，STORAGE_BACKEND=redis 時不適用；已封存月份的修改無法再以 journal 復原
+HISTORY_HOT_MONTHS = int(os.getenv('HISTORY_HOT_MONTHS', '0'))
+ARCHIVE_DIR = os.getenv('ARCHIVE_DIR', 'archive')
+ARCHIVE_CACHE_SIZE = int(os.getenv('ARCHIVE_CACHE_SIZE', '16'))
+LOCK_FILE = os.getenv('LOCK_FILE', 'roommate.lock')
+JOURNAL_FILE = os.getenv('JOURNAL_FILE', 'roommate_journal.jsonl')
+JOURNAL_BASE_FILE = os.getenv('JOURNAL_BASE_FILE', 'roommate_journal_base.json')
+JOURNAL_COMPACT_EVERY = int(os.getenv('JOURNAL_COMPACT_EVERY', '1000'))
+JOURNAL_KEEP = int(os.getenv('JOURNAL_KEEP', '100'))
+# 多台機器共用狀態：STORAGE_BACKEND=redis 時連線到 REDIS_URL（redis://[:密碼@]主機:埠/資料庫編號）
+REDIS_URL = os.getenv('REDIS_URL', '')
+REDIS_PREFIX = os.getenv('REDIS_PREFIX', 'tottmigo')
+REDIS_TIMEOUT = float(os.getenv('REDIS_TIMEOUT', '5'))
+
+# Webhook 非同步處理：1 時 /callback 驗證簽章後立即回應，事件交給背景執行緒處理
+WEBHOOK_ASYNC = os.getenv('WEBHOOK_ASYNC', '0') == '1'
+WEBHOOK_WORKERS = int(os.getenv('WEBHOOK_WORKERS', '4'))
+WEBHOOK_QUEUE_SIZE = int(os.getenv('WEBHOOK_QUEUE_SIZE', '100'))
+WEBHOOK_ENQUEUE_TIMEOUT = float(os.getenv('WEBHOOK_ENQUEUE_TIMEOUT', '0.5'))
+
+# 流量控制：每個群組／聊天室與每個使用者各自的 token bucket（每秒補充 RATE 個、最多累積 BURST 個，RATE 為 0 則不限制）
+# 同時處理的指令最多 MAX_CONCURRENT_COMMANDS 個（0 為不限制），等待 ADMISSION_WAIT 秒仍沒有空位就回覆忙碌中
+RATE_LIMIT_GROUP_RATE = float(os.getenv('RATE_LIMIT_GROUP_RATE', '1'))
+RATE_LIMIT_GROUP_BURST = float(os.getenv('RATE_LIMIT_GROUP_BURST', '10'))
+RATE_LIMIT_USER_RATE = float(os.getenv('RATE_LIMIT_USER_RATE', '0.5'))
+RATE_LIMIT_USER_BURST = float(os.getenv('RATE_LIMIT_USER_BURST', '5'))
+MAX_CONCURRENT_COMMANDS = int(os.getenv('MAX_CONCURRENT_COMMANDS', '8'))
+ADMISSION_WAIT = float(os.getenv('ADMISSION_WAIT', '0.5'))
+
+# 週次索引預先計算的年份範圍（範圍外仍可查詢，只是改為即時計算）
+CALENDAR_START_YEAR = int(os.getenv('CALENDAR_START_YEAR', '2020'))
+CALENDAR_END_YEAR = int(os.getenv('CALENDAR_END_YEAR', '2060'))
+
+# 多租戶：開啟後每個 LINE 群組／聊天室各自有名單與排程；TENANT_CACHE_SIZE 為記憶體中最多保留的租戶數
+MULTI_TENANT = os.getenv('MULTI_TENANT', '0') == '1'
+TENANT_DIR = os.getenv('TENANT_DIR', 'tenants')
+TENANT_CACHE_SIZE = int(os.getenv('TENANT_CACHE_SIZE', '256'))
+
+# 預先序列化的排程 Flex Message 快取最多保留的月份數
+FLEX_CACHE_SIZE = int(os.getenv('FLEX_CACHE_SIZE', '1024'))
+
+# webhook 事件去重：記住處理過的事件 DEDUP_TTL 秒；DEDUP_PATH 設定 SQLite 檔案時重新啟動後仍有效，設定 redis:// 網址時多台機器共用
+DEDUP_TTL = float(os.getenv('DEDUP_TTL', '3600'))
+DEDUP_CACHE_SIZE = int(os.getenv('DEDUP_CACHE_SIZE', '10000'))
+DEDUP_PATH = os.getenv('DEDUP_PATH', '')
+
+# 每週輪值提醒：每週一 REMINDER_HOUR 點（REMINDER_TIMEZONE 時區）推播本週輪到誰
+# 未開啟多租戶時，預設租戶的提醒推播給 REMINDER_DEFAULT_TO（群組 ID 或使用者 ID）
+# 注意：Fly 機器閒置時會自動停止，啟用提醒請在 fly.toml 設定 min_machines_running = 1
+REMINDER_ENABLED = os.getenv('REMINDER_ENABLED', '0') == '1'
+REMINDER_TIMEZONE = os.getenv('REMINDER_TIMEZONE', 'Asia/Taipei')
+REMINDER_HOUR = int(os.getenv('REMINDER_HOUR', '9'))
+REMINDER_DEFAULT_TO = os.getenv('REMINDER_DEFAULT_TO', '')
+REMINDER_BATCH_SIZE = int(os.getenv('REMINDER_BATCH_SIZE', '500'))
+
+# 月份排程預先產生：每個月最後 ROLLOVER_DAYS 天在背景產生接下來 ROLLOVER_MONTHS 個月，每 ROLLOVER_INTERVAL 秒檢查一次
+ROLLOVER_ENABLED = os.getenv('ROLLOVER_ENABLED', '0') == '1'
+ROLLOVER_DAYS = int(os.getenv('ROLLOVER_DAYS', '3'))
+ROLLOVER_MONTHS = int(os.getenv('ROLLOVER_MONTHS', '1'))
+ROLLOVER_INTERVAL = float(os.getenv('ROLLOVER_INTERVAL', '3600'))
+ROLLOVER_TIMEZONE = os.getenv('ROLLOVER_TIMEZONE', REMINDER_TIMEZONE)
+
+# 排程匯出（/export/schedule.ics、/export/schedule.csv）與 CSV 匯入（/import/schedule.csv）需要帶上的 token，留空則不開放
+EXPORT_TOKEN = os.getenv('EXPORT_TOKEN', '')
+
+# 冷啟動最佳化：1 時 LINE SDK 等較重的模組在背景預先載入，並以快照還原儲存快取（SNAPSHOT_FILE 留空則不使用快照）
+FAST_START = os.getenv('FAST_START', '0') == '1'
+SNAPSHOT_FILE = os.getenv('SNAPSHOT_FILE', 'state.snapshot')
+
+# 請求追蹤：超過 TRACE_SLOW_MS 毫秒的請求輸出 slow_request 日誌（含各階段耗時），其餘依 TRACE_SAMPLE_RATE（0~1）抽樣輸出
+TRACE_SLOW_MS = float(os.getenv('TRACE_SLOW_MS', '500'))
+TRACE_SAMPLE_RATE = float(os.getenv('TRACE_SAMPLE_RATE', '0'))
+TRACE_MAX_SPANS = int(os.getenv('TRACE_MAX_SPANS', '200'))
+
+# 取樣式效能分析（/debug/profile?token=...&seconds=5）需要帶上的 token，留空則不開放
+PROFILE_TOKEN = os.getenv('PROFILE_TOKEN', '')
@@ -0,0 +1,138 @@
+"""流量控制：在指令處理之前擋下洗版與過載
+
+- 不是指令的訊息在入口就用 router.match 判斷後略過，不做去重、不讀儲存
+- 每個群組／聊天室與每個使用者各自一個 token bucket（每秒補充 RATE 個、最多累積 BURST 個）
+- 同時處理的指令數有上限，等待 ADMISSION_WAIT 秒仍沒有空位就放棄處理（load shedding）
+
+bucket 的狀態是 dict 中的 [剩餘 tokens, 上次更新時間]。補滿的 bucket 與不存在等價，
+定期清掉，記憶體只與最近活躍的群組與使用者數量有關。
+"""
+import threading
+import time
+
+from .metrics import Counter, register_collector
+from config import (
+    RATE_LIMIT_GROUP_RATE, RATE_LIMIT_GROUP_BURST, RATE_LIMIT_USER_RATE, RATE_LIMIT_USER_BURST,
+    MAX_CONCURRENT_COMMANDS, ADMISSION_WAIT,
+)
+
+
+REJECTED = Counter('tottmigo_rejected_messages_total', '被流量控制擋下的訊息數', ['reason'])
+BUSY_TEXT = "⏳ 目前訊息較多，請稍後再試一次"
+
+
+class TokenBuckets:
+    # 每隔這麼多秒清一次已補滿的 bucket
+    EVICT_INTERVAL = 60
+
+    def __init__(self, rate, burst, max_keys=100000, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self.clock = clock
+        self._buckets = {}  # key -> [tokens, updated]
+        self._lock = threading.Lock()
+        self._next_evict = clock() + self.EVICT_INTERVAL
+
+    def allow(self, key, cost=1):
+        """key 還有足夠的 tokens 就扣掉並回傳 True；rate 為 0 時不限制"""
+        if self.rate <= 0 or not key:
+            return True
+        now = self.clock()
+        with self._lock:
+            if now >= self._next_evict:
+                self._evict(now)
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                if len(self._buckets) >= self.max_keys:
+                    self._evict(now)
+                    if len(self._buckets) >= self.max_keys:
+                        # 仍然太多時丟掉最早建立的，被丟掉的 key 下次會以滿的 bucket 重新開始
+                        del self._buckets[next(iter(self._buckets))]
+                bucket = self._buckets[key] = [self.burst, now]
+            else:
+                bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+            if bucket[0] < cost:
+                return False
+            bucket[0] -= cost
+            return True
+
+    def _evict(self, now):
+        full = [
+            key for key, (tokens, updated) in self._buckets.items()
+            if tokens + (now - updated) * self.rate >= self.burst
+        ]
+        for key in full:
+            del self._buckets[key]
+        self._next_evict = now + self.EVICT_INTERVAL
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class AdmissionControl:
+    def __init__(self, group_buckets, user_buckets, max_concurrent, wait):
+        self.groups = group_buckets
+        self.users = user_buckets
+        self.max_concurrent = max_concurrent
+        self.wait = wait
+        self.in_flight = 0
+        self._slots = threading.BoundedSemaphore(max_concurrent) if max_concurrent > 0 else None
+        self._count_lock = threading.Lock()
+
+    def allow(self, source):
+        """依訊息來源的群組與使用者扣 tokens，超過限制時回傳 False"""
+        # 先檢查使用者，洗版的人不會耗掉整個群組的額度
+        if not self.users.allow(getattr(source, 'user_id', None)):
+            REJECTED.labels('user').inc()
+            return False
+        group_id = getattr(source, 'group_id', None) or getattr(source, 'room_id', None)
+        if not self.groups.allow(group_id):
+            REJECTED.labels('group').inc()
+            return False
+        return True
+
+    def acquire(self, blocking=True):
+        """取得一個處理名額；blocking 為 False 時不等待（給事件迴圈使用）"""
+        if self._slots is not None:
+            acquired = self._slots.acquire(timeout=self.wait) if blocking else self._slots.acquire(blocking=False)
+            if not acquired:
+                REJECTED.labels('overload').inc()
+                return False
+        with self._count_lock:
+            self.in_flight += 1
+        return True
+
+    def release(self):
+        with self._count_lock:
+            self.in_flight -= 1
+        if self._slots is not None:
+            self._slots.release()
+
+
+_admission = None
+
+def get_admission():
+    global _admission
+    if _admission is None:
+        _admission = AdmissionControl(
+            TokenBuckets(RATE_LIMIT_GROUP_RATE, RATE_LIMIT_GROUP_BURST),
+            TokenBuckets(RATE_LIMIT_USER_RATE, RATE_LIMIT_USER_BURST),
+            MAX_CONCURRENT_COMMANDS,
+            ADMISSION_WAIT,
+        )
+    return _admission
+
+def _collect_admission():
+    if _admission is None:
+        return []
+    return [
+        ('tottmigo_commands_in_flight', 'gauge', '目前正在處理的指令數', [({}, _admission.in_flight)]),
+        ('tottmigo_rate_limit_buckets', 'gauge', '記憶體中的 token bucket 數', [
+            ({'scope': 'group'}, len(_admission.groups)),
+            ({'scope': 'user'}, len(_admission.users)),
+        ]),
+    ]
+
+register_collector(_collect_admission)
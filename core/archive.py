@@ -0,0 +1,176 @@
+"""歷史月份的分層儲存（HISTORY_HOT_MONTHS > 0 時啟用）
+
+主要儲存只保留最近 HISTORY_HOT_MONTHS 個月（含本月）與之後的月份，
+更早的月份由 archive_old_months 移到每個年度一個的壓縮封存檔：
+
+    {租戶目錄}/{ARCHIVE_DIR}/2023.json.gz    {"2023-1": {...}, "2023-2": {...}, ...}
+
+讀取某個月份時先查主要儲存，沒有才去讀該年度的封存檔（第一次用到時才載入，
+記憶體中最多保留 ARCHIVE_CACHE_SIZE 個年度），因此主要儲存的大小與每次讀取的成本
+不會隨著 bot 執行的時間增加。
+"""
+from collections import OrderedDict
+import copy
+import gzip
+import json
+import os
+import threading
+
+from .db import (
+    DEFAULT_TENANT, _atomic_write_bytes, _fsync_dir, get_backend, list_tenants, month_key, tenant_path, transaction,
+)
+from .utils import _load_duty_counts, add_months
+from config import HISTORY_HOT_MONTHS, ARCHIVE_DIR, ARCHIVE_CACHE_SIZE
+
+
+def archive_path(tenant_id, year):
+    directory = os.path.join(os.path.dirname(tenant_path(tenant_id, 'archive')), ARCHIVE_DIR)
+    return os.path.join(directory, f'{year}.json.gz')
+
+
+class ArchiveStore:
+    """各年度封存檔的讀寫，載入過的年度依檔案 mtime 快取在記憶體（LRU）"""
+
+    def __init__(self, max_years=ARCHIVE_CACHE_SIZE):
+        self.max_years = max_years
+        self.loads = 0
+        self._years = OrderedDict()  # (tenant_id, year) -> (mtime_ns, {month_key: entry})
+        self._lock = threading.Lock()
+
+    def load_year(self, tenant_id, year):
+        """該年度封存的所有月份，沒有封存檔時回傳空 dict"""
+        path = archive_path(tenant_id, year)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            return {}
+        key = (tenant_id, year)
+        with self._lock:
+            cached = self._years.get(key)
+            if cached is not None and cached[0] == mtime:
+                self._years.move_to_end(key)
+                return cached[1]
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            months = json.load(f)
+        with self._lock:
+            self.loads += 1
+            self._years[key] = (mtime, months)
+            while len(self._years) > self.max_years:
+                self._years.popitem(last=False)
+        return months
+
+    def load_month(self, tenant_id, year, month):
+        return self.load_year(tenant_id, year).get(month_key(year, month))
+
+    def years(self, tenant_id):
+        directory = os.path.dirname(archive_path(tenant_id, 0))
+        if not os.path.isdir(directory):
+            return []
+        return sorted(int(name[:-len('.json.gz')]) for name in os.listdir(directory)
+                      if name.endswith('.json.gz') and name[:-len('.json.gz')].isdigit())
+
+    def add(self, tenant_id, year, entries):
+        """把 entries（{month_key: entry}）併入該年度的封存檔"""
+        months = dict(self.load_year(tenant_id, year))
+        months.update(entries)
+        path = archive_path(tenant_id, year)
+        data = json.dumps(months, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        _fsync_dir(_atomic_write_bytes(path, gzip.compress(data, mtime=0)))
+
+
+_store = ArchiveStore()
+
+
+class ArchivedBackend:
+    """包在儲存後端外層：主要儲存沒有的月份，改從封存檔讀取"""
+
+    def __init__(self, backend, store=_store):
+        self.backend = backend
+        self.store = store
+
+    def load_month(self, tenant_id, year, month):
+        entry = self.backend.load_month(tenant_id, year, month)
+        if entry is None:
+            entry = copy.deepcopy(self.store.load_month(tenant_id, year, month))
+        return entry
+
+    def load_config(self, tenant_id):
+        return self.backend.load_config(tenant_id)
+
+    def save_config(self, tenant_id, config):
+        self.backend.save_config(tenant_id, config)
+
+    def load_schedules(self, tenant_id):
+        """只有主要儲存中的月份；需要完整歷史時另外以 archived_schedules 逐年讀取"""
+        return self.backend.load_schedules(tenant_id)
+
+    def save_schedules(self, tenant_id, schedules):
+        return self.backend.save_schedules(tenant_id, schedules)
+
+    def save_month(self, tenant_id, year, month, entry):
+        self.backend.save_month(tenant_id, year, month, entry)
+
+    def apply(self, tenant_id, config, months, events=(), **options):
+        return self.backend.apply(tenant_id, config, months, events, **options)
+
+    def version(self, tenant_id):
+        return self.backend.version(tenant_id)
+
+    def list_tenants(self):
+        return self.backend.list_tenants()
+
+
+def archiving_enabled():
+    """目前的儲存後端是否包著 ArchivedBackend（讀取時會查封存檔）"""
+    backend = get_backend()
+    while backend is not None:
+        if isinstance(backend, ArchivedBackend):
+            return True
+        backend = getattr(backend, 'backend', None)
+    return False
+
+def archived_schedules(tenant_id=DEFAULT_TENANT):
+    """依年度順序逐年產生 (year, {month_key: entry})，一次只載入一個年度"""
+    for year in _store.years(tenant_id):
+        yield year, _store.load_year(tenant_id, year)
+
+def hot_cutoff(today, keep=HISTORY_HOT_MONTHS):
+    """主要儲存要保留的最早月份：含本月在內的最近 keep 個月"""
+    return add_months(today.year, today.month, -(keep - 1))
+
+def archive_old_months(today, tenant_id=DEFAULT_TENANT, keep=HISTORY_HOT_MONTHS):
+    """把早於保留範圍的月份移到封存檔，回傳移動的月份數
+
+    先寫入封存檔再從主要儲存刪除：中途失敗時月份只會同時存在兩邊（讀取以主要儲存為準），不會遺失。
+    """
+    if not archiving_enabled():
+        # 讀取不會查封存檔，移走的月份會讀不到
+        raise RuntimeError("儲存後端沒有啟用封存（HISTORY_HOT_MONTHS 為 0 或不適用的後端）")
+    cutoff = hot_cutoff(today, keep)
+    with transaction(tenant_id) as tx:
+        config = tx.load_config()
+        if 'duty_counts' not in config:
+            # 累計週數需要掃描完整歷史，移走之前先建立
+            _load_duty_counts(tx, config)
+            tx.save_config(config)
+        by_year = {}
+        for key, entry in tx.load_schedules().items():
+            year, month = (int(part) for part in key.split('-'))
+            if (year, month) < cutoff:
+                by_year.setdefault(year, {})[key] = entry
+        for year, entries in sorted(by_year.items()):
+            _store.add(tenant_id, year, entries)
+            for key in entries:
+                tx.save_month(*(int(part) for part in key.split('-')), None)
+    return sum(len(entries) for entries in by_year.values())
+
+def archive_all(today, keep=HISTORY_HOT_MONTHS):
+    """對所有租戶執行 archive_old_months，回傳移動的月份數"""
+    return sum(archive_old_months(today, tenant_id, keep) for tenant_id in list_tenants())
+
+
+if __name__ == "__main__":
+    from datetime import date
+
+    count = archive_all(date.today())
+    print(f"已封存 {count} 個月份的排程")
@@ -0,0 +1,120 @@
+"""預先計算的週次索引
+
+排程規則：一週從星期一開始，週一落在哪個月就屬於哪個月（包含跨到下個月的最後一週，
+不包含從上個月開始的第一週）。因此每個月的週次就是該月所有的星期一。
+
+索引以兩個 array 儲存：
+- _mondays：範圍內每個星期一的 ordinal，依序排列
+- _offsets：第 i 個月份（從起始年 1 月算起）的第一個星期一在 _mondays 中的位置，
+  長度為月份數 + 1，同時也是「到該月為止累計的週數」的前綴和
+"""
+from array import array
+from datetime import date, timedelta
+from functools import lru_cache
+
+from config import CALENDAR_START_YEAR, CALENDAR_END_YEAR
+
+
+class CalendarIndex:
+    def __init__(self, start_year, end_year):
+        self.start_year = start_year
+        self.end_year = end_year
+        first = date(start_year, 1, 1)
+        # 範圍內第一個星期一
+        self.first_monday = first.toordinal() + (7 - first.weekday()) % 7
+        last = date(end_year, 12, 31).toordinal()
+
+        self._mondays = array('l', range(self.first_monday, last + 1, 7))
+        self._offsets = array('l')
+        i = 0
+        for year in range(start_year, end_year + 1):
+            for month in range(1, 13):
+                self._offsets.append(i)
+                month_end = _month_end(year, month).toordinal()
+                while i < len(self._mondays) and self._mondays[i] <= month_end:
+                    i += 1
+        self._offsets.append(i)
+
+    def contains(self, year):
+        return self.start_year <= year <= self.end_year
+
+    def month_position(self, year, month):
+        return (year - self.start_year) * 12 + month - 1
+
+    def weeks_before(self, year, month):
+        """從起始年 1 月到 (year, month) 之前累計的週數（前綴和）"""
+        return self._offsets[self.month_position(year, month)]
+
+    def week_starts(self, year, month):
+        """該月每週星期一的 ordinal"""
+        i = self.month_position(year, month)
+        return self._mondays[self._offsets[i]:self._offsets[i + 1]]
+
+
+def _month_end(year, month):
+    if month == 12:
+        return date(year, 12, 31)
+    return date(year, month + 1, 1) - timedelta(days=1)
+
+def _week_starts_uncached(year, month):
+    first = date(year, month, 1)
+    monday = first.toordinal() + (7 - first.weekday()) % 7
+    return array('l', range(monday, _month_end(year, month).toordinal() + 1, 7))
+
+
+_index = None
+
+def get_index():
+    global _index
+    if _index is None:
+        _index = CalendarIndex(CALENDAR_START_YEAR, CALENDAR_END_YEAR)
+    return _index
+
+@lru_cache(maxsize=256)
+def weeks_of_month(year, month):
+    """該月的週次，每週為 (星期一 ordinal, 星期日 ordinal)"""
+    index = get_index()
+    if index.contains(year):
+        starts = index.week_starts(year, month)
+    else:
+        starts = _week_starts_uncached(year, month)
+    return tuple((start, start + 6) for start in starts)
+
+@lru_cache(maxsize=256)
+def week_ranges(year, month):
+    """該月每週的起訖日期字串，例如 ('2025/06/02', '2025/06/08')"""
+    return tuple((format_ordinal(start), format_ordinal(end)) for start, end in weeks_of_month(year, month))
+
+@lru_cache(maxsize=4096)
+def format_ordinal(ordinal):
+    return date.fromordinal(ordinal).strftime('%Y/%m/%d')
+
+@lru_cache(maxsize=4096)
+def parse_date(text):
+    """format_ordinal 的反向：'2025/06/02' 轉成 ordinal，不是這個格式時丟出 ValueError"""
+    # 年份 1000 以上、補零的 ASCII 數字才與 format_ordinal 的輸出一致
+    if not (len(text) == 10 and text[4] == text[7] == '/' and text.isascii() and text[0] != '0'
+            and text[:4].isdigit() and text[5:7].isdigit() and text[8:].isdigit()):
+        raise ValueError(f"無效的日期：{text!r}")
+    return date(int(text[:4]), int(text[5:7]), int(text[8:])).toordinal()
+
+@lru_cache(maxsize=64)
+def week_containing(day):
+    """包含 day 的排程週 (year, month, week_num)
+
+    該週的星期一決定所屬月份，而星期一是當月第幾個星期一就是第幾週。
+    """
+    monday = day - timedelta(days=day.weekday())
+    return monday.year, monday.month, (monday.day - 1) // 7 + 1
+
+def weeks_between(from_year, from_month, to_year, to_month):
+    """從 (from_year, from_month) 月初到 (to_year, to_month) 月初之間的週數，可為負數"""
+    index = get_index()
+    if index.contains(from_year) and index.contains(to_year):
+        return index.weeks_before(to_year, to_month) - index.weeks_before(from_year, from_month)
+    # 範圍外以星期一數量計算：兩個月初之間的星期一個數
+    return _mondays_before(to_year, to_month) - _mondays_before(from_year, from_month)
+
+def _mondays_before(year, month):
+    """西元 1 年 1 月 1 日（星期一）起到 (year, month) 月初之前的星期一個數"""
+    return (date(year, month, 1).toordinal() - 1 + 6) // 7
@@ -0,0 +1,318 @@
+from datetime import datetime
+from functools import lru_cache
+import re
+
+from linebot.models import TextSendMessage
+
+from .ui import create_main_menu, create_roommate_selection, schedule_flex_payload
+from .db import DEFAULT_TENANT, load_config, transaction
+from .journal import journal_backend
+from .metrics import COMMANDS
+from .rollover import month_schedule, next_month_starter
+from .tracing import annotate
+from .utils import (
+    add_months, duty_statistics, get_future_schedule, get_roommates,
+    set_next_roommate_index, set_roommates, update_schedules_for_weeks,
+)
+from config import MULTI_TENANT, SCHEDULE_MODE
+
+
+class CommandRouter:
+    """以表格註冊指令：完整比對用 dict 查詢，前綴比對依前綴長度各查一次 dict
+
+    已註冊的前綴長度種類是固定的少數幾個，因此不論指令多少，派送都是 O(1)。
+    separated=True 的前綴後面必須接空白（或什麼都不接），避免一般訊息剛好以指令開頭時被當成指令。
+    """
+
+    def __init__(self):
+        self._exact = {}
+        self._prefixes = {}
+        self._prefix_lengths = []
+
+    def exact(self, *names):
+        def decorator(func):
+            for name in names:
+                self._exact[name] = func
+            return func
+        return decorator
+
+    def prefix(self, name, separated=False):
+        def decorator(func):
+            self._prefixes[name] = (func, separated)
+            self._prefix_lengths = sorted({len(p) for p in self._prefixes}, reverse=True)
+            return func
+        return decorator
+
+    def match(self, text):
+        """回傳 (處理函式, 指令後面的參數)，不是指令時回傳 None"""
+        func = self._exact.get(text)
+        if func is not None:
+            return func, ''
+        for length in self._prefix_lengths:
+            entry = self._prefixes.get(text[:length])
+            if entry is not None:
+                func, separated = entry
+                argument = text[length:]
+                if separated and argument and not argument[0].isspace():
+                    continue
+                return func, argument
+        return None
+
+
+router = CommandRouter()
+
+MAX_FUTURE_MONTHS = 120
+
+# 「!更改排程」每一行的格式：週數 室友名稱
+_EDIT_LINE = re.compile(r'^\s*(\d{1,2})\s+(\S+)\s*$')
+
+@lru_cache(maxsize=256)
+def roster_index(roommates):
+    """室友名稱 -> 索引 的雜湊表，同一份名單只建立一次"""
+    return {name: i for i, name in enumerate(roommates)}
+
+def parse_bulk_edit(body, roster, week_count):
+    """解析「!更改排程」的內容，回傳 (week_roommate_map, 錯誤訊息列表)
+
+    會檢查每一行，把所有錯誤一次回報，而不是遇到第一個錯誤就停止。
+    """
+    week_roommate_map = {}
+    errors = []
+    for line_no, line in enumerate(body.split("\n"), 1):
+        if not line.strip():
+            continue
+        matched = _EDIT_LINE.match(line)
+        if matched is None:
+            errors.append(f"第{line_no}行「{line.strip()}」格式錯誤，應為「週數 室友名稱」")
+            continue
+        week_num = int(matched.group(1))
+        roommate_name = matched.group(2)
+        if not 1 <= week_num <= week_count:
+            errors.append(f"第{line_no}行：本月沒有第{week_num}週")
+        elif roommate_name not in roster:
+            errors.append(f"第{line_no}行：無效的室友名稱：{roommate_name}")
+        else:
+            week_roommate_map[week_num] = roommate_name
+    return week_roommate_map, errors
+
+# 使用者可以用「復原」撤銷的修改（自動產生排程與提醒紀錄不算）
+UNDOABLE_EVENTS = {'weeks_reassigned', 'next_roommate_set', 'roommates_set', 'imported'}
+HISTORY_LIMIT = 10
+
+def describe_event(event):
+    """修改紀錄中一個事件的說明文字"""
+    kind = event['kind']
+    if kind == 'generated':
+        return f"產生 {event['year']}年{event['month']}月排程"
+    if kind == 'weeks_reassigned':
+        changes = '、'.join(f"第{week}週 {old}→{new}" for week, old, new in event['changes'])
+        return f"更改 {event['year']}年{event['month']}月排程：{changes}"
+    if kind == 'next_roommate_set':
+        return f"設定下個室友為 {event['roommate']}"
+    if kind == 'roommates_set':
+        return f"設定室友名單：{', '.join(event['roommates'])}"
+    if kind == 'imported':
+        return f"匯入 {'、'.join(event['months'])} 排程（變更 {event['weeks']} 週）"
+    if kind == 'reminded':
+        return f"發送 {event['week']} 當週提醒"
+    if kind == 'undo':
+        return f"復原 #{event['seq']}"
+    return kind
+
+def parse_future_month(argument, today):
+    """解析「查看未來排程」後面的參數：空白為下個月、數字為幾個月後、或 YYYY/M"""
+    if not argument:
+        return add_months(today.year, today.month, 1)
+    try:
+        if '/' in argument or '-' in argument:
+            year, month = (int(part) for part in argument.replace('-', '/').split('/'))
+        else:
+            year, month = add_months(today.year, today.month, int(argument))
+    except ValueError:
+        return None
+    months_ahead = (year - today.year) * 12 + month - today.month
+    if not 1 <= month <= 12 or not 0 <= months_ahead <= MAX_FUTURE_MONTHS:
+        return None
+    return year, month
+
+def tenant_id_of(source):
+    """訊息來源對應的租戶：群組、聊天室或一對一聊天的使用者各自獨立
+
+    未開啟 MULTI_TENANT 時所有訊息共用預設租戶（原本單一家庭的資料）。
+    """
+    if not MULTI_TENANT or source is None:
+        return DEFAULT_TENANT
+    return (
+        getattr(source, 'group_id', None)
+        or getattr(source, 'room_id', None)
+        or getattr(source, 'user_id', None)
+        or DEFAULT_TENANT
+    )
+
+def handle_text(text, today, tenant_id=DEFAULT_TENANT):
+    """依照使用者輸入的文字處理指令，回傳要回覆的訊息列表（不需回覆時回傳 None）
+
+    Flask（app.py）與 ASGI（asgi.py）兩個入口共用這份指令處理邏輯；
+    tenant_id 決定讀寫哪一個群組的名單與排程。
+    """
+    matched = router.match(text)
+    if matched is None:
+        return None
+    func, argument = matched
+    command = func.__name__.lstrip('_')
+    COMMANDS.labels(command).inc()
+    annotate(command=command, tenant=tenant_id)
+    return func(argument, today, tenant_id)
+
+
+@router.exact("倒垃圾咪狗", "主選單")
+def _main_menu(argument, today, tenant_id):
+    reply_text = "🏠 室友輪值排程系統\n\n請選擇功能："
+    return [TextSendMessage(text=reply_text, quick_reply=create_main_menu())]
+
+@router.exact("查看本月排程")
+def _show_this_month(argument, today, tenant_id):
+    schedules, config = month_schedule(today.year, today.month, tenant_id)
+
+    if isinstance(schedules, str):  # 錯誤訊息
+        return [TextSendMessage(text=schedules, quick_reply=create_main_menu())]
+
+    next_roommate = next_month_starter(today.year, today.month, config, tenant_id)
+    flex_msg = schedule_flex_payload(schedules, today.year, today.month, today, tenant_id)
+    status_msg = TextSendMessage(
+        text=f"✅ 排程已更新！\n下個月將從 {next_roommate} 開始",
+        quick_reply=create_main_menu()
+    )
+    return [flex_msg, status_msg]
+
+@router.prefix("查看未來排程")
+def _show_future_month(argument, today, tenant_id):
+    target = parse_future_month(argument.strip(), today)
+    if target is None:
+        return [TextSendMessage(
+            text="❌ 格式錯誤，請輸入「查看未來排程」、「查看未來排程 3」（3 個月後）或「查看未來排程 2026/3」",
+            quick_reply=create_main_menu()
+        )]
+
+    year, month = target
+    schedules, projected = get_future_schedule(year, month, today, tenant_id)
+    flex_msg = schedule_flex_payload(schedules, year, month, today, tenant_id)
+    note = "🔮 以上為依目前輪值推算的排程，實際排程會在該月產生時確定" if projected else "以上為已產生的排程"
+    return [flex_msg, TextSendMessage(text=note, quick_reply=create_main_menu())]
+
+@router.exact("設定下個室友")
+def _choose_next_roommate(argument, today, tenant_id):
+    roommates = get_roommates(load_config(tenant_id))
+    return [TextSendMessage(text="請選擇下一個輪到的室友：", quick_reply=create_roommate_selection(roommates))]
+
+@router.prefix("設定室友", separated=True)
+def _set_roommates(argument, today, tenant_id):
+    names = argument.replace("，", ",").replace(",", " ").split()
+    try:
+        set_roommates(names, tenant_id)
+    except ValueError as e:
+        return [TextSendMessage(text=f"❌ {e}\n格式範例：設定室友 思妤 怡彣 小明", quick_reply=create_main_menu())]
+    return [TextSendMessage(text=f"✅ 已設定室友名單：{', '.join(names)}", quick_reply=create_main_menu())]
+
+@router.prefix("選擇室友")
+def _select_roommate(argument, today, tenant_id):
+    roommate_index = int(argument)
+    selected_roommate = set_next_roommate_index(roommate_index, tenant_id)
+
+    return [TextSendMessage(
+        text=f"✅ 已設定下一個輪到的室友為：{selected_roommate}",
+        quick_reply=create_main_menu()
+    )]
+
+@router.exact("統計")
+def _show_statistics(argument, today, tenant_id):
+    roommates, counts = duty_statistics(tenant_id)
+    average = sum(counts.get(name, 0) for name in roommates) / len(roommates)
+    lines = [
+        f"{name}：{counts.get(name, 0)} 週（{counts.get(name, 0) - average:+.1f}）"
+        for name in roommates
+    ]
+    former = [f"{name} {weeks} 週" for name, weeks in counts.items() if name not in roommates and weeks]
+    if former:
+        lines.append(f"已不在名單：{'、'.join(former)}")
+    mode = "平衡模式（優先排給週數較少的室友）" if SCHEDULE_MODE == 'balanced' else "依序輪流"
+    return [TextSendMessage(
+        text=f"📊 累計輪值週數（與平均 {average:.1f} 週的差距）：\n" + "\n".join(lines) + f"\n\n排班方式：{mode}",
+        quick_reply=create_main_menu()
+    )]
+
+@router.exact("修改紀錄")
+def _show_history(argument, today, tenant_id):
+    journal = journal_backend()
+    if journal is None:
+        return [TextSendMessage(text="目前的儲存方式不保留修改紀錄（需要 STORAGE_BACKEND=journal）")]
+    lines = []
+    for record in journal.history(tenant_id, HISTORY_LIMIT):
+        when = datetime.fromtimestamp(record['ts']).strftime('%m/%d %H:%M')
+        description = '；'.join(describe_event(event) for event in record['events']) or '資料更新'
+        lines.append(f"#{record['seq']} {when} {description}")
+    if not lines:
+        return [TextSendMessage(text="還沒有任何修改紀錄", quick_reply=create_main_menu())]
+    return [TextSendMessage(text="📜 最近的修改紀錄：\n" + "\n".join(lines), quick_reply=create_main_menu())]
+
+@router.exact("復原")
+def _undo(argument, today, tenant_id):
+    journal = journal_backend()
+    if journal is None:
+        return [TextSendMessage(text="目前的儲存方式不支援復原（需要 STORAGE_BACKEND=journal）")]
+    try:
+        with transaction(tenant_id):
+            record = journal.undo(tenant_id, UNDOABLE_EVENTS)
+    except ValueError as e:
+        return [TextSendMessage(text=f"❌ {e}", quick_reply=create_main_menu())]
+    if record is None:
+        return [TextSendMessage(text="沒有可以復原的修改", quick_reply=create_main_menu())]
+    description = '；'.join(describe_event(event) for event in record['events'])
+    return [TextSendMessage(text=f"↩️ 已復原 #{record['seq']}：{description}", quick_reply=create_main_menu())]
+
+@router.exact("更改本月排程")
+def _edit_hint(argument, today, tenant_id):
+    schedules, config = month_schedule(today.year, today.month, tenant_id)
+
+    if isinstance(schedules, str):  # 錯誤訊息
+        return [TextSendMessage(text=schedules, quick_reply=create_main_menu())]
+
+    hint_msg = TextSendMessage(
+        text=(
+            "請輸入新的排程格式\n"
+            "每一行代表一週的排程，格式為「週數 室友名稱」\n"
+            "格式範例：\n"
+            "!更改排程\n"
+            "1 思妤\n"
+            "3 怡彣\n"
+            f"可用室友名稱：{', '.join(get_roommates(config))}"
+        ),
+    )
+    flex_msg = schedule_flex_payload(schedules, today.year, today.month, today, tenant_id)
+    return [flex_msg, hint_msg]
+
+@router.prefix("!更改排程")
+def _bulk_edit(argument, today, tenant_id):
+    # 處理排程更改
+    schedules, config = month_schedule(today.year, today.month, tenant_id)
+
+    if isinstance(schedules, str):  # 錯誤訊息
+        return [TextSendMessage(text=schedules, quick_reply=create_main_menu())]
+
+    roommates = get_roommates(config)
+    next_roommate = next_month_starter(today.year, today.month, config, tenant_id)
+
+    # 第一行是指令本身，排程從第二行開始
+    body = argument.split("\n", 1)[1] if "\n" in argument else ""
+    week_roommate_map, errors = parse_bulk_edit(body, roster_index(tuple(roommates)), len(schedules))
+    if errors:
+        return [TextSendMessage(text="❌ 排程未更新，請修正以下錯誤：\n" + "\n".join(errors))]
+
+    schedules = update_schedules_for_weeks(today.year, today.month, week_roommate_map, tenant_id)
+
+    flex_msg = schedule_flex_payload(schedules, today.year, today.month, today, tenant_id)
+    status_msg = TextSendMessage(
+        text=f"✅ 排程已更新！\n下個月將從 {next_roommate} 開始",
+        quick_reply=create_main_menu()
+    )
+    return [flex_msg, status_msg]
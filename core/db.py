@@ -1,53 +1,764 @@
+import copy
+import fcntl
 import json
+import marshal
 import os
+import random
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import wraps
+
+from .metrics import Counter, register_collector, stage
+from config import (
+    STORAGE_BACKEND, SQLITE_PATH, STORAGE_CACHE, LOCK_FILE, TENANT_DIR, TENANT_CACHE_SIZE, HISTORY_HOT_MONTHS,
+)
 
 
 CONFIG_FILE = 'roommate_config.json'
 SCHEDULES_FILE = 'roommate_schedules.json'
+# 預設租戶沿用原本單一家庭的檔案；其他租戶（LINE 群組／聊天室）各自一個目錄
+DEFAULT_TENANT = ''
 
-def load_config():
-    """載入設定檔"""
-    default_config = {
+_TENANT_ID = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+
+_LOAD = stage('storage_load')
+_SAVE = stage('storage_save')
+
+def _default_config():
+    return {
         'next_roommate_index': 0,
         'last_updated_month': None,
         'last_updated_year': None
     }
-    
-    if os.path.exists(CONFIG_FILE):
-        try:
-            with open(CONFIG_FILE, 'r', encoding='utf-8') as f:
-                config = json.load(f)
-                for key in default_config:
-                    if key not in config:
-                        config[key] = default_config[key]
-                return config
-        except:
-            pass
-    
-    return default_config
-
-def save_config(config):
-    """儲存設定檔"""
+
+def _fill_defaults(config):
+    default_config = _default_config()
+    for key in default_config:
+        if key not in config:
+            config[key] = default_config[key]
+    return config
+
+def month_key(year, month):
+    """排程的月份鍵值，例如 2025-6"""
+    return f"{year}-{month}"
+
+def tenant_path(tenant_id, filename):
+    """租戶的檔案路徑：預設租戶在工作目錄，其他租戶在 TENANT_DIR/<tenant_id>/ 下
+
+    只計算路徑，不建立目錄（讀取不需要）；目錄在第一次寫入時才建立。
+    """
+    if tenant_id == DEFAULT_TENANT:
+        return filename
+    if not _TENANT_ID.match(tenant_id):
+        raise ValueError(f"無效的租戶 ID：{tenant_id!r}")
+    return os.path.join(TENANT_DIR, tenant_id, os.path.basename(filename))
+
+
+class StorageError(Exception):
+    """儲存檔損毀或無法讀取"""
+
+
+class ConflictError(StorageError):
+    """樂觀並行控制：交易寫回時發現資料已被其他程序（或其他機器）修改"""
+
+
+def _fsync_dir(directory):
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def _atomic_write_bytes(path, data):
+    """先寫入同目錄的暫存檔並 fsync，再以 rename 取代原檔，不會留下寫一半的檔案；回傳所在目錄"""
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix=f".{os.path.basename(path)}.", suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+    return directory
+
+def _atomic_write_json(path, data):
+    return _atomic_write_bytes(path, json.dumps(data, ensure_ascii=False, indent=2).encode('utf-8'))
+
+def _read_json(path, default):
+    if not os.path.exists(path):
+        return default
     try:
-        with open(CONFIG_FILE, 'w', encoding='utf-8') as f:
-            json.dump(config, f, ensure_ascii=False, indent=2)
-    except Exception as e:
-        print(f"警告：無法儲存設定檔: {e}")
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except ValueError as e:
+        # 檔案損毀時不可當作空資料，否則下一次寫入會蓋掉所有歷史
+        raise StorageError(f"無法解析 {path}: {e}")
+
+
+class JsonBackend:
+    """以 JSON 檔儲存（原本的格式），每個租戶各自一組檔案，讀寫時處理該租戶的整個檔案"""
+
+    def __init__(self, config_file=CONFIG_FILE, schedules_file=SCHEDULES_FILE):
+        self.config_file = config_file
+        self.schedules_file = schedules_file
+
+    def _config_path(self, tenant_id):
+        return tenant_path(tenant_id, self.config_file)
+
+    def _schedules_path(self, tenant_id):
+        return tenant_path(tenant_id, self.schedules_file)
+
+    def load_config(self, tenant_id):
+        return _fill_defaults(_read_json(self._config_path(tenant_id), _default_config()))
+
+    def save_config(self, tenant_id, config):
+        self.apply(tenant_id, config, {})
+
+    def load_schedules(self, tenant_id):
+        return _read_json(self._schedules_path(tenant_id), {})
+
+    def save_schedules(self, tenant_id, schedules):
+        _fsync_dir(_atomic_write_json(self._schedules_path(tenant_id), schedules))
+
+    def load_month(self, tenant_id, year, month):
+        return self.load_schedules(tenant_id).get(month_key(year, month))
+
+    def save_month(self, tenant_id, year, month, entry):
+        self.apply(tenant_id, None, {(year, month): entry})
+
+    def apply(self, tenant_id, config, months, events=()):
+        """一次寫入設定與多個月份（值為 None 的月份會被刪除），所有檔案寫完後才對目錄做一次 fsync"""
+        directories = set()
+        if config is not None:
+            directories.add(_atomic_write_json(self._config_path(tenant_id), config))
+        if months:
+            schedules = self.load_schedules(tenant_id)
+            for (year, month), entry in months.items():
+                if entry is None:
+                    schedules.pop(month_key(year, month), None)
+                else:
+                    schedules[month_key(year, month)] = entry
+            directories.add(_atomic_write_json(self._schedules_path(tenant_id), schedules))
+        for directory in directories:
+            _fsync_dir(directory)
+
+    def version(self, tenant_id):
+        """以兩個檔案的 mtime 與大小作為版本，檔案被外部改寫時即失效"""
+        token = []
+        for path in (self._config_path(tenant_id), self._schedules_path(tenant_id)):
+            try:
+                st = os.stat(path)
+                token.append((st.st_mtime_ns, st.st_size))
+            except OSError:
+                token.append(None)
+        return tuple(token)
+
+    def list_tenants(self):
+        tenants = []
+        if os.path.exists(self.config_file) or os.path.exists(self.schedules_file):
+            tenants.append(DEFAULT_TENANT)
+        if os.path.isdir(TENANT_DIR):
+            tenants.extend(sorted(
+                name for name in os.listdir(TENANT_DIR)
+                if _TENANT_ID.match(name) and os.path.isdir(os.path.join(TENANT_DIR, name))
+            ))
+        return tenants
+
+
+class SqliteBackend:
+    """以 SQLite（WAL 模式）儲存，排程依 (group, year, month) 一列一個月份
+
+    讀寫單一月份只動到一列，成本與歷史長度、租戶數量無關。
+    """
+
+    def __init__(self, path=SQLITE_PATH):
+        self.path = path
+        self._local = threading.local()
+        self._init_schema()
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def _init_schema(self):
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS config ('
+                ' group_id TEXT PRIMARY KEY,'
+                ' data TEXT NOT NULL,'
+                ' version INTEGER NOT NULL DEFAULT 0)'
+            )
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS schedules ('
+                ' group_id TEXT NOT NULL,'
+                ' year INTEGER NOT NULL,'
+                ' month INTEGER NOT NULL,'
+                ' data TEXT NOT NULL,'
+                ' PRIMARY KEY (group_id, year, month))'
+            )
+            columns = [row[1] for row in conn.execute('PRAGMA table_info(config)')]
+            if 'version' not in columns:
+                # 舊版資料庫的版本計數器是全域的，改為每個租戶各自一個
+                conn.execute('ALTER TABLE config ADD COLUMN version INTEGER NOT NULL DEFAULT 0')
+
+    def _bump_version(self, conn, tenant_id):
+        # 租戶的版本計數器放在 config 列上，還沒有設定時先建立預設設定
+        conn.execute(
+            'INSERT INTO config (group_id, data, version) VALUES (?, ?, 1) '
+            'ON CONFLICT(group_id) DO UPDATE SET version = version + 1',
+            (tenant_id, json.dumps(_default_config()))
+        )
+
+    def version(self, tenant_id):
+        """該租戶每次寫入都會遞增的版本計數器"""
+        row = self._connect().execute(
+            'SELECT version FROM config WHERE group_id = ?', (tenant_id,)
+        ).fetchone()
+        return row[0] if row else 0
+
+    def load_config(self, tenant_id):
+        row = self._connect().execute(
+            'SELECT data FROM config WHERE group_id = ?', (tenant_id,)
+        ).fetchone()
+        if row is None:
+            return _default_config()
+        return _fill_defaults(json.loads(row[0]))
+
+    def save_config(self, tenant_id, config):
+        self.apply(tenant_id, config, {})
+
+    def load_schedules(self, tenant_id):
+        rows = self._connect().execute(
+            'SELECT year, month, data FROM schedules WHERE group_id = ? ORDER BY year, month',
+            (tenant_id,)
+        )
+        return {month_key(year, month): json.loads(data) for year, month, data in rows}
+
+    def save_schedules(self, tenant_id, schedules):
+        conn = self._connect()
+        with conn:
+            conn.execute('DELETE FROM schedules WHERE group_id = ?', (tenant_id,))
+            for key, entry in schedules.items():
+                year, month = (int(part) for part in key.split('-'))
+                self._upsert_month(conn, tenant_id, year, month, entry)
+            self._bump_version(conn, tenant_id)
+
+    def load_month(self, tenant_id, year, month):
+        row = self._connect().execute(
+            'SELECT data FROM schedules WHERE group_id = ? AND year = ? AND month = ?',
+            (tenant_id, year, month)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save_month(self, tenant_id, year, month, entry):
+        self.apply(tenant_id, None, {(year, month): entry})
+
+    def apply(self, tenant_id, config, months, events=()):
+        """在同一個 SQLite 交易中寫入設定與多個月份（值為 None 的月份會被刪除）"""
+        conn = self._connect()
+        with conn:
+            self._bump_version(conn, tenant_id)
+            if config is not None:
+                conn.execute(
+                    'UPDATE config SET data = ? WHERE group_id = ?',
+                    (json.dumps(config, ensure_ascii=False), tenant_id)
+                )
+            for (year, month), entry in months.items():
+                if entry is None:
+                    conn.execute(
+                        'DELETE FROM schedules WHERE group_id = ? AND year = ? AND month = ?',
+                        (tenant_id, year, month)
+                    )
+                else:
+                    self._upsert_month(conn, tenant_id, year, month, entry)
+
+    def _upsert_month(self, conn, tenant_id, year, month, entry):
+        conn.execute(
+            'INSERT INTO schedules (group_id, year, month, data) VALUES (?, ?, ?, ?) '
+            'ON CONFLICT(group_id, year, month) DO UPDATE SET data = excluded.data',
+            (tenant_id, year, month, json.dumps(entry, ensure_ascii=False))
+        )
+
+    def list_tenants(self):
+        rows = self._connect().execute(
+            'SELECT group_id FROM config UNION SELECT group_id FROM schedules ORDER BY 1'
+        )
+        return [row[0] for row in rows]
+
+
+class _TenantCache:
+    __slots__ = ('token', 'config', 'schedules', 'months')
+
+    def __init__(self, token):
+        self.token = token
+        self.config = None
+        self.schedules = None
+        self.months = {}
+
+
+class CachedBackend:
+    """在記憶體中快取設定與各月份排程的寫穿式（write-through）快取
+
+    每次讀取前比對該租戶在後端的版本（檔案 mtime 或版本計數器），
+    被其他程序改寫時該租戶的快取失效；自己的寫入會同時更新快取。
+    只保留最近使用的 max_tenants 個租戶，不活躍的群組不會一直佔用記憶體。
+    """
+
+    def __init__(self, backend, max_tenants=TENANT_CACHE_SIZE):
+        self.backend = backend
+        self.max_tenants = max_tenants
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._tenants = OrderedDict()
+
+    def _entry(self, tenant_id):
+        """取得租戶的快取（版本不符時重建），並移到 LRU 的最新端"""
+        token = self.backend.version(tenant_id)
+        entry = self._tenants.get(tenant_id)
+        if entry is None or entry.token != token:
+            entry = _TenantCache(token)
+            self._tenants[tenant_id] = entry
+        self._tenants.move_to_end(tenant_id)
+        while len(self._tenants) > self.max_tenants:
+            self._tenants.popitem(last=False)
+            self.evictions += 1
+        return entry
+
+    def _write(self, tenant_id, write):
+        """寫入後端並更新快取的版本；寫入前已驗證過版本，其餘快取內容仍然有效
+
+        後端回傳這次寫入產生的版本時直接使用。共用狀態的後端沒有回傳版本時不能事後再讀：
+        寫入與讀取版本之間其他機器可能已經寫入，過期的快取會被當成最新，因此改為捨棄該租戶的快取。
+        """
+        entry = self._entry(tenant_id)
+        version = write()
+        if version is not None:
+            entry.token = version
+        elif self.optimistic:
+            self._tenants.pop(tenant_id, None)
+            return _TenantCache(None)
+        else:
+            entry.token = self.backend.version(tenant_id)
+        return entry
+
+    def _hit(self, value):
+        self.hits += 1
+        return copy.deepcopy(value)
+
+    def load_config(self, tenant_id):
+        with self._lock:
+            entry = self._entry(tenant_id)
+            if entry.config is not None:
+                return self._hit(entry.config)
+            self.misses += 1
+            entry.config = self.backend.load_config(tenant_id)
+            return copy.deepcopy(entry.config)
 
-def load_schedules():
+    def save_config(self, tenant_id, config):
+        self.apply(tenant_id, config, {})
+
+    def load_schedules(self, tenant_id):
+        with self._lock:
+            entry = self._entry(tenant_id)
+            if entry.schedules is not None:
+                return self._hit(entry.schedules)
+            self.misses += 1
+            entry.schedules = self.backend.load_schedules(tenant_id)
+            return copy.deepcopy(entry.schedules)
+
+    def save_schedules(self, tenant_id, schedules):
+        with self._lock:
+            entry = self._write(tenant_id, lambda: self.backend.save_schedules(tenant_id, schedules))
+            entry.schedules = copy.deepcopy(schedules)
+            entry.months = {}
+
+    def load_month(self, tenant_id, year, month):
+        key = month_key(year, month)
+        with self._lock:
+            entry = self._entry(tenant_id)
+            if key in entry.months:
+                return self._hit(entry.months[key])
+            if entry.schedules is not None and key in entry.schedules:
+                return self._hit(entry.schedules[key])
+            # 不在 schedules 中的月份仍要問後端一次（可能在封存檔中），結果記在 months
+            self.misses += 1
+            value = self.backend.load_month(tenant_id, year, month)
+            entry.months[key] = value
+            return copy.deepcopy(value)
+
+    def save_month(self, tenant_id, year, month, entry):
+        self.apply(tenant_id, None, {(year, month): entry})
+
+    def apply(self, tenant_id, config, months, events=(), **options):
+        with self._lock:
+            entry = self._write(tenant_id, lambda: self.backend.apply(tenant_id, config, months, events, **options))
+            if config is not None:
+                entry.config = copy.deepcopy(config)
+            for (year, month), value in months.items():
+                key = month_key(year, month)
+                if value is None:
+                    # 刪除的月份不記成 None：後端（例如封存）可能還有資料，下次讀取時再問後端
+                    entry.months.pop(key, None)
+                    if entry.schedules is not None:
+                        entry.schedules.pop(key, None)
+                    continue
+                entry.months[key] = copy.deepcopy(value)
+                if entry.schedules is not None:
+                    entry.schedules[key] = copy.deepcopy(value)
+
+    def version(self, tenant_id):
+        return self.backend.version(tenant_id)
+
+    @property
+    def optimistic(self):
+        return getattr(self.backend, 'optimistic', False)
+
+    def list_tenants(self):
+        return self.backend.list_tenants()
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'tenants': len(self._tenants),
+            'evictions': self.evictions,
+        }
+
+    def snapshot(self):
+        """快取內容，只包含內建型別，可直接以 marshal 序列化"""
+        with self._lock:
+            return {
+                tenant_id: (entry.token, entry.config, entry.schedules, entry.months)
+                for tenant_id, entry in self._tenants.items()
+            }
+
+    def restore(self, data):
+        """載入快照，回傳載入的租戶數
+
+        已在快取中的租戶不覆蓋；快照中的版本與後端不符時，第一次讀取就會自然失效重建。
+        """
+        count = 0
+        with self._lock:
+            # 快照依 LRU 順序排列；從最新的開始插到最前面，保持原本的先後順序
+            for tenant_id, (token, config, schedules, months) in reversed(list(data.items())):
+                if tenant_id in self._tenants:
+                    continue
+                entry = _TenantCache(token)
+                entry.config = config
+                entry.schedules = schedules
+                entry.months = months
+                self._tenants[tenant_id] = entry
+                self._tenants.move_to_end(tenant_id, last=False)
+                count += 1
+            while len(self._tenants) > self.max_tenants:
+                self._tenants.popitem(last=False)
+        return count
+
+
+def _journal_backend(*args, **kwargs):
+    # 日誌後端（core/journal.py）會用到這個模組的工具函式，使用時才載入以避免循環匯入
+    from .journal import JournalBackend
+    return JournalBackend(*args, **kwargs)
+
+def _redis_backend(*args, **kwargs):
+    from .redis_store import RedisBackend
+    return RedisBackend(*args, **kwargs)
+
+def _binary_backend(*args, **kwargs):
+    from .model import BinaryBackend
+    return BinaryBackend(*args, **kwargs)
+
+BACKENDS = {
+    'json': JsonBackend,
+    'sqlite': SqliteBackend,
+    'journal': _journal_backend,
+    'redis': _redis_backend,
+    'binary': _binary_backend,
+}
+
+_backend = None
+
+def get_backend():
+    """取得目前使用的儲存後端（依 STORAGE_BACKEND 設定）"""
+    global _backend
+    if _backend is None:
+        if STORAGE_BACKEND not in BACKENDS:
+            raise ValueError(f"未知的儲存後端：{STORAGE_BACKEND}")
+        _backend = BACKENDS[STORAGE_BACKEND]()
+        if HISTORY_HOT_MONTHS and not getattr(_backend, 'optimistic', False):
+            # 歷史月份分層：超出保留範圍的月份移到各年度的壓縮封存檔（共用狀態的後端不適用）
+            from .archive import ArchivedBackend
+            _backend = ArchivedBackend(_backend)
+        if STORAGE_CACHE:
+            _backend = CachedBackend(_backend)
+    return _backend
+
+def set_backend(backend):
+    """替換儲存後端"""
+    global _backend
+    _backend = backend
+
+def load_config(tenant_id=DEFAULT_TENANT):
+    """載入設定檔"""
+    with _LOAD.time():
+        return get_backend().load_config(tenant_id)
+
+def save_config(config, tenant_id=DEFAULT_TENANT):
+    """儲存設定檔"""
+    with _SAVE.time():
+        get_backend().save_config(tenant_id, config)
+
+def load_schedules(tenant_id=DEFAULT_TENANT):
     """載入所有月份的排程"""
-    if os.path.exists(SCHEDULES_FILE):
-        try:
-            with open(SCHEDULES_FILE, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except Exception as e:
-            print(f"警告：無法載入排程檔: {e}")
-    return {}
-
-def save_schedules(schedules):
+    with _LOAD.time():
+        return get_backend().load_schedules(tenant_id)
+
+def save_schedules(schedules, tenant_id=DEFAULT_TENANT):
     """儲存所有月份的排程"""
+    with _SAVE.time():
+        get_backend().save_schedules(tenant_id, schedules)
+
+def load_month_schedule(year, month, tenant_id=DEFAULT_TENANT):
+    """載入單一月份的排程，不存在時回傳 None"""
+    with _LOAD.time():
+        return get_backend().load_month(tenant_id, year, month)
+
+def save_month_schedule(year, month, entry, tenant_id=DEFAULT_TENANT):
+    """儲存單一月份的排程"""
+    with _SAVE.time():
+        get_backend().save_month(tenant_id, year, month, entry)
+
+def list_tenants():
+    """所有有資料的租戶"""
+    return get_backend().list_tenants()
+
+
+class Transaction:
+    """讀改寫交易：讀取會快取在交易內，寫入先暫存，結束時一次寫回後端
+
+    expected_version 不是 None 時（共用狀態的後端），寫回時由後端確認版本沒變，否則丟出 ConflictError。
+    """
+
+    def __init__(self, backend, tenant_id, expected_version=None):
+        self.backend = backend
+        self.tenant_id = tenant_id
+        self.expected_version = expected_version
+        self._config = None
+        self._config_dirty = False
+        self._months = {}
+        self._dirty_months = set()
+        self._events = []
+
+    def log(self, kind, **details):
+        """記錄這次交易做了什麼（日誌後端會寫入修改紀錄，其他後端忽略）"""
+        self._events.append({'kind': kind, **details})
+
+    def load_config(self):
+        if self._config is None:
+            with _LOAD.time():
+                self._config = self.backend.load_config(self.tenant_id)
+        return self._config
+
+    def save_config(self, config):
+        self._config = config
+        self._config_dirty = True
+
+    def load_month(self, year, month):
+        if (year, month) not in self._months:
+            with _LOAD.time():
+                self._months[(year, month)] = self.backend.load_month(self.tenant_id, year, month)
+        return self._months[(year, month)]
+
+    def save_month(self, year, month, entry):
+        """entry 為 None 時從儲存中刪除該月份"""
+        self._months[(year, month)] = entry
+        self._dirty_months.add((year, month))
+
+    def load_schedules(self):
+        """所有月份（含交易內尚未寫回的月份），只在需要掃描整個歷史時使用"""
+        with _LOAD.time():
+            schedules = dict(self.backend.load_schedules(self.tenant_id))
+        for (year, month), entry in self._months.items():
+            if entry is not None:
+                schedules[month_key(year, month)] = entry
+            elif (year, month) in self._dirty_months:
+                schedules.pop(month_key(year, month), None)
+        return schedules
+
+    def commit(self):
+        if not self._config_dirty and not self._dirty_months:
+            return
+        options = {}
+        if self.expected_version is not None:
+            options['expected_version'] = self.expected_version
+        with _SAVE.time():
+            self.backend.apply(
+                self.tenant_id,
+                self._config if self._config_dirty else None,
+                {key: self._months[key] for key in self._dirty_months},
+                self._events,
+                **options
+            )
+
+
+# 以固定數量的鎖分段（lock striping），租戶再多也不會增加記憶體
+_tx_locks = [threading.RLock() for _ in range(64)]
+_tx_local = threading.local()
+
+def _tx_lock(tenant_id):
+    return _tx_locks[zlib.crc32(tenant_id.encode('utf-8')) % len(_tx_locks)]
+
+def _open_lock_file(path):
     try:
-        with open(SCHEDULES_FILE, 'w', encoding='utf-8') as f:
-            json.dump(schedules, f, ensure_ascii=False, indent=2)
-    except Exception as e:
-        print(f"警告：無法儲存排程檔: {e}")
\ No newline at end of file
+        return open(path, 'a')
+    except FileNotFoundError:
+        # 租戶第一次寫入，目錄還不存在
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        return open(path, 'a')
+
+@contextmanager
+def transaction(tenant_id=DEFAULT_TENANT):
+    """取得該租戶跨執行緒（RLock）與跨程序（檔案鎖）的獨佔交易
+
+    巢狀呼叫會沿用外層交易，只有最外層結束時才寫回；發生例外則全部捨棄。
+    不同租戶使用各自的鎖檔，互不阻擋。
+    共用狀態的後端（多台機器）沒有共同的檔案鎖，改為開始時記下版本、寫回時比對（見 retry_on_conflict）。
+    """
+    active = getattr(_tx_local, 'active', None)
+    if active is None:
+        active = _tx_local.active = {}
+    current = active.get(tenant_id)
+    if current is not None:
+        yield current
+        return
+
+    backend = get_backend()
+    if getattr(backend, 'optimistic', False):
+        with _tx_lock(tenant_id):
+            tx = Transaction(backend, tenant_id, backend.version(tenant_id))
+            active[tenant_id] = tx
+            try:
+                yield tx
+                tx.commit()
+            finally:
+                del active[tenant_id]
+        return
+
+    with _tx_lock(tenant_id):
+        with _open_lock_file(tenant_path(tenant_id, LOCK_FILE)) as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            tx = Transaction(get_backend(), tenant_id)
+            active[tenant_id] = tx
+            try:
+                yield tx
+                tx.commit()
+            finally:
+                del active[tenant_id]
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+# 衝突時重新執行交易的次數上限
+TX_MAX_ATTEMPTS = 8
+
+CONFLICTS = Counter('tottmigo_storage_conflicts_total', '交易寫回時版本不符、重新執行的次數')
+
+def retry_on_conflict(func):
+    """裝飾器：交易因 ConflictError 失敗時重新執行整個函式（重新讀取最新資料再修改）
+
+    只在最外層重試；已經在交易中（巢狀呼叫）時把例外交給外層處理。
+    重試前隨機等待一小段時間，避免多台機器同時重試又再次衝突。
+    """
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        for attempt in range(1, TX_MAX_ATTEMPTS + 1):
+            try:
+                return func(*args, **kwargs)
+            except ConflictError:
+                if getattr(_tx_local, 'active', None) or attempt == TX_MAX_ATTEMPTS:
+                    raise
+                CONFLICTS.inc()
+                time.sleep(random.uniform(0, 0.005 * 2 ** attempt))
+    return wrapper
+
+# 快照格式版本；marshal 的格式與 Python 版本相關，讀取失敗時直接忽略快照
+SNAPSHOT_FORMAT = 1
+
+def save_snapshot(path):
+    """把記憶體中的快取寫成 marshal 快照，下次冷啟動時不必重新讀取與解析每個 JSON 檔
+
+    快照只是快取：寫入失敗或內容過期都不影響正確性。未啟用快取時回傳 False。
+    """
+    backend = get_backend()
+    if not isinstance(backend, CachedBackend):
+        return False
+    _atomic_write_bytes(path, marshal.dumps((SNAPSHOT_FORMAT, STORAGE_BACKEND, backend.snapshot())))
+    return True
+
+def load_snapshot(path):
+    """載入 save_snapshot 寫出的快照，回傳載入的租戶數（沒有快照或格式不符時為 0）"""
+    backend = get_backend()
+    if not isinstance(backend, CachedBackend):
+        return 0
+    try:
+        with open(path, 'rb') as f:
+            snapshot_format, backend_name, data = marshal.load(f)
+    except (OSError, EOFError, ValueError, TypeError):
+        return 0
+    if snapshot_format != SNAPSHOT_FORMAT or backend_name != STORAGE_BACKEND:
+        return 0
+    return backend.restore(data)
+
+def cache_stats():
+    """快取命中／未命中次數，未啟用快取時回傳 None"""
+    backend = get_backend()
+    if isinstance(backend, CachedBackend):
+        return backend.stats()
+    return None
+
+def _collect_cache():
+    stats = cache_stats()
+    if stats is None:
+        return []
+    return [
+        ('tottmigo_storage_cache_total', 'counter', '儲存快取查詢次數',
+         [({'result': 'hits'}, stats['hits']), ({'result': 'misses'}, stats['misses'])]),
+        ('tottmigo_storage_cache_tenants', 'gauge', '快取中的租戶數', [({}, stats['tenants'])]),
+        ('tottmigo_storage_cache_evictions_total', 'counter', '被移出快取的租戶數', [({}, stats['evictions'])]),
+    ]
+
+register_collector(_collect_cache)
+
+def migrate_json_to_sqlite(config_file=CONFIG_FILE, schedules_file=SCHEDULES_FILE, db_path=SQLITE_PATH):
+    """一次性將舊的 JSON 檔（包含所有租戶）搬移到 SQLite"""
+    source = JsonBackend(config_file, schedules_file)
+    target = SqliteBackend(db_path)
+    count = 0
+    for tenant_id in source.list_tenants():
+        target.save_config(tenant_id, source.load_config(tenant_id))
+        schedules = source.load_schedules(tenant_id)
+        target.save_schedules(tenant_id, schedules)
+        count += len(schedules)
+    return count
+
+
+if __name__ == "__main__":
+    count = migrate_json_to_sqlite()
+    print(f"已搬移 {count} 個月份的排程到 {SQLITE_PATH}")
@@ -0,0 +1,157 @@
+"""webhook 事件去重
+
+LINE 在 /callback 回應太慢時會重送同一個事件（webhookEventId 相同，
+deliveryContext.isRedelivery 為 true）。指令處理不是冪等的，重送的「!更改排程」或
+「選擇室友N」會再套用一次，因此在讀寫儲存或呼叫 API 之前先以事件 ID 與 reply token 過濾。
+
+記憶體中以 OrderedDict 當作有上限的 TTL/LRU；設定 DEDUP_PATH 時另外寫入 SQLite，
+機器重新啟動後仍能辨識重送的事件。多台機器同時服務時 DEDUP_PATH 改設 redis:// 網址，
+重送的事件送到另一台機器也能辨識。
+"""
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from .metrics import ERRORS, register_collector
+from .tracing import warn
+from config import DEDUP_TTL, DEDUP_CACHE_SIZE, DEDUP_PATH
+
+
+class EventDeduplicator:
+    # 每寫入這麼多筆就清一次 SQLite 中過期的紀錄
+    PURGE_EVERY = 1000
+
+    def __init__(self, ttl=DEDUP_TTL, maxsize=DEDUP_CACHE_SIZE, path=None, clock=time.time):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.path = path
+        self.clock = clock
+        self.duplicates = 0
+        self._seen = OrderedDict()  # key -> 到期時間，依寫入順序排列
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._writes = 0
+        self._redis = None
+        if path and path.startswith(('redis://', 'rediss://')):
+            from .redis_store import RedisBackend
+            self._redis = RedisBackend(path)
+        elif path:
+            self._init_schema()
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def _init_schema(self):
+        self._connect().execute(
+            'CREATE TABLE IF NOT EXISTS processed_events ('
+            ' key TEXT PRIMARY KEY,'
+            ' expires_at REAL NOT NULL)'
+        )
+
+    def _expire(self, now):
+        # TTL 固定，所以越前面的越早到期，遇到第一個未到期的就可以停止
+        while self._seen:
+            key, expires_at = next(iter(self._seen.items()))
+            if expires_at > now:
+                break
+            self._seen.popitem(last=False)
+
+    def _remember(self, keys, expires_at):
+        for key in keys:
+            self._seen[key] = expires_at
+            self._seen.move_to_end(key)
+        while len(self._seen) > self.maxsize:
+            self._seen.popitem(last=False)
+
+    def _claim_persistent(self, keys, now, expires_at):
+        """在 SQLite 中登記 keys；任何一個已存在且未過期就回傳 False
+
+        以 BEGIN IMMEDIATE 取得寫入鎖，多個程序同時收到同一個事件時只有一個會成功。
+        """
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            claimed = True
+            for key in keys:
+                cursor = conn.execute(
+                    'INSERT INTO processed_events (key, expires_at) VALUES (?, ?) '
+                    'ON CONFLICT(key) DO UPDATE SET expires_at = excluded.expires_at '
+                    'WHERE processed_events.expires_at <= ?',
+                    (key, expires_at, now)
+                )
+                if cursor.rowcount == 0:
+                    claimed = False
+            self._writes += 1
+            if self._writes % self.PURGE_EVERY == 0:
+                conn.execute('DELETE FROM processed_events WHERE expires_at <= ?', (now,))
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        return claimed
+
+    def seen(self, *keys):
+        """keys 中任何一個在 TTL 內出現過就回傳 True；否則登記全部 keys 並回傳 False"""
+        keys = [key for key in keys if key]
+        if not keys:
+            return False
+        now = self.clock()
+        expires_at = now + self.ttl
+        with self._lock:
+            self._expire(now)
+            duplicate = any(key in self._seen for key in keys)
+            if not duplicate and (self._redis is not None or self.path):
+                try:
+                    if self._redis is not None:
+                        duplicate = not self._redis.claim(keys, self.ttl)
+                    else:
+                        duplicate = not self._claim_persistent(keys, now, expires_at)
+                except Exception as e:
+                    # 持久儲存被鎖住或連不上：只以記憶體去重、照常處理，
+                    # 否則 /callback 回應 500，LINE 會一直重送同一個事件而使用者收不到回覆
+                    ERRORS.labels('dedup').inc()
+                    warn("事件去重的儲存無法使用，照常處理事件", e)
+            self._remember(keys, expires_at)
+            if duplicate:
+                self.duplicates += 1
+        return duplicate
+
+    def stats(self):
+        return {'tracked': len(self._seen), 'duplicates': self.duplicates}
+
+
+def event_keys(event):
+    """事件的去重 key：webhookEventId 與 reply token（加上前綴避免互相碰撞）"""
+    event_id = getattr(event, 'webhook_event_id', None)
+    reply_token = getattr(event, 'reply_token', None)
+    return (
+        f'e:{event_id}' if event_id else None,
+        f'r:{reply_token}' if reply_token else None,
+    )
+
+
+_deduplicator = None
+
+def get_deduplicator():
+    global _deduplicator
+    if _deduplicator is None:
+        _deduplicator = EventDeduplicator(path=DEDUP_PATH or None)
+    return _deduplicator
+
+def _collect_dedup():
+    if _deduplicator is None:
+        return []
+    return [('tottmigo_duplicate_events_total', 'counter', '略過的重送事件數', [({}, _deduplicator.duplicates)])]
+
+register_collector(_collect_dedup)
+
+def is_duplicate(event):
+    """事件是否已處理過（第一次看到時會順便登記）"""
+    return get_deduplicator().seen(*event_keys(event))
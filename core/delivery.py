@@ -0,0 +1,171 @@
+import json
+import random
+import time
+import uuid
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .metrics import ERRORS, LINE_API_CALLS, stage
+from .tracing import warn
+
+
+# LINE Messaging API 的限制
+MAX_MESSAGES_PER_REQUEST = 5
+MAX_MULTICAST_RECIPIENTS = 500
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+_LINE_API = stage('line_api')
+
+
+class LineApiError(Exception):
+    """LINE API 回應錯誤（重試後仍失敗）"""
+
+    def __init__(self, status, body):
+        super().__init__(f"LINE API 錯誤 {status}: {body}")
+        self.status = status
+        self.body = body
+
+
+def to_payload(message):
+    """將 SDK 的訊息物件轉成 API 的 JSON 格式；已經是 dict 的（預先序列化）直接使用"""
+    if isinstance(message, dict):
+        return message
+    return message.as_json_dict()
+
+def chunked(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+class LineDelivery:
+    """對 LINE API 的發送層
+
+    - 共用一個 keep-alive 的 requests.Session 與連線池
+    - 可設定連線／讀取逾時
+    - 429 與 5xx 以指數退避加隨機抖動重試，並遵守 Retry-After
+    - 訊息依 API 上限合併：每次最多 5 則訊息、multicast 每次最多 500 人
+    """
+
+    def __init__(self, access_token, endpoint='https://api.line.me', timeout=(3.05, 10),
+                 max_retries=3, backoff=0.5, max_backoff=8, pool_size=10):
+        self.endpoint = endpoint.rstrip('/')
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.calls = 0
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update({
+            'Authorization': f'Bearer {access_token}',
+            'Content-Type': 'application/json',
+        })
+
+    def _sleep(self, attempt, retry_after):
+        if retry_after is not None:
+            try:
+                time.sleep(min(float(retry_after), self.max_backoff))
+                return
+            except ValueError:
+                pass
+        # full jitter：在 0 與指數上限之間隨機等待，避免多個程序同時重試
+        time.sleep(random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt)))
+
+    def _post(self, path, payload, retry_key=None):
+        headers = {}
+        if retry_key is not None:
+            # 同一個 retry key 只會被 LINE 處理一次，重試 push/multicast 不會重複發送
+            headers['X-Line-Retry-Key'] = retry_key
+        data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+
+        for attempt in range(self.max_retries + 1):
+            last = attempt == self.max_retries
+            try:
+                with _LINE_API.time():
+                    response = self.session.post(self.endpoint + path, data=data, headers=headers, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout):
+                ERRORS.labels('line_api').inc()
+                if last:
+                    raise
+                self._sleep(attempt, None)
+                continue
+
+            self.calls += 1
+            LINE_API_CALLS.labels(response.status_code).inc()
+            if response.status_code < 300:
+                return response
+            if response.status_code == 409 and retry_key is not None:
+                return response  # 先前的重試已被接受
+            if response.status_code not in RETRY_STATUSES or last:
+                raise LineApiError(response.status_code, response.text)
+            self._sleep(attempt, response.headers.get('Retry-After'))
+
+    def reply(self, reply_token, messages, overflow_to=None):
+        """以一次 API 呼叫回覆最多 5 則訊息
+
+        reply token 只能使用一次；超過 5 則時，多出的訊息改用 push 發送給 overflow_to，
+        沒有指定 overflow_to 則捨棄。
+        """
+        payloads = [to_payload(message) for message in messages]
+        self._post('/v2/bot/message/reply', {
+            'replyToken': reply_token,
+            'messages': payloads[:MAX_MESSAGES_PER_REQUEST],
+        })
+        overflow = payloads[MAX_MESSAGES_PER_REQUEST:]
+        if overflow:
+            if overflow_to is None:
+                warn(f"回覆超過 {MAX_MESSAGES_PER_REQUEST} 則，捨棄 {len(overflow)} 則訊息", dropped=len(overflow))
+            else:
+                self.push(overflow_to, overflow)
+
+    def push(self, to, messages):
+        """推播訊息給一個使用者、群組或聊天室，每 5 則一次呼叫"""
+        payloads = [to_payload(message) for message in messages]
+        for chunk in chunked(payloads, MAX_MESSAGES_PER_REQUEST):
+            self._post('/v2/bot/message/push', {'to': to, 'messages': chunk}, retry_key=str(uuid.uuid4()))
+
+    def multicast(self, user_ids, messages):
+        """同一組訊息發送給多個使用者，每 500 人、每 5 則一次呼叫"""
+        payloads = [to_payload(message) for message in messages]
+        for recipients in chunked(list(user_ids), MAX_MULTICAST_RECIPIENTS):
+            for chunk in chunked(payloads, MAX_MESSAGES_PER_REQUEST):
+                self._post('/v2/bot/message/multicast', {'to': recipients, 'messages': chunk},
+                           retry_key=str(uuid.uuid4()))
+
+    def send_pushes(self, pushes):
+        """合併多筆推播：內容相同且對象是使用者 ID 的改用 multicast 一起發送
+
+        pushes: [(to, [message, ...]), ...]
+        群組（C…）與聊天室（R…）無法 multicast，仍逐一 push。
+        一筆失敗不影響其他筆，回傳發送失敗的對象 {to: 例外}。
+        """
+        failed = {}
+        users_by_content = {}
+        for to, messages in pushes:
+            payloads = [to_payload(message) for message in messages]
+            if to.startswith('U'):
+                key = json.dumps(payloads, ensure_ascii=False, sort_keys=True)
+                users_by_content.setdefault(key, (payloads, []))[1].append(to)
+            else:
+                try:
+                    self.push(to, payloads)
+                except Exception as e:
+                    failed[to] = e
+
+        for payloads, user_ids in users_by_content.values():
+            if len(user_ids) == 1:
+                try:
+                    self.push(user_ids[0], payloads)
+                except Exception as e:
+                    failed[user_ids[0]] = e
+                continue
+            # 每次 multicast 呼叫各自成功或失敗，逐批呼叫才知道哪些使用者沒收到
+            for recipients in chunked(user_ids, MAX_MULTICAST_RECIPIENTS):
+                try:
+                    self.multicast(recipients, payloads)
+                except Exception as e:
+                    failed.update(dict.fromkeys(recipients, e))
+        return failed
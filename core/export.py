@@ -0,0 +1,195 @@
+"""排程匯出（iCalendar、CSV）與 CSV 批次匯入
+
+GET /export/schedule.ics?tenant=<租戶>&roommate=<室友>&token=<EXPORT_TOKEN>
+GET /export/schedule.csv?tenant=<租戶>&token=<EXPORT_TOKEN>
+POST /import/schedule.csv?tenant=<租戶>&token=<EXPORT_TOKEN>
+
+匯出以產生器逐月輸出，不先組出整份檔案。ETag 由儲存後端的 version() 算出，
+行事曆定期輪詢時帶 If-None-Match（或 If-Modified-Since），沒有變動就直接回 304，不讀取排程。
+
+CSV 欄位：year,month,week_num,start_date,end_date,roommate（匯入時 start_date、end_date 可省略）
+"""
+import csv
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from email.utils import formatdate, parsedate_to_datetime
+import hashlib
+import hmac
+import io
+import threading
+import time
+
+from .db import DEFAULT_TENANT, get_backend, load_schedules
+from .utils import import_schedules
+from config import EXPORT_TOKEN
+
+
+CONTENT_TYPES = {
+    'ics': 'text/calendar; charset=utf-8',
+    'csv': 'text/csv; charset=utf-8',
+}
+CSV_FIELDS = ['year', 'month', 'week_num', 'start_date', 'end_date', 'roommate']
+MAX_IMPORT_BYTES = 1 << 20
+
+# 租戶 -> (版本, 第一次看到這個版本的時間)，作為 Last-Modified
+_versions = OrderedDict()
+_versions_lock = threading.Lock()
+_MAX_VERSIONS = 1024
+
+
+def check_token(token):
+    """EXPORT_TOKEN 沒有設定時一律拒絕"""
+    return bool(EXPORT_TOKEN) and hmac.compare_digest((token or '').encode('utf-8'), EXPORT_TOKEN.encode('utf-8'))
+
+def _modified_at(tenant_id, version):
+    with _versions_lock:
+        seen = _versions.get(tenant_id)
+        if seen is None or seen[0] != version:
+            seen = _versions[tenant_id] = (version, int(time.time()))
+        _versions.move_to_end(tenant_id)
+        while len(_versions) > _MAX_VERSIONS:
+            _versions.popitem(last=False)
+    return seen[1]
+
+def _not_modified(etag, modified_at, if_none_match, if_modified_since):
+    if if_none_match:
+        return etag in (tag.strip() for tag in if_none_match.split(',')) or if_none_match.strip() == '*'
+    if if_modified_since:
+        try:
+            return modified_at <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+def _month_order(key):
+    year, month = key.split('-')
+    return int(year), int(month)
+
+def _iter_months(tenant_id):
+    """依月份順序逐月取出 (月份鍵值, 排程)：先逐年讀取封存檔，再讀主要儲存（同一個月份以主要儲存為準）"""
+    from .archive import archived_schedules, archiving_enabled
+
+    schedules = load_schedules(tenant_id)
+    if archiving_enabled():
+        for year, months in archived_schedules(tenant_id):
+            for key in sorted(months, key=_month_order):
+                if key not in schedules:
+                    yield key, months[key]
+    for key in sorted(schedules, key=_month_order):
+        yield key, schedules[key]
+
+def _iter_weeks(tenant_id, roommate=None):
+    """依月份順序逐月取出 (year, month, [週次排程])"""
+    for key, entry in _iter_months(tenant_id):
+        weeks = entry['schedules']
+        if roommate:
+            weeks = [schedule for schedule in weeks if schedule['roommate'] == roommate]
+        if weeks:
+            yield (*_month_order(key), weeks)
+
+def _ics_text(value):
+    return value.replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,').replace('\n', '\\n')
+
+def _ics_line(line):
+    """RFC 5545 每行最多 75 個位元組，超過時折行（後續行以空白開頭）"""
+    encoded = line.encode('utf-8')
+    if len(encoded) <= 75:
+        return line + '\r\n'
+    parts = []
+    current = ''
+    limit = 75
+    for char in line:
+        if len((current + char).encode('utf-8')) > limit:
+            parts.append(current)
+            current = ''
+            limit = 74
+        current += char
+    parts.append(current)
+    return '\r\n '.join(parts) + '\r\n'
+
+def _ics_date(value):
+    return value.replace('/', '')
+
+def iter_ics(tenant_id=DEFAULT_TENANT, roommate=None, stamp=None):
+    """iCalendar 動態：每週一個全天事件（DTEND 為結束日的隔天）"""
+    stamp = time.strftime('%Y%m%dT%H%M%SZ', time.gmtime(stamp or time.time()))
+    uid_prefix = tenant_id or 'default'
+    yield ''.join(_ics_line(line) for line in (
+        'BEGIN:VCALENDAR',
+        'VERSION:2.0',
+        'PRODID:-//TOTTMigo//Roommate Duty//ZH',
+        'CALSCALE:GREGORIAN',
+        'METHOD:PUBLISH',
+        f"X-WR-CALNAME:{_ics_text('倒垃圾輪值' + (f'（{roommate}）' if roommate else ''))}",
+    ))
+    for year, month, weeks in _iter_weeks(tenant_id, roommate):
+        lines = []
+        for schedule in weeks:
+            end = datetime.strptime(schedule['end_date'], '%Y/%m/%d') + timedelta(days=1)
+            lines.extend((
+                'BEGIN:VEVENT',
+                f"UID:{uid_prefix}-{year}-{month}-{schedule['week_num']}@tottmigo",
+                f'DTSTAMP:{stamp}',
+                f"DTSTART;VALUE=DATE:{_ics_date(schedule['start_date'])}",
+                f"DTEND;VALUE=DATE:{end.strftime('%Y%m%d')}",
+                f"SUMMARY:{_ics_text('倒垃圾：' + schedule['roommate'])}",
+                'TRANSP:TRANSPARENT',
+                'END:VEVENT',
+            ))
+        yield ''.join(_ics_line(line) for line in lines)
+    yield _ics_line('END:VCALENDAR')
+
+def iter_csv(tenant_id=DEFAULT_TENANT, roommate=None, stamp=None):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\r\n')
+    writer.writerow(CSV_FIELDS)
+    for year, month, weeks in _iter_weeks(tenant_id, roommate):
+        for schedule in weeks:
+            writer.writerow([
+                year, month, schedule['week_num'], schedule['start_date'], schedule['end_date'], schedule['roommate']
+            ])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+_WRITERS = {'ics': iter_ics, 'csv': iter_csv}
+
+def export_feed(kind, tenant_id=DEFAULT_TENANT, roommate=None, if_none_match=None, if_modified_since=None):
+    """回傳 (HTTP 狀態, 標頭 dict, 內容的產生器)；沒有變動時狀態為 304，內容為空"""
+    version = get_backend().version(tenant_id)
+    etag = '"' + hashlib.sha1(repr((version, kind, roommate)).encode('utf-8')).hexdigest()[:24] + '"'
+    modified_at = _modified_at(tenant_id, version)
+    headers = {
+        'ETag': etag,
+        'Last-Modified': formatdate(modified_at, usegmt=True),
+        'Cache-Control': 'private, max-age=0, must-revalidate',
+    }
+    if _not_modified(etag, modified_at, if_none_match, if_modified_since):
+        return 304, headers, iter(())
+    headers['Content-Type'] = CONTENT_TYPES[kind]
+    return 200, headers, _WRITERS[kind](tenant_id, roommate, modified_at)
+
+def parse_csv(text):
+    """解析匯入的 CSV，回傳 {(year, month): {週次: 室友}}；格式錯誤時丟出 ValueError（含行號）"""
+    reader = csv.DictReader(io.StringIO(text.lstrip('\ufeff')))
+    missing = {'year', 'month', 'week_num', 'roommate'} - set(reader.fieldnames or ())
+    if missing:
+        raise ValueError(f"缺少欄位：{', '.join(sorted(missing))}")
+    assignments = {}
+    for row in reader:
+        try:
+            year, month, week_num = int(row['year']), int(row['month']), int(row['week_num'])
+        except (TypeError, ValueError):
+            raise ValueError(f"第 {reader.line_num} 行：year、month、week_num 必須是數字")
+        roommate = (row['roommate'] or '').strip()
+        if not 1 <= month <= 12 or not roommate:
+            raise ValueError(f"第 {reader.line_num} 行：月份或室友無效")
+        assignments.setdefault((year, month), {})[week_num] = roommate
+    return assignments
+
+def import_csv(text, tenant_id=DEFAULT_TENANT):
+    """匯入 CSV（同一個交易），回傳 (月份數, 實際變更的週數)"""
+    assignments = parse_csv(text)
+    return len(assignments), import_schedules(assignments, tenant_id)
@@ -0,0 +1,60 @@
+import queue
+import threading
+
+from .tracing import warn
+
+
+class EventQueue:
+    """以固定數量的背景執行緒處理 webhook，/callback 只負責驗證與排入佇列
+
+    佇列有上限：排入時最多等待 put_timeout 秒，仍滿則回報失敗，
+    由呼叫端回應 503 讓 LINE 稍後重送（背壓）。
+    """
+
+    _STOP = object()
+
+    def __init__(self, handle, workers=4, maxsize=100, put_timeout=0.5):
+        self.handle = handle
+        self.put_timeout = put_timeout
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._accepting = True
+        self._threads = []
+        for i in range(workers):
+            thread = threading.Thread(target=self._run, name=f"webhook-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, *args):
+        """排入一個工作，佇列已滿或已關閉時回傳 False"""
+        if not self._accepting:
+            return False
+        try:
+            self._queue.put(args, timeout=self.put_timeout)
+        except queue.Full:
+            return False
+        return True
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is self._STOP:
+                    return
+                self.handle(*item)
+            except Exception as e:
+                warn("webhook 事件處理失敗", e)
+            finally:
+                self._queue.task_done()
+
+    def shutdown(self, timeout=10):
+        """停止接收新工作，處理完佇列中剩下的事件後結束所有執行緒"""
+        if not self._accepting:
+            return
+        self._accepting = False
+        for _ in self._threads:
+            self._queue.put(self._STOP)
+        for thread in self._threads:
+            thread.join(timeout)
@@ -0,0 +1,366 @@
+"""只追加（append-only）的事件日誌儲存後端（STORAGE_BACKEND=journal）
+
+每次寫入在租戶的日誌檔尾端追加一行 JSON，只記錄有變動的設定欄位與月份，以及變動前的值：
+
+    {"seq": 12, "ts": ..., "events": [{"kind": "weeks_reassigned", ...}],
+     "config": {"next_roommate_index": 2}, "months": {"2025-6": {...}},
+     "before": {"config": {"next_roommate_index": 1}, "months": {"2025-6": {...}}}}
+
+變動前不存在的設定欄位列在 before 的 absent 中（不記成 null），復原時寫成 removed，重播時刪除該欄位。
+
+讀取使用記憶體中的實體化檢視（materialized view）：啟動時從基準快照重播日誌，
+之後只讀取其他程序新追加的部分。日誌累積 JOURNAL_COMPACT_EVERY 筆後壓縮：
+把較舊的紀錄併入基準快照，只保留最近 JOURNAL_KEEP 筆供修改紀錄與復原使用。
+
+寫入到一半當機時，日誌最後一行會不完整；重播時忽略它，下一次寫入前截掉。
+"""
+import copy
+from collections import deque
+import json
+import os
+import threading
+import time
+
+from .db import (
+    DEFAULT_TENANT, JsonBackend, StorageError, TENANT_DIR, _TENANT_ID, _atomic_write_json, _default_config,
+    _fill_defaults, _fsync_dir, get_backend, month_key, tenant_path,
+)
+from config import JOURNAL_FILE, JOURNAL_BASE_FILE, JOURNAL_COMPACT_EVERY, JOURNAL_KEEP
+
+
+# 可交換的計數欄位（{名稱: 數字}）：復原時套用反向增量，之後的變更不會阻擋復原
+COUNTER_KEYS = {'duty_counts'}
+
+
+class _JournalView:
+    __slots__ = ('seq', 'config', 'schedules', 'records', 'pending', 'offset', 'token', 'needs_base')
+
+    def __init__(self, seq, config, schedules, token):
+        self.seq = seq
+        self.config = config
+        self.schedules = schedules
+        self.records = deque(maxlen=JOURNAL_KEEP)  # 最近的紀錄，供修改紀錄與復原
+        self.pending = 0  # 日誌檔中（基準快照之後）的紀錄數
+        self.offset = 0  # 已重播到日誌檔的第幾個位元組
+        self.token = token
+        self.needs_base = False
+
+
+def _file_id(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_ino, st.st_mtime_ns
+
+
+class JournalBackend:
+
+    def __init__(self, journal_file=JOURNAL_FILE, base_file=JOURNAL_BASE_FILE,
+                 compact_every=JOURNAL_COMPACT_EVERY):
+        self.journal_file = journal_file
+        self.base_file = base_file
+        self.compact_every = compact_every
+        self.compactions = 0
+        self._views = {}
+        self._lock = threading.RLock()
+
+    def _journal_path(self, tenant_id):
+        return tenant_path(tenant_id, self.journal_file)
+
+    def _base_path(self, tenant_id):
+        return tenant_path(tenant_id, self.base_file)
+
+    def _token(self, tenant_id):
+        """基準快照與日誌檔的識別；壓縮會以新檔取代兩者，這時整個檢視要重新載入"""
+        journal_id = _file_id(self._journal_path(tenant_id))
+        return _file_id(self._base_path(tenant_id)), journal_id and journal_id[0]
+
+    def _load(self, tenant_id):
+        base_path = self._base_path(tenant_id)
+        token = self._token(tenant_id)
+        if os.path.exists(base_path):
+            try:
+                with open(base_path, 'r', encoding='utf-8') as f:
+                    base = json.load(f)
+            except ValueError as e:
+                raise StorageError(f"無法解析 {base_path}: {e}")
+            view = _JournalView(base['seq'], _fill_defaults(base['config']), base['schedules'], token)
+        elif os.path.exists(self._journal_path(tenant_id)):
+            view = _JournalView(0, _default_config(), {}, token)
+        else:
+            # 第一次使用：沿用原本 JSON 檔的資料，第一次寫入時存成基準快照
+            legacy = JsonBackend()
+            view = _JournalView(0, legacy.load_config(tenant_id), legacy.load_schedules(tenant_id), token)
+            view.needs_base = True
+        self._catch_up(tenant_id, view)
+        return view
+
+    def _catch_up(self, tenant_id, view):
+        """重播日誌中 view.offset 之後的完整紀錄（其他程序追加的部分）"""
+        path = self._journal_path(tenant_id)
+        try:
+            with open(path, 'rb') as f:
+                f.seek(view.offset)
+                data = f.read()
+        except FileNotFoundError:
+            return
+        position = 0
+        while True:
+            end = data.find(b'\n', position)
+            if end < 0:
+                break  # 沒有換行的最後一行是寫到一半的紀錄，忽略
+            line = data[position:end]
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                raise StorageError(f"{path} 第 {view.offset + position} 位元組的紀錄損毀: {e}")
+            position = end + 1
+            if record['seq'] <= view.seq:
+                continue  # 已併入基準快照的紀錄
+            self._replay(view, record)
+            view.records.append(record)
+            view.pending += 1
+        view.offset += position
+
+    @staticmethod
+    def _replay(view, record):
+        view.config.update(record.get('config', {}))
+        for key in record.get('removed', ()):
+            view.config.pop(key, None)
+        for key, entry in record.get('months', {}).items():
+            if entry is None:
+                view.schedules.pop(key, None)
+            else:
+                view.schedules[key] = entry
+        view.seq = record['seq']
+
+    def _view(self, tenant_id):
+        view = self._views.get(tenant_id)
+        if view is None or view.token != self._token(tenant_id):
+            view = self._views[tenant_id] = self._load(tenant_id)
+        else:
+            self._catch_up(tenant_id, view)
+        return view
+
+    def _append(self, tenant_id, view, config_changes, month_changes, events, undo=None, removed=()):
+        """追加一筆紀錄並更新檢視；before 保留變動前的值供復原，removed 是要刪除的設定欄位"""
+        if not config_changes and not month_changes and not removed:
+            return None
+        if view.needs_base:
+            self._write_base(tenant_id, view)
+        record = {
+            'seq': view.seq + 1,
+            'ts': time.time(),
+            'events': list(events),
+            'config': config_changes,
+            'months': month_changes,
+            'before': {
+                'config': {key: view.config[key] for key in (*config_changes, *removed) if key in view.config},
+                'months': {key: view.schedules.get(key) for key in month_changes},
+            },
+        }
+        absent = [key for key in config_changes if key not in view.config]
+        if absent:
+            record['before']['absent'] = absent
+        if removed:
+            record['removed'] = list(removed)
+        if undo is not None:
+            record['undo'] = undo
+
+        path = self._journal_path(tenant_id)
+        created = not os.path.exists(path)
+        if created:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, 'ab') as f:
+            if f.tell() != view.offset:
+                f.truncate(view.offset)  # 截掉當機時寫到一半的最後一行
+            f.write(json.dumps(record, ensure_ascii=False).encode('utf-8') + b'\n')
+            f.flush()
+            os.fsync(f.fileno())
+            view.offset = f.tell()
+        if created:
+            _fsync_dir(os.path.dirname(os.path.abspath(path)))
+        view.token = self._token(tenant_id)
+
+        self._replay(view, copy.deepcopy(record))
+        view.records.append(record)
+        view.pending += 1
+        # 日誌中的紀錄比保留數多時才有東西可以併入基準快照
+        if view.pending >= self.compact_every and view.pending > len(view.records):
+            self._compact(tenant_id, view)
+        return record
+
+    def _write_base(self, tenant_id, view, seq=None, config=None, schedules=None):
+        _atomic_write_json(self._base_path(tenant_id), {
+            'seq': view.seq if seq is None else seq,
+            'config': view.config if config is None else config,
+            'schedules': view.schedules if schedules is None else schedules,
+        })
+        view.needs_base = False
+
+    def _compact(self, tenant_id, view):
+        """把保留範圍之前的紀錄併入基準快照，日誌只留下最近 JOURNAL_KEEP 筆
+
+        基準快照的狀態由目前狀態依序套用保留紀錄的 before 倒推回去。
+        先寫基準快照再取代日誌：兩步之間當機時，重播會略過已併入快照的紀錄。
+        """
+        kept = list(view.records)
+        config = copy.deepcopy(view.config)
+        schedules = copy.deepcopy(view.schedules)
+        for record in reversed(kept):
+            config.update(record['before']['config'])
+            for key in record['before'].get('absent', ()):
+                config.pop(key, None)
+            for key, entry in record['before']['months'].items():
+                if entry is None:
+                    schedules.pop(key, None)
+                else:
+                    schedules[key] = entry
+        base_seq = kept[0]['seq'] - 1 if kept else view.seq
+        self._write_base(tenant_id, view, base_seq, config, schedules)
+
+        path = self._journal_path(tenant_id)
+        tmp_path = path + '.compact'
+        with open(tmp_path, 'wb') as f:
+            for record in kept:
+                f.write(json.dumps(record, ensure_ascii=False).encode('utf-8') + b'\n')
+            f.flush()
+            os.fsync(f.fileno())
+            offset = f.tell()
+        os.replace(tmp_path, path)
+        _fsync_dir(os.path.dirname(os.path.abspath(path)))
+        view.offset = offset
+        view.pending = len(kept)
+        view.token = self._token(tenant_id)
+        self.compactions += 1
+
+    # 與其他後端相同的介面
+
+    def version(self, tenant_id):
+        """基準快照與日誌檔的識別加上日誌大小，每次追加都會改變"""
+        try:
+            size = os.path.getsize(self._journal_path(tenant_id))
+        except OSError:
+            size = None
+        return self._token(tenant_id), size
+
+    def load_config(self, tenant_id):
+        with self._lock:
+            return copy.deepcopy(self._view(tenant_id).config)
+
+    def save_config(self, tenant_id, config):
+        self.apply(tenant_id, config, {})
+
+    def load_schedules(self, tenant_id):
+        with self._lock:
+            return copy.deepcopy(self._view(tenant_id).schedules)
+
+    def save_schedules(self, tenant_id, schedules):
+        with self._lock:
+            view = self._view(tenant_id)
+            changes = {key: entry for key, entry in schedules.items() if view.schedules.get(key) != entry}
+            changes.update({key: None for key in view.schedules if key not in schedules})
+            self._append(tenant_id, view, {}, copy.deepcopy(changes), [])
+
+    def load_month(self, tenant_id, year, month):
+        with self._lock:
+            return copy.deepcopy(self._view(tenant_id).schedules.get(month_key(year, month)))
+
+    def save_month(self, tenant_id, year, month, entry):
+        self.apply(tenant_id, None, {(year, month): entry})
+
+    def apply(self, tenant_id, config, months, events=()):
+        """只把有變動的設定欄位與月份追加到日誌，成本與歷史長度無關"""
+        with self._lock:
+            view = self._view(tenant_id)
+            config_changes = {}
+            if config is not None:
+                config_changes = {key: value for key, value in config.items() if view.config.get(key) != value}
+            month_changes = {}
+            for (year, month), entry in months.items():
+                key = month_key(year, month)
+                if view.schedules.get(key) != entry:
+                    month_changes[key] = entry
+            self._append(tenant_id, view, copy.deepcopy(config_changes), copy.deepcopy(month_changes), events)
+
+    def list_tenants(self):
+        tenants = []
+        legacy = JsonBackend()
+        if any(os.path.exists(name) for name in (
+            self.journal_file, self.base_file, legacy.config_file, legacy.schedules_file
+        )):
+            tenants.append(DEFAULT_TENANT)
+        if os.path.isdir(TENANT_DIR):
+            tenants.extend(sorted(
+                name for name in os.listdir(TENANT_DIR)
+                if _TENANT_ID.match(name) and os.path.isdir(os.path.join(TENANT_DIR, name))
+            ))
+        return tenants
+
+    # 修改紀錄與復原
+
+    def history(self, tenant_id, limit=10):
+        """最近的紀錄（新到舊）"""
+        with self._lock:
+            return [copy.deepcopy(record) for record in list(self._view(tenant_id).records)[::-1][:limit]]
+
+    def undo(self, tenant_id, kinds=None):
+        """復原最近一筆尚未復原、且事件種類在 kinds 之內的紀錄，回傳被復原的紀錄
+
+        只有在之後沒有其他紀錄改過相同欄位或月份時才能復原，否則丟出 ValueError，
+        避免蓋掉之後的變更（例如每週提醒寫入的 last_reminded 不會阻擋復原）。
+        """
+        with self._lock:
+            view = self._view(tenant_id)
+            undone = {record['undo'] for record in view.records if 'undo' in record}
+            target = None
+            for record in reversed(view.records):
+                if 'undo' in record or record['seq'] in undone:
+                    continue
+                if kinds is None or any(event['kind'] in kinds for event in record['events']):
+                    target = record
+                    break
+            if target is None:
+                return None
+
+            for key, value in target['config'].items():
+                if key not in COUNTER_KEYS and view.config.get(key) != value:
+                    raise ValueError(f"設定「{key}」之後又被修改過，無法復原")
+            for key, entry in target['months'].items():
+                if view.schedules.get(key) != entry:
+                    raise ValueError(f"{key} 的排程之後又被修改過，無法復原")
+
+            config = copy.deepcopy(target['before']['config'])
+            for key in COUNTER_KEYS & target['config'].keys():
+                counts = _revert_counter(view.config.get(key), target['config'][key], config.get(key))
+                if counts or key in config:
+                    config[key] = counts
+            # 變動前不存在的欄位要刪除，而不是寫回 null
+            removed = [key for key in target['before'].get('absent', ()) if key not in config]
+            self._append(
+                tenant_id, view,
+                config, copy.deepcopy(target['before']['months']),
+                [{'kind': 'undo', 'seq': target['seq']}], undo=target['seq'], removed=removed
+            )
+            return copy.deepcopy(target)
+
+
+def _revert_counter(current, after, before):
+    """目前的計數扣掉該筆紀錄造成的增量（after - before）"""
+    if before is None:
+        before = {}
+    names = set(current or {}) | set(after) | set(before)
+    reverted = {
+        name: (current or {}).get(name, 0) - after.get(name, 0) + before.get(name, 0)
+        for name in names
+    }
+    return {name: value for name, value in reverted.items() if value or name in (current or {})}
+
+
+def journal_backend():
+    """目前使用的日誌後端（外層可能包著快取與封存），不是日誌後端時回傳 None"""
+    backend = get_backend()
+    while not isinstance(backend, JournalBackend) and hasattr(backend, 'backend'):
+        backend = backend.backend
+    return backend if isinstance(backend, JournalBackend) else None
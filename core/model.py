@@ -0,0 +1,370 @@
+"""排程的精簡型別模型與二進位格式（STORAGE_BACKEND=binary）
+
+其他模組使用的排程仍是 JSON 相容的 dict（{'schedules': [{'roommate', 'start_date', 'end_date', 'week_num'}]}），
+這裡的型別只用在儲存與記憶體中：
+
+- Week：一週的輪值，日期存成 ordinal、室友存成名單（roster）中的索引，使用 __slots__
+- MonthSchedule：一個月的所有週次
+- ScheduleHistory：一個租戶的所有月份與共用的室友名單，可編碼成欄位式的二進位檔
+
+二進位檔的內容（數字都是 little-endian）：
+
+    表頭   magic 'TMSB'、格式版本、室友人數、名單位元組數、月份數、週數、不規則月份的位元組數
+    名單   室友名稱以 UTF-8 編碼、以 NUL 分隔（名稱可以是空字串，因此人數另外記在表頭）
+    月份   (year * 12 + month - 1) 的 int32 陣列、每月週數的 uint16 陣列
+    週次   星期一 ordinal 的 int32、(結束 - 開始) 天數的 int8、週次的 uint8、室友索引的 uint16 四個陣列
+    其他   無法以上述欄位表示的月份（例如手動編輯過、格式不同的資料），原樣存成一個 JSON 物件
+
+載入時只以 array.frombytes 讀入各欄位，讀取某個月份時才由欄位產生該月的內容，
+因此多年的歷史載入與寫回都不需要逐筆解析或格式化字串。
+"""
+from array import array
+from collections import OrderedDict
+import copy
+import json
+import os
+import struct
+import sys
+import threading
+
+from .calendar_index import format_ordinal, parse_date
+from .db import (
+    CONFIG_FILE, JsonBackend, StorageError, _atomic_write_bytes, _atomic_write_json, _fsync_dir, month_key,
+)
+from config import BINARY_SCHEDULES_FILE, TENANT_CACHE_SIZE
+
+
+MAGIC = b'TMSB'
+FORMAT_VERSION = 2
+
+_HEADER = struct.Struct('<4sBIIIII')
+_WEEK_KEYS = {'roommate', 'start_date', 'end_date', 'week_num'}
+# 週次欄位（開始、天數、週次、室友索引）的 array 型別；超出範圍的月份改存成 JSON
+_COLUMNS = 'ibBH'
+
+
+class Week:
+    __slots__ = ('week_num', 'start', 'end', 'roommate')
+
+    def __init__(self, week_num, start, end, roommate):
+        self.week_num = week_num
+        self.start = start  # 星期一的 ordinal
+        self.end = end
+        self.roommate = roommate  # 室友在 ScheduleHistory.roster 中的索引
+
+    def to_dict(self, roster):
+        return {
+            'roommate': roster[self.roommate],
+            'start_date': format_ordinal(self.start),
+            'end_date': format_ordinal(self.end),
+            'week_num': self.week_num,
+        }
+
+
+class MonthSchedule:
+    __slots__ = ('year', 'month', 'weeks')
+
+    def __init__(self, year, month, weeks):
+        self.year = year
+        self.month = month
+        self.weeks = weeks  # Week 的 tuple，依週次排列
+
+    def to_entry(self, roster):
+        """JSON 相容的月份排程（與其他後端儲存的格式相同）"""
+        return {'schedules': [week.to_dict(roster) for week in self.weeks]}
+
+    @classmethod
+    def from_entry(cls, year, month, entry, roommate_index):
+        """由月份排程 dict 建立；roommate_index(名稱) 回傳室友索引
+
+        不是標準格式（多了欄位、日期格式不同、數值超出欄位範圍）時回傳 None，由呼叫端原樣保存。
+        """
+        if not isinstance(entry, dict) or entry.keys() != {'schedules'} or not isinstance(entry['schedules'], list):
+            return None
+        weeks = []
+        for schedule in entry['schedules']:
+            if not isinstance(schedule, dict) or schedule.keys() != _WEEK_KEYS:
+                return None
+            roommate, start, end, week_num = (
+                schedule['roommate'], schedule['start_date'], schedule['end_date'], schedule['week_num']
+            )
+            if not (isinstance(roommate, str) and '\0' not in roommate
+                    and isinstance(start, str) and isinstance(end, str)
+                    and type(week_num) is int and 0 <= week_num <= 255):
+                return None
+            try:
+                start, end = parse_date(start), parse_date(end)
+            except ValueError:
+                return None
+            index = roommate_index(roommate)
+            if not -128 <= end - start <= 127 or index > 65535:
+                return None
+            weeks.append(Week(week_num, start, end, index))
+        if len(weeks) > 65535:
+            return None
+        return cls(year, month, tuple(weeks))
+
+
+def _to_le(column):
+    if sys.byteorder == 'big':
+        column = array(column.typecode, column)
+        column.byteswap()
+    return column.tobytes()
+
+def _from_le(typecode, data):
+    column = array(typecode)
+    column.frombytes(data)
+    if sys.byteorder == 'big':
+        column.byteswap()
+    return column
+
+
+class ScheduleHistory:
+    """一個租戶所有月份的排程
+
+    月份分成三種狀態：已轉成 MonthSchedule 的（_months）、還在載入時讀入的欄位中的（_packed），
+    以及無法以欄位表示、原樣保存的（_irregular）。室友名單只增不減，欄位中的索引一直有效。
+    """
+    __slots__ = ('roster', '_roster_index', '_months', '_packed', '_columns', '_irregular')
+
+    def __init__(self):
+        self.roster = []
+        self._roster_index = {}
+        self._months = {}
+        self._packed = {}  # (year, month) -> (週次在欄位中的起點, 週數)
+        self._columns = None  # (starts, spans, week_nums, roommates)
+        self._irregular = {}
+
+    @classmethod
+    def from_dict(cls, schedules):
+        """由 {month_key: entry} 建立"""
+        history = cls()
+        for key, entry in schedules.items():
+            year, month = (int(part) for part in key.split('-'))
+            history.set(year, month, entry)
+        return history
+
+    def _roommate(self, name):
+        index = self._roster_index.get(name)
+        if index is None:
+            index = self._roster_index[name] = len(self.roster)
+            self.roster.append(name)
+        return index
+
+    def __len__(self):
+        return len(self._months) + len(self._packed) + len(self._irregular)
+
+    def __contains__(self, year_month):
+        return year_month in self._months or year_month in self._packed or year_month in self._irregular
+
+    def keys(self):
+        """所有月份的 (year, month)，依時間排序"""
+        return sorted([*self._months, *self._packed, *self._irregular])
+
+    def get(self, year, month):
+        """JSON 相容的月份排程（每次回傳新的物件），沒有這個月時回傳 None
+
+        還在欄位中的月份直接由欄位產生，不轉成 Week 物件留在記憶體。
+        """
+        key = (year, month)
+        schedule = self._months.get(key)
+        if schedule is not None:
+            return schedule.to_entry(self.roster)
+        if key in self._packed:
+            offset, count = self._packed[key]
+            starts, spans, week_nums, roommates = self._columns
+            roster = self.roster
+            return {'schedules': [
+                {
+                    'roommate': roster[roommates[i]],
+                    'start_date': format_ordinal(starts[i]),
+                    'end_date': format_ordinal(starts[i] + spans[i]),
+                    'week_num': week_nums[i],
+                }
+                for i in range(offset, offset + count)
+            ]}
+        entry = self._irregular.get(key)
+        return copy.deepcopy(entry) if entry is not None else None
+
+    def set(self, year, month, entry):
+        """寫入月份排程（dict），entry 為 None 時刪除該月"""
+        key = (year, month)
+        self._months.pop(key, None)
+        self._packed.pop(key, None)
+        self._irregular.pop(key, None)
+        if entry is None:
+            return
+        schedule = MonthSchedule.from_entry(year, month, entry, self._roommate)
+        if schedule is None:
+            self._irregular[key] = copy.deepcopy(entry)
+        else:
+            self._months[key] = schedule
+
+    def to_dict(self):
+        """JSON 相容的所有月份 {month_key: entry}，依時間排序"""
+        return {month_key(year, month): self.get(year, month) for year, month in self.keys()}
+
+    def encode(self):
+        keys, counts = array('i'), array('H')
+        columns = tuple(array(typecode) for typecode in _COLUMNS)
+        starts, spans, week_nums, roommates = columns
+        for year, month in sorted([*self._months, *self._packed]):
+            schedule = self._months.get((year, month))
+            if schedule is not None:
+                for week in schedule.weeks:
+                    starts.append(week.start)
+                    spans.append(week.end - week.start)
+                    week_nums.append(week.week_num)
+                    roommates.append(week.roommate)
+                count = len(schedule.weeks)
+            else:
+                # 沒有被讀取過的月份直接複製欄位，不必轉成物件
+                offset, count = self._packed[(year, month)]
+                for column, packed in zip(columns, self._columns):
+                    column.extend(packed[offset:offset + count])
+            keys.append(year * 12 + month - 1)
+            counts.append(count)
+        roster = '\0'.join(self.roster).encode('utf-8')
+        irregular = b''
+        if self._irregular:
+            irregular = json.dumps(
+                {month_key(year, month): entry for (year, month), entry in sorted(self._irregular.items())},
+                ensure_ascii=False, separators=(',', ':')
+            ).encode('utf-8')
+        return b''.join([
+            _HEADER.pack(MAGIC, FORMAT_VERSION, len(self.roster), len(roster), len(keys), len(starts), len(irregular)),
+            roster,
+            _to_le(keys), _to_le(counts),
+            *(_to_le(column) for column in columns),
+            irregular,
+        ])
+
+    @classmethod
+    def decode(cls, data):
+        """由 encode 的結果建立；格式不符時丟出 ValueError"""
+        try:
+            magic, version, roster_count, roster_size, month_count, week_count, irregular_size = _HEADER.unpack_from(data)
+        except struct.error as e:
+            raise ValueError(f"排程檔表頭不完整: {e}")
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError(f"不支援的排程檔格式：{magic!r} 版本 {version}")
+        sizes = [roster_size, month_count * 4, month_count * 2]
+        sizes += [week_count * array(typecode).itemsize for typecode in _COLUMNS]
+        sizes.append(irregular_size)
+        if _HEADER.size + sum(sizes) != len(data):
+            raise ValueError("排程檔長度與表頭不符")
+        view = memoryview(data)
+        parts = []
+        position = _HEADER.size
+        for size in sizes:
+            parts.append(view[position:position + size])
+            position += size
+        roster, keys, counts, *columns, irregular = parts
+
+        history = cls()
+        if roster_count:
+            history.roster = bytes(roster).decode('utf-8').split('\0')
+            if len(history.roster) != roster_count:
+                raise ValueError("排程檔的室友名單與表頭不符")
+            history._roster_index = {name: i for i, name in enumerate(history.roster)}
+        elif roster_size:
+            raise ValueError("排程檔的室友名單與表頭不符")
+        history._columns = tuple(_from_le(typecode, part) for typecode, part in zip(_COLUMNS, columns))
+        offset = 0
+        for key, count in zip(_from_le('i', keys), _from_le('H', counts)):
+            year, month = divmod(key, 12)
+            history._packed[(year, month + 1)] = (offset, count)
+            offset += count
+        if offset != week_count or max(history._columns[3], default=-1) >= len(history.roster):
+            raise ValueError("排程檔的週次與表頭不符")
+        if irregular_size:
+            for key, entry in json.loads(bytes(irregular).decode('utf-8')).items():
+                year, month = (int(part) for part in key.split('-'))
+                history._irregular[(year, month)] = entry
+        return history
+
+
+def _file_token(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_ino, st.st_mtime_ns, st.st_size
+
+
+class BinaryBackend(JsonBackend):
+    """設定仍是 JSON 檔，排程改存成 ScheduleHistory 的二進位檔
+
+    解碼後的 ScheduleHistory 保留在記憶體中（最近使用的 max_tenants 個租戶），
+    以檔案的 inode、mtime 與大小判斷是否被其他程序改寫。
+    第一次使用時沿用原本 JSON 排程檔的資料，第一次寫入時存成二進位檔。
+    """
+
+    def __init__(self, config_file=CONFIG_FILE, schedules_file=BINARY_SCHEDULES_FILE, max_tenants=TENANT_CACHE_SIZE):
+        super().__init__(config_file, schedules_file)
+        self.max_tenants = max_tenants
+        self._histories = OrderedDict()  # tenant_id -> (檔案識別, ScheduleHistory)
+        self._lock = threading.RLock()
+
+    def _history(self, tenant_id):
+        path = self._schedules_path(tenant_id)
+        token = _file_token(path)
+        cached = self._histories.get(tenant_id)
+        if cached is not None and cached[0] == token:
+            self._histories.move_to_end(tenant_id)
+            return cached[1]
+        if token is None:
+            history = ScheduleHistory.from_dict(JsonBackend(self.config_file).load_schedules(tenant_id))
+        else:
+            with open(path, 'rb') as f:
+                data = f.read()
+            try:
+                history = ScheduleHistory.decode(data)
+            except ValueError as e:
+                # 檔案損毀時不可當作空資料，否則下一次寫入會蓋掉所有歷史
+                raise StorageError(f"無法解析 {path}: {e}")
+        self._remember(tenant_id, token, history)
+        return history
+
+    def _remember(self, tenant_id, token, history):
+        self._histories[tenant_id] = (token, history)
+        self._histories.move_to_end(tenant_id)
+        while len(self._histories) > self.max_tenants:
+            self._histories.popitem(last=False)
+
+    def _write(self, tenant_id, history):
+        path = self._schedules_path(tenant_id)
+        try:
+            directory = _atomic_write_bytes(path, history.encode())
+        except BaseException:
+            # 記憶體中的內容已經改過，寫入失敗時丟掉，下次從檔案重新載入
+            self._histories.pop(tenant_id, None)
+            raise
+        self._remember(tenant_id, _file_token(path), history)
+        return directory
+
+    def load_schedules(self, tenant_id):
+        with self._lock:
+            return self._history(tenant_id).to_dict()
+
+    def save_schedules(self, tenant_id, schedules):
+        with self._lock:
+            _fsync_dir(self._write(tenant_id, ScheduleHistory.from_dict(schedules)))
+
+    def load_month(self, tenant_id, year, month):
+        with self._lock:
+            return self._history(tenant_id).get(year, month)
+
+    def apply(self, tenant_id, config, months, events=()):
+        """一次寫入設定與多個月份（值為 None 的月份會被刪除），所有檔案寫完後才對目錄做一次 fsync"""
+        directories = set()
+        if config is not None:
+            directories.add(_atomic_write_json(self._config_path(tenant_id), config))
+        if months:
+            with self._lock:
+                history = self._history(tenant_id)
+                for (year, month), entry in months.items():
+                    history.set(year, month, entry)
+                directories.add(self._write(tenant_id, history))
+        for directory in directories:
+            _fsync_dir(directory)
@@ -0,0 +1,57 @@
+"""取樣式效能分析（PROFILE_TOKEN 設定時開放 /debug/profile）
+
+在 seconds 秒內每隔 interval 秒以 sys._current_frames() 取樣所有執行緒的呼叫堆疊，
+輸出 collapsed stack 格式（每行「執行緒;最外層;…;最內層 次數」），可直接交給 flamegraph.pl
+或 speedscope 畫成火焰圖。取樣期間其他執行緒照常處理請求，只有取樣本身的開銷。
+"""
+from collections import Counter
+import hmac
+import os
+import sys
+import threading
+import time
+
+from config import PROFILE_TOKEN
+
+
+MAX_SECONDS = 60
+
+_running = threading.Lock()
+
+
+def check_token(token):
+    """PROFILE_TOKEN 沒有設定時一律拒絕"""
+    return bool(PROFILE_TOKEN) and hmac.compare_digest((token or '').encode('utf-8'), PROFILE_TOKEN.encode('utf-8'))
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
+def sample(seconds=5.0, interval=0.005):
+    """取樣並回傳 {collapsed stack: 次數}；同時只能有一個取樣，已在取樣時丟出 RuntimeError"""
+    seconds = min(max(seconds, 0.1), MAX_SECONDS)
+    if not _running.acquire(blocking=False):
+        raise RuntimeError("已經有一個取樣正在進行")
+    try:
+        me = threading.get_ident()
+        counts = Counter()
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame))
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                counts[';'.join(reversed(stack))] += 1
+            time.sleep(interval)
+        return counts
+    finally:
+        _running.release()
+
+def collapsed(counts):
+    """collapsed stack 格式的文字，次數多的在前"""
+    return ''.join(f"{stack} {count}\n" for stack, count in counts.most_common())
@@ -0,0 +1,271 @@
+"""共用狀態的儲存後端（STORAGE_BACKEND=redis），讓多台 Fly 機器同時服務同一個 bot
+
+狀態放在 Redis（或相容的伺服器，例如 Valkey、KeyDB、Upstash）而不是機器本地的檔案，
+每個 app 程序都是無狀態的，可以任意增減。只用到最基本的指令，自帶極簡的 RESP 客戶端，不需要額外套件。
+
+每個租戶三個 key：
+
+    {prefix}:{tenant}:config    設定（JSON 字串）
+    {prefix}:{tenant}:months    排程，hash 欄位為 "2025-6"，值為該月的 JSON
+    {prefix}:{tenant}:version   每次寫入遞增的版本計數器
+
+跨機器沒有檔案鎖可用，交易改為樂觀並行控制：開始時記下版本，寫回時以 WATCH/MULTI/EXEC
+確認版本沒變（也就是 next_roommate_index 等設定沒有被其他機器改過）才寫入，
+否則丟出 ConflictError，由 retry_on_conflict 重新執行整個交易。
+"""
+import json
+import socket
+import threading
+from urllib.parse import unquote, urlparse
+
+from .db import ConflictError, StorageError, _default_config, _fill_defaults, month_key
+from config import REDIS_URL, REDIS_PREFIX, REDIS_TIMEOUT
+
+
+class RedisError(StorageError):
+    """Redis 回傳錯誤或連線失敗"""
+
+
+class RespConnection:
+    """一條 RESP（Redis 序列化協定）連線，一次送出多個指令、依序讀回回應"""
+
+    def __init__(self, url=REDIS_URL, timeout=REDIS_TIMEOUT):
+        parsed = urlparse(url)
+        if parsed.scheme not in ('redis', 'rediss'):
+            raise ValueError(f"不支援的 Redis 網址：{url}")
+        self.sock = socket.create_connection((parsed.hostname or 'localhost', parsed.port or 6379), timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if parsed.scheme == 'rediss':
+            import ssl
+            self.sock = ssl.create_default_context().wrap_socket(self.sock, server_hostname=parsed.hostname)
+        self.reader = self.sock.makefile('rb')
+        if parsed.password:
+            auth = ('AUTH', unquote(parsed.username), unquote(parsed.password)) if parsed.username else \
+                ('AUTH', unquote(parsed.password))
+            self.execute(*auth)
+        db = parsed.path.lstrip('/')
+        if db:
+            self.execute('SELECT', db)
+
+    @staticmethod
+    def _encode(args):
+        parts = [b'*%d\r\n' % len(args)]
+        for arg in args:
+            if not isinstance(arg, bytes):
+                arg = str(arg).encode('utf-8')
+            parts.append(b'$%d\r\n%s\r\n' % (len(arg), arg))
+        return b''.join(parts)
+
+    def _read(self):
+        line = self.reader.readline()
+        if not line.endswith(b'\r\n'):
+            raise ConnectionError("Redis 連線中斷")
+        kind, payload = line[:1], line[1:-2]
+        if kind == b'+':
+            return payload.decode('utf-8')
+        if kind == b'-':
+            return RedisError(payload.decode('utf-8'))
+        if kind == b':':
+            return int(payload)
+        if kind == b'$':
+            length = int(payload)
+            if length < 0:
+                return None
+            data = self.reader.read(length + 2)
+            return data[:-2].decode('utf-8')
+        if kind == b'*':
+            length = int(payload)
+            if length < 0:
+                return None
+            return [self._read() for _ in range(length)]
+        raise RedisError(f"無法解析的 Redis 回應：{line!r}")
+
+    def pipeline(self, *commands):
+        """一次送出多個指令（一個來回），回傳各自的回應；錯誤回應以 RedisError 物件表示"""
+        self.sock.sendall(b''.join(self._encode(command) for command in commands))
+        return [self._read() for _ in commands]
+
+    def execute(self, *args):
+        [reply] = self.pipeline(args)
+        if isinstance(reply, RedisError):
+            raise reply
+        return reply
+
+    def close(self):
+        try:
+            self.reader.close()
+            self.sock.close()
+        except OSError:
+            pass
+
+
+class RedisBackend:
+    """以 Redis 儲存，讀寫單一月份只動到 hash 的一個欄位"""
+
+    # 由 transaction() 判斷：不使用本機檔案鎖，改在寫回時比對版本
+    optimistic = True
+
+    def __init__(self, url=REDIS_URL, prefix=REDIS_PREFIX, timeout=REDIS_TIMEOUT):
+        if not url:
+            raise ValueError("STORAGE_BACKEND=redis 需要設定 REDIS_URL")
+        self.url = url
+        self.prefix = prefix
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            try:
+                conn = RespConnection(self.url, self.timeout)
+            except OSError as e:
+                raise RedisError(f"無法連線到 Redis：{e}")
+            self._local.conn = conn
+        return conn
+
+    def _call(self, *commands):
+        """在這個執行緒的連線上送出指令；連線出錯時丟棄連線，下次重新連線"""
+        try:
+            return self._connection().pipeline(*commands)
+        except (OSError, ConnectionError) as e:
+            conn, self._local.conn = getattr(self._local, 'conn', None), None
+            if conn is not None:
+                conn.close()
+            raise RedisError(f"Redis 連線失敗：{e}")
+
+    def _execute(self, *args):
+        [reply] = self._call(args)
+        if isinstance(reply, RedisError):
+            raise reply
+        return reply
+
+    def _key(self, tenant_id, name):
+        return f'{self.prefix}:{tenant_id}:{name}'
+
+    def version(self, tenant_id):
+        """該租戶每次寫入都會遞增的版本計數器（所有機器共用）"""
+        value = self._execute('GET', self._key(tenant_id, 'version'))
+        return int(value) if value is not None else 0
+
+    def load_config(self, tenant_id):
+        data = self._execute('GET', self._key(tenant_id, 'config'))
+        if data is None:
+            return _default_config()
+        return _fill_defaults(json.loads(data))
+
+    def save_config(self, tenant_id, config):
+        self.apply(tenant_id, config, {})
+
+    def load_schedules(self, tenant_id):
+        flat = self._execute('HGETALL', self._key(tenant_id, 'months'))
+        months = {}
+        for key, data in zip(flat[::2], flat[1::2]):
+            year, month = (int(part) for part in key.split('-'))
+            months[(year, month)] = json.loads(data)
+        return {month_key(year, month): months[(year, month)] for year, month in sorted(months)}
+
+    def save_schedules(self, tenant_id, schedules):
+        months_key = self._key(tenant_id, 'months')
+        commands = [('MULTI',), ('DEL', months_key)]
+        if schedules:
+            commands.append(('HSET', months_key, *self._month_fields(
+                (key, entry) for key, entry in schedules.items()
+            )))
+        commands += self._bump_commands(tenant_id) + [('EXEC',)]
+        return self._new_version(self._exec(commands))
+
+    def load_month(self, tenant_id, year, month):
+        data = self._execute('HGET', self._key(tenant_id, 'months'), month_key(year, month))
+        return json.loads(data) if data is not None else None
+
+    def save_month(self, tenant_id, year, month, entry):
+        self.apply(tenant_id, None, {(year, month): entry})
+
+    def apply(self, tenant_id, config, months, events=(), expected_version=None):
+        """在同一個 MULTI/EXEC 中寫入設定與多個月份（值為 None 的月份會被刪除）
+
+        指定 expected_version 時先 WATCH 版本計數器：版本已經不同，或在 EXEC 之前被其他機器寫入，
+        都會丟出 ConflictError 且不寫入任何資料。
+        回傳這次寫入產生的版本（同一個 EXEC 中 INCR 的結果，不會混入之後其他機器的寫入）。
+        """
+        commands = [('MULTI',)]
+        if config is not None:
+            commands.append(('SET', self._key(tenant_id, 'config'), json.dumps(config, ensure_ascii=False)))
+        stored = {key: entry for key, entry in months.items() if entry is not None}
+        if stored:
+            commands.append(('HSET', self._key(tenant_id, 'months'), *self._month_fields(
+                (month_key(year, month), entry) for (year, month), entry in stored.items()
+            )))
+        deleted = [month_key(year, month) for (year, month), entry in months.items() if entry is None]
+        if deleted:
+            commands.append(('HDEL', self._key(tenant_id, 'months'), *deleted))
+        commands += self._bump_commands(tenant_id) + [('EXEC',)]
+
+        if expected_version is None:
+            return self._new_version(self._exec(commands))
+        version_key = self._key(tenant_id, 'version')
+        _, current = self._call(('WATCH', version_key), ('GET', version_key))
+        if (int(current) if current is not None else 0) != expected_version:
+            self._call(('UNWATCH',))
+            raise ConflictError(f"租戶 {tenant_id!r} 的資料已被其他程序修改")
+        result = self._exec(commands)
+        if result is None:
+            raise ConflictError(f"租戶 {tenant_id!r} 的資料已被其他程序修改")
+        return self._new_version(result)
+
+    def _exec(self, commands):
+        """送出 MULTI ... EXEC，回傳 EXEC 的結果（WATCH 的 key 被改過時為 None）"""
+        replies = self._call(*commands)
+        for reply in replies[:-1]:
+            if isinstance(reply, RedisError):
+                raise reply
+        result = replies[-1]
+        if isinstance(result, RedisError):
+            raise result
+        for reply in result or ():
+            if isinstance(reply, RedisError):
+                raise reply
+        return result
+
+    @staticmethod
+    def _new_version(result):
+        # EXEC 的回應依序對應 MULTI 之後的指令，最後兩個是 _bump_commands 的 INCR 與 SADD
+        return int(result[-2])
+
+    @staticmethod
+    def _month_fields(items):
+        fields = []
+        for key, entry in items:
+            fields += [key, json.dumps(entry, ensure_ascii=False)]
+        return fields
+
+    def _bump_commands(self, tenant_id):
+        return [
+            ('INCR', self._key(tenant_id, 'version')),
+            ('SADD', f'{self.prefix}:tenants', tenant_id),
+        ]
+
+    def list_tenants(self):
+        return sorted(self._execute('SMEMBERS', f'{self.prefix}:tenants'))
+
+    def claim(self, keys, ttl):
+        """以 SET NX 登記 keys（ttl 秒後過期），任何一個已存在就回傳 False；供 webhook 事件去重跨機器共用"""
+        replies = self._call(*(
+            ('SET', f'{self.prefix}:seen:{key}', 1, 'NX', 'PX', max(1, int(ttl * 1000))) for key in keys
+        ))
+        for reply in replies:
+            if isinstance(reply, RedisError):
+                raise reply
+        return all(reply == 'OK' for reply in replies)
+
+
+def migrate_to_redis(source, url=REDIS_URL, prefix=REDIS_PREFIX):
+    """一次性把另一個後端（例如 JsonBackend 或 SqliteBackend）的所有租戶搬到 Redis，回傳搬移的月份數"""
+    target = RedisBackend(url, prefix)
+    count = 0
+    for tenant_id in source.list_tenants():
+        target.save_config(tenant_id, source.load_config(tenant_id))
+        schedules = source.load_schedules(tenant_id)
+        target.save_schedules(tenant_id, schedules)
+        count += len(schedules)
+    return count
@@ -0,0 +1,210 @@
+"""每週輪值提醒
+
+每個租戶在堆積（heap）中只有一筆「下次提醒時間」，背景執行緒睡到最早的那一筆到期，
+把所有到期的租戶一起處理，不需要定時輪詢每個租戶。
+
+已提醒的週次記錄在租戶設定的 last_reminded（該週星期一的日期），
+先在交易中登記再發送，因此重新啟動或多個程序同時執行都不會重複提醒；
+發送失敗時取消該租戶的登記，RETRY_DELAY 秒後重試。
+重新啟動時若本週的提醒時間已過但還沒提醒，會立即補發。
+"""
+from datetime import datetime, time as dtime, timedelta
+import heapq
+import threading
+import time
+from zoneinfo import ZoneInfo
+
+from linebot.models import TextSendMessage
+
+from .calendar_index import week_containing
+from .db import DEFAULT_TENANT, list_tenants, load_config, retry_on_conflict, transaction
+from .tracing import warn
+from .ui import create_main_menu
+from .utils import generate_schedule
+from config import REMINDER_TIMEZONE, REMINDER_HOUR, REMINDER_DEFAULT_TO, REMINDER_BATCH_SIZE
+
+
+class ReminderScheduler:
+    # 產生或推播失敗時多久後重試（秒）
+    RETRY_DELAY = 300
+
+    def __init__(self, delivery, hour=REMINDER_HOUR, timezone=REMINDER_TIMEZONE,
+                 default_to=REMINDER_DEFAULT_TO, batch_size=REMINDER_BATCH_SIZE, clock=time.time):
+        self.delivery = delivery
+        self.hour = hour
+        self.tz = ZoneInfo(timezone)
+        self.default_to = default_to
+        self.batch_size = batch_size
+        self.clock = clock
+        self.sent = 0
+        self._heap = []  # (下次提醒的 timestamp, tenant_id)
+        self._tracked = set()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _now(self):
+        return datetime.fromtimestamp(self.clock(), self.tz)
+
+    def _week_slot(self, now):
+        """now 所在這週的 (星期一日期, 提醒時間)"""
+        monday = now.date() - timedelta(days=now.weekday())
+        return monday, datetime.combine(monday, dtime(self.hour), self.tz)
+
+    def _next_fire(self, now, last_reminded):
+        monday, slot = self._week_slot(now)
+        if now >= slot and last_reminded != monday.isoformat():
+            return now.timestamp()  # 本週的提醒時間已過但還沒提醒：立即補發
+        if now < slot:
+            return slot.timestamp()
+        return (slot + timedelta(days=7)).timestamp()
+
+    def target_of(self, tenant_id):
+        """提醒要推播給誰：租戶 ID 就是群組／聊天室／使用者 ID，預設租戶則用 REMINDER_DEFAULT_TO"""
+        if tenant_id == DEFAULT_TENANT:
+            return self.default_to or None
+        return tenant_id
+
+    def track(self, tenant_id, now=None, last_reminded=None):
+        if tenant_id in self._tracked or self.target_of(tenant_id) is None:
+            return
+        now = now or self._now()
+        self._tracked.add(tenant_id)
+        heapq.heappush(self._heap, (self._next_fire(now, last_reminded), tenant_id))
+
+    def sync_tenants(self, now=None):
+        """把新出現的租戶加入堆積（已追蹤的租戶不會重複加入）"""
+        now = now or self._now()
+        for tenant_id in list_tenants():
+            if tenant_id not in self._tracked and self.target_of(tenant_id) is not None:
+                self.track(tenant_id, now, load_config(tenant_id).get('last_reminded'))
+
+    @retry_on_conflict
+    def _claim(self, tenant_id, now):
+        """登記本週已提醒，回傳 (要推播的訊息, 登記前的 last_reminded)；本週已經提醒過則訊息為 None"""
+        monday, _ = self._week_slot(now)
+        year, month, week_num = week_containing(now.date())
+        with transaction(tenant_id) as tx:
+            previous = tx.load_config().get('last_reminded')
+            if previous == monday.isoformat():
+                return None, previous
+            schedules, _ = generate_schedule(year, month, tenant_id)
+            config = tx.load_config()
+            config['last_reminded'] = monday.isoformat()
+            tx.save_config(config)
+            tx.log('reminded', week=monday.isoformat())
+
+        if isinstance(schedules, str):
+            return None, previous
+        for schedule in schedules:
+            if schedule['week_num'] == week_num:
+                return [TextSendMessage(
+                    text=(
+                        f"🗑️ 本週輪到 {schedule['roommate']} 倒垃圾！\n"
+                        f"{schedule['start_date']} ~ {schedule['end_date']}"
+                    ),
+                    quick_reply=create_main_menu()
+                )], previous
+        return None, previous
+
+    @retry_on_conflict
+    def _release(self, tenant_id, week, previous):
+        """推播失敗時取消本週的登記（恢復成登記前的值），重試時才會再發送"""
+        with transaction(tenant_id) as tx:
+            config = tx.load_config()
+            if config.get('last_reminded') != week:
+                return
+            config['last_reminded'] = previous
+            tx.save_config(config)
+            tx.log('reminder_failed', week=week)
+
+    def _retry(self, tenant_id, now):
+        heapq.heappush(self._heap, (now.timestamp() + self.RETRY_DELAY, tenant_id))
+
+    def run_due(self):
+        """處理所有到期的租戶，回傳發送的提醒數"""
+        now = self._now()
+        if self._heap and self._heap[0][0] > now.timestamp():
+            return 0
+        # 到期（或還沒有任何租戶）時才重新掃描租戶清單，新租戶本週沒提醒過也會在這一批發送
+        self.sync_tenants(now)
+
+        due = []
+        while self._heap and self._heap[0][0] <= now.timestamp():
+            _, tenant_id = heapq.heappop(self._heap)
+            due.append(tenant_id)
+
+        week = self._week_slot(now)[0].isoformat()
+        sent = 0
+        pushes = []
+        for tenant_id in due:
+            try:
+                messages, previous = self._claim(tenant_id, now)
+            except Exception as e:
+                warn("提醒產生失敗，稍後重試", e, tenant=tenant_id)
+                self._retry(tenant_id, now)
+                continue
+            if messages:
+                pushes.append((tenant_id, messages, previous))
+            else:
+                heapq.heappush(self._heap, (self._next_fire(now, week), tenant_id))
+            if len(pushes) >= self.batch_size:
+                sent += self._send(pushes, now)
+                pushes = []
+        if pushes:
+            sent += self._send(pushes, now)
+        self.sent += sent
+        return sent
+
+    def _send(self, pushes, now):
+        """發送一批提醒，回傳成功數；沒送出的租戶取消本週的登記，RETRY_DELAY 秒後重試"""
+        week = self._week_slot(now)[0].isoformat()
+        # 群組與聊天室只能逐一 push；一對一聊天的使用者內容相同時由 send_pushes 合併成 multicast
+        try:
+            failed = self.delivery.send_pushes([
+                (self.target_of(tenant_id), messages) for tenant_id, messages, _ in pushes
+            ])
+        except Exception as e:
+            failed = {self.target_of(tenant_id): e for tenant_id, _, _ in pushes}
+        sent = 0
+        for tenant_id, _, previous in pushes:
+            error = failed.get(self.target_of(tenant_id))
+            if error is None:
+                sent += 1
+                heapq.heappush(self._heap, (self._next_fire(now, week), tenant_id))
+                continue
+            warn("提醒推播失敗，稍後重試", error, tenant=tenant_id)
+            try:
+                self._release(tenant_id, week, previous)
+            except Exception as e:
+                warn("取消提醒登記失敗，本週的提醒不會重試", e, tenant=tenant_id)
+            self._retry(tenant_id, now)
+        return sent
+
+    def seconds_until_next(self):
+        now = self._now()
+        # 沒有租戶時也要在下一個提醒時間醒來，看看是否有新租戶
+        _, slot = self._week_slot(now)
+        wake = slot.timestamp() if now < slot else (slot + timedelta(days=7)).timestamp()
+        if self._heap:
+            wake = min(wake, self._heap[0][0])
+        return max(0.0, wake - now.timestamp())
+
+    def _run(self):
+        self.sync_tenants()
+        while not self._stop.is_set():
+            self.run_due()
+            if self._heap and self._heap[0][0] <= self.clock():
+                continue
+            # 最多睡一小時，避免系統時間調整或機器休眠後錯過提醒
+            self._stop.wait(min(self.seconds_until_next(), 3600))
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="reminder-scheduler", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=5):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
@@ -0,0 +1,170 @@
+"""月份排程的預先產生（ROLLOVER_ENABLED=1）
+
+每個月第一次「查看本月排程」原本要在使用者的請求中計算週次、輪值並寫回儲存。
+背景執行緒改為在每個月最後 ROLLOVER_DAYS 天預先產生接下來 ROLLOVER_MONTHS 個月，
+平常也會補上還沒產生的本月（例如機器剛啟動），使用者的請求只需要讀取。
+同一個工作也負責把超出 HISTORY_HOT_MONTHS 的月份移到封存檔（見 core/archive.py）。
+
+同一個月份只會由一個呼叫者產生：同一個程序內以 SingleFlight 合併，其他程序（或其他機器）
+則由 generate_schedule 的交易保證，晚到的一方只會讀到已產生的結果。
+
+注意：預先產生後，「設定下個室友」只影響再下一個還沒產生的月份。
+"""
+from datetime import date, datetime
+import threading
+import time
+from zoneinfo import ZoneInfo
+
+from .db import DEFAULT_TENANT, list_tenants, load_config, load_month_schedule
+from .metrics import Counter
+from .tracing import warn
+from .utils import add_months, generate_schedule, project_schedules, rotation_anchor
+from config import ROLLOVER_DAYS, ROLLOVER_MONTHS, ROLLOVER_INTERVAL, ROLLOVER_TIMEZONE
+
+
+GENERATED = Counter('tottmigo_months_generated_total', '產生的月份排程數（依由誰產生）', ['source'])
+
+
+class SingleFlight:
+    """同一個 key 同時只執行一次：執行中的其他呼叫者等待並取得同一個結果（或例外）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, func):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = {'done': threading.Event()}
+        if not leader:
+            call['done'].wait()
+            if 'error' in call:
+                raise call['error']
+            return call['result']
+        try:
+            call['result'] = func()
+        except BaseException as e:
+            call['error'] = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call['done'].set()
+        return call['result']
+
+
+_flight = SingleFlight()
+
+def _generate(year, month, tenant_id):
+    return _flight.do((tenant_id, year, month), lambda: generate_schedule(year, month, tenant_id))
+
+def month_schedule(year, month, tenant_id=DEFAULT_TENANT):
+    """使用者查看某個月的排程：只讀取預先產生的結果
+
+    背景工作還沒產生時（例如機器剛啟動）才退回在請求中產生，同時間的其他請求等待同一份結果。
+    回傳值與 generate_schedule 相同：(schedules 或錯誤訊息, config)
+    """
+    existing = load_month_schedule(year, month, tenant_id)
+    if existing is not None:
+        return existing['schedules'], load_config(tenant_id)
+    GENERATED.labels('request').inc()
+    return _generate(year, month, tenant_id)
+
+def next_month_starter(year, month, config, tenant_id=DEFAULT_TENANT):
+    """(year, month) 的下個月第一週輪到的室友
+
+    下個月可能已經預先產生，這時設定中的 next_roommate_index 已經指向再下一個月，
+    因此以儲存的下個月第一週為準，還沒產生時才由設定推算。
+    """
+    next_year, next_month = add_months(year, month, 1)
+    existing = load_month_schedule(next_year, next_month, tenant_id)
+    if existing is not None:
+        schedules = existing['schedules']
+    else:
+        [(_, _, schedules)] = project_schedules(config, next_year, next_month, 1, year, month)
+    return schedules[0]['roommate']
+
+def months_to_prepare(today, days=ROLLOVER_DAYS, months_ahead=ROLLOVER_MONTHS):
+    """today 時應該已經產生的月份：本月，月底前 days 天內再加上之後 months_ahead 個月"""
+    months = [(today.year, today.month)]
+    year, month = add_months(today.year, today.month, 1)
+    if (date(year, month, 1) - today).days <= days:
+        months += [add_months(today.year, today.month, i) for i in range(1, months_ahead + 1)]
+    return months
+
+def prepare_tenant(tenant_id, months):
+    """依序產生租戶還沒產生的月份，回傳產生的月份數
+
+    只產生輪到或超過下一個要產生的月份，依序產生才不會讓較晚的月份先用掉起始室友。
+    """
+    generated = 0
+    for year, month in months:
+        if load_month_schedule(year, month, tenant_id) is not None:
+            continue
+        if rotation_anchor(load_config(tenant_id), year, month)[:2] > (year, month):
+            continue
+        _generate(year, month, tenant_id)
+        GENERATED.labels('background').inc()
+        generated += 1
+    return generated
+
+
+class RolloverScheduler:
+
+    def __init__(self, days=ROLLOVER_DAYS, months_ahead=ROLLOVER_MONTHS, interval=ROLLOVER_INTERVAL,
+                 timezone=ROLLOVER_TIMEZONE, clock=time.time):
+        self.days = days
+        self.months_ahead = months_ahead
+        self.interval = interval
+        self.tz = ZoneInfo(timezone)
+        self.clock = clock
+        self.generated = 0
+        self.archived = 0
+        self._archived_through = {}  # tenant_id -> 已封存到哪個保留範圍（每個月只需要做一次）
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _today(self):
+        return datetime.fromtimestamp(self.clock(), self.tz).date()
+
+    def run_once(self):
+        """檢查所有租戶並產生缺少的月份（順便把超出保留範圍的月份封存），回傳產生的月份數"""
+        today = self._today()
+        months = months_to_prepare(today, self.days, self.months_ahead)
+        generated = 0
+        for tenant_id in list_tenants():
+            try:
+                generated += prepare_tenant(tenant_id, months)
+                self._archive(tenant_id, today)
+            except Exception as e:
+                warn("排程預先產生失敗", e, tenant=tenant_id)
+        self.generated += generated
+        return generated
+
+    def _archive(self, tenant_id, today):
+        from .archive import archive_old_months, archiving_enabled, hot_cutoff
+
+        if not archiving_enabled():
+            return
+        cutoff = hot_cutoff(today)
+        if self._archived_through.get(tenant_id) != cutoff:
+            self.archived += archive_old_months(today, tenant_id)
+            self._archived_through[tenant_id] = cutoff
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.run_once()
+            self._stop.wait(self.interval)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="rollover", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=5):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
@@ -0,0 +1,137 @@
+"""請求追蹤與結構化（JSON）日誌
+
+每個 /callback 請求有一個追蹤 ID（沿用 Fly-Request-Id 或 X-Request-Id，沒有就新產生），
+以 contextvars 傳遞：同一個請求中的儲存讀寫、排程計算、Flex 產生與 LINE API 呼叫
+（metrics.stage 的計時）都會記成這個追蹤的 span。
+
+請求結束時超過 TRACE_SLOW_MS 毫秒就輸出一行 slow_request 日誌（含每個 span 的耗時），
+其餘請求依 TRACE_SAMPLE_RATE 抽樣輸出。所有日誌都是一行一個 JSON 物件，寫到 stdout。
+"""
+import contextvars
+from contextlib import contextmanager
+import json
+import random
+import sys
+import threading
+import time
+import traceback
+import uuid
+
+from config import TRACE_SLOW_MS, TRACE_SAMPLE_RATE, TRACE_MAX_SPANS
+
+
+# 沿用上游已經產生的請求 ID（依序檢查），日誌才能與 Fly 的代理紀錄對應
+TRACE_ID_HEADERS = ('Fly-Request-Id', 'X-Request-Id')
+
+_current = contextvars.ContextVar('trace', default=None)
+_write_lock = threading.Lock()
+
+
+def log(event, level='info', **fields):
+    """輸出一行 JSON 日誌；在追蹤中時自動帶上 trace_id"""
+    record = {'ts': round(time.time(), 3), 'level': level, 'event': event}
+    trace = _current.get()
+    if trace is not None:
+        record['trace_id'] = trace.trace_id
+    record.update(fields)
+    line = json.dumps(record, ensure_ascii=False, default=str)
+    with _write_lock:
+        sys.stdout.write(line + '\n')
+        sys.stdout.flush()
+
+def warn(message, error=None, **fields):
+    """警告日誌；有例外時附上例外與 traceback"""
+    if error is not None:
+        fields['error'] = repr(error)
+        fields['traceback'] = ''.join(traceback.format_exception(type(error), error, error.__traceback__))
+    log('warning', level='warning', message=message, **fields)
+
+
+class Trace:
+    __slots__ = ('trace_id', 'name', 'started', 'spans', 'dropped', 'attrs')
+
+    def __init__(self, name, trace_id=None, **attrs):
+        self.trace_id = trace_id or self.new_id()
+        self.name = name
+        self.started = time.perf_counter()
+        self.spans = []  # (名稱, 開始時間相對於請求開始的秒數, 耗時秒數)
+        self.dropped = 0
+        self.attrs = attrs
+
+    @staticmethod
+    def new_id():
+        return uuid.uuid4().hex[:16]
+
+    def add_span(self, name, duration):
+        if len(self.spans) >= TRACE_MAX_SPANS:
+            self.dropped += 1
+            return
+        self.spans.append((name, time.perf_counter() - self.started - duration, duration))
+
+    def finish(self):
+        duration = time.perf_counter() - self.started
+        slow = duration * 1000 >= TRACE_SLOW_MS
+        if not slow and (not TRACE_SAMPLE_RATE or random.random() >= TRACE_SAMPLE_RATE):
+            return
+        fields = dict(self.attrs)
+        fields.update(
+            trace_id=self.trace_id,
+            name=self.name,
+            duration_ms=round(duration * 1000, 2),
+            spans=[
+                {'name': name, 'start_ms': round(start * 1000, 2), 'duration_ms': round(span * 1000, 2)}
+                for name, start, span in self.spans
+            ],
+        )
+        if self.dropped:
+            fields['dropped_spans'] = self.dropped
+        log('slow_request' if slow else 'request', level='warning' if slow else 'info', **fields)
+
+
+@contextmanager
+def trace(name, trace_id=None, **attrs):
+    """開始一個請求追蹤；巢狀呼叫（例如 ASGI 入口呼叫共用的處理）沿用外層的追蹤"""
+    current = _current.get()
+    if current is not None:
+        current.attrs.update(attrs)
+        yield current
+        return
+    current = Trace(name, trace_id, **attrs)
+    token = _current.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.attrs['error'] = repr(e)
+        raise
+    finally:
+        _current.reset(token)
+        current.finish()
+
+def trace_id_from(get_header):
+    """從請求標頭取得追蹤 ID（get_header(名稱) 回傳字串或 None），沒有時回傳 None"""
+    for name in TRACE_ID_HEADERS:
+        value = get_header(name)
+        if value:
+            return value[:64]
+    return None
+
+def record_span(name, duration):
+    """在目前的追蹤中記錄一個 span；不在追蹤中時什麼都不做"""
+    current = _current.get()
+    if current is not None:
+        current.add_span(name, duration)
+
+def annotate(**attrs):
+    """在目前的追蹤加上欄位（例如事件 ID、指令），slow_request 日誌中會一起輸出"""
+    current = _current.get()
+    if current is not None:
+        current.attrs.update(attrs)
+
+def current_trace_id():
+    current = _current.get()
+    return current.trace_id if current is not None else None
+
+def bind(func):
+    """把目前的 context（含追蹤）帶到其他執行緒，用於 run_in_executor 或背景佇列"""
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.run(func, *args, **kwargs)
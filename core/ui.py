@@ -1,25 +1,39 @@
+from collections import OrderedDict
+from datetime import date
+from functools import lru_cache
+import threading
+
 from linebot.models import (
     QuickReply, QuickReplyButton, MessageAction,
     FlexSendMessage, BubbleContainer, BoxComponent,
     TextComponent
 )
 
-from config import ROOMMATES
+from .calendar_index import week_containing
+from .metrics import register_collector, stage
+from config import FLEX_CACHE_SIZE
 
+@lru_cache(maxsize=1)
 def create_main_menu():
-    """建立主選單"""
+    """建立主選單（只建立一次，之後重複使用同一個物件）"""
     quick_reply_buttons = [
         QuickReplyButton(action=MessageAction(label="📅 查看本月排程", text="查看本月排程")),
         QuickReplyButton(action=MessageAction(label="👤 設定下個室友", text="設定下個室友")),
         QuickReplyButton(action=MessageAction(label="📝 更改本月排程", text="更改本月排程")),
+        QuickReplyButton(action=MessageAction(label="🔮 查看未來排程", text="查看未來排程")),
+        QuickReplyButton(action=MessageAction(label="📊 輪值統計", text="統計")),
     ]
     
     return QuickReply(items=quick_reply_buttons)
 
-def create_roommate_selection():
-    """建立室友選擇選單"""
+def create_roommate_selection(roommates):
+    """建立室友選擇選單，同一份名單只建立一次"""
+    return _roommate_selection(tuple(roommates))
+
+@lru_cache(maxsize=256)
+def _roommate_selection(roommates):
     quick_reply_buttons = []
-    for i, roommate in enumerate(ROOMMATES):
+    for i, roommate in enumerate(roommates):
         quick_reply_buttons.append(
             QuickReplyButton(action=MessageAction(label=roommate, text=f"選擇室友{i}"))
         )
@@ -29,9 +43,12 @@ def create_roommate_selection():
     
     return QuickReply(items=quick_reply_buttons)
 
-def create_schedule_flex_message(schedules, year, month):
-    """建立排程的 Flex Message"""
+def create_schedule_flex_message(schedules, year, month, today=None):
+    """建立排程的 Flex Message，本週的排程會特別標示"""
     contents = []
+    current_year, current_month, current_week = week_containing(today or date.today())
+    if (current_year, current_month) != (year, month):
+        current_week = None
     
     # 標題
     contents.append(
@@ -50,11 +67,12 @@ def create_schedule_flex_message(schedules, year, month):
     
     # 排程內容
     for schedule in schedules:
+        is_current = schedule['week_num'] == current_week
         contents.append(
             TextComponent(
-                text=f"第{schedule['week_num']}週：{schedule['roommate']}",
+                text=f"{'👉 ' if is_current else ''}第{schedule['week_num']}週：{schedule['roommate']}",
                 weight="bold",
-                color="#333333"
+                color="#1DB446" if is_current else "#333333"
             )
         )
         contents.append(
@@ -75,4 +93,48 @@ def create_schedule_flex_message(schedules, year, month):
         )
     )
     
-    return FlexSendMessage(alt_text=f"{year}年{month}月排程", contents=bubble)
\ No newline at end of file
+    return FlexSendMessage(alt_text=f"{year}年{month}月排程", contents=bubble)
+
+
+# 預先序列化的排程 Flex Message：(租戶, 年, 月) -> (版本, 本週週次, payload)
+_flex_cache = OrderedDict()
+_flex_lock = threading.Lock()
+flex_cache_stats = {'hits': 0, 'misses': 0}
+_FLEX_RENDER = stage('flex_render')
+
+def _collect_flex_cache():
+    return [('tottmigo_flex_cache_total', 'counter', 'Flex Message 快取查詢次數',
+             [({'result': result}, count) for result, count in flex_cache_stats.items()])]
+
+register_collector(_collect_flex_cache)
+
+def schedule_version(schedules):
+    """排程內容的版本：日期由年月決定，因此各週的室友就能代表整個月份的內容
+
+    generate_schedule 或 update_schedules_for_weeks 寫入不同的室友後版本就會改變，
+    舊的快取自然失效，多個程序之間也不需要另外通知。
+    """
+    return tuple(schedule['roommate'] for schedule in schedules)
+
+def schedule_flex_payload(schedules, year, month, today=None, tenant_id=''):
+    """回傳排程 Flex Message 已序列化的 JSON（dict），命中快取時不必重建元件樹"""
+    today = today or date.today()
+    key = (tenant_id, year, month)
+    version = schedule_version(schedules)
+    current_week = week_containing(today)
+    with _flex_lock:
+        cached = _flex_cache.get(key)
+        if cached is not None and cached[0] == version and cached[1] == current_week:
+            _flex_cache.move_to_end(key)
+            flex_cache_stats['hits'] += 1
+            return cached[2]
+
+    with _FLEX_RENDER.time():
+        payload = create_schedule_flex_message(schedules, year, month, today).as_json_dict()
+    with _flex_lock:
+        flex_cache_stats['misses'] += 1
+        _flex_cache[key] = (version, current_week, payload)
+        _flex_cache.move_to_end(key)
+        while len(_flex_cache) > FLEX_CACHE_SIZE:
+            _flex_cache.popitem(last=False)
+    return payload
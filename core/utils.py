@@ -1,99 +1,315 @@
-import calendar
-from .db import load_config, save_config, load_schedules, save_schedules
-from config import ROOMMATES
+from datetime import date
+
+from .calendar_index import week_ranges, weeks_between, weeks_of_month
+from .db import DEFAULT_TENANT, load_config, load_month_schedule, retry_on_conflict, transaction
+from .metrics import stage, timed
+from config import ROOMMATES, SCHEDULE_MODE
 
 
 def get_weeks_of_month(year, month):
-    """取得一個月的週次，根據規則過濾"""
-    c = calendar.Calendar(firstweekday=calendar.MONDAY)
-    all_weeks = []
-    
-    for week in c.monthdatescalendar(year, month):
-        week_start = week[0]
-        week_end = week[-1]
-        
-        # 如果週的開始日期在上個月，則跳過
-        if week_start.month < month or (week_start.month == 12 and month == 1):
-            continue
-            
-        # 如果這週有任何一天在這個月，就納入
-        if any(day.month == month for day in week):
-            all_weeks.append(week)
-    
-    return all_weeks
-
-def generate_schedule(year, month):
-    """產生排程（只在第一次產生該月時才寫入，否則直接讀取）"""
-    schedules_all = load_schedules()
-    key = f"{year}-{month}"
-    config = load_config()
+    """取得一個月的週次，根據規則過濾（第一週如從上個月開始則不算，最後一週可跨到下個月）"""
+    return [
+        [date.fromordinal(ordinal) for ordinal in range(start, end + 1)]
+        for start, end in weeks_of_month(year, month)
+    ]
+
+def get_roommates(config):
+    """租戶的室友名單：群組自己設定過就用群組的，否則使用環境變數 ROOMMATES"""
+    return config.get('roommates') or ROOMMATES
 
-    # 若該月已存在，直接回傳
-    if key in schedules_all:
-        return schedules_all[key]['schedules'], config
+def _build_month_schedules(weeks, start_index, roommates):
+    """依起始室友索引排出一個月每週的輪值"""
+    return [
+        {
+            'roommate': roommates[(start_index + i) % len(roommates)],
+            'start_date': start_date,
+            'end_date': end_date,
+            'week_num': i + 1
+        }
+        for i, (start_date, end_date) in enumerate(weeks)
+    ]
 
-    weeks = get_weeks_of_month(year, month)
-    if not weeks:
-        return "本月沒有符合條件的週次", config
+def _build_balanced_schedules(weeks, start_index, roommates, counts, credit):
+    """平衡模式：每週排給「累計週數 + 補償週數」最少的室友，同分時依輪值順序（從 start_index 起）
 
+    大家週數相同時結果與依序輪流一樣。counts 會就地累加，回傳 (schedules, 下一個起始室友索引)。
+    """
     schedules = []
-    current_roommate_index = config['next_roommate_index']
-    for i, week in enumerate(weeks):
-        start_day = week[0]
-        end_day = week[-1]
-        roommate_index = (current_roommate_index + i) % len(ROOMMATES)
-        roommate = ROOMMATES[roommate_index]
-        schedule_info = {
+    cursor = start_index
+    for i, (start_date, end_date) in enumerate(weeks):
+        index = min(
+            range(len(roommates)),
+            key=lambda j: (counts.get(roommates[j], 0) + credit.get(roommates[j], 0), (j - cursor) % len(roommates))
+        )
+        roommate = roommates[index]
+        counts[roommate] = counts.get(roommate, 0) + 1
+        schedules.append({
             'roommate': roommate,
-            'start_date': start_day.strftime('%Y/%m/%d'),
-            'end_date': end_day.strftime('%Y/%m/%d'),
+            'start_date': start_date,
+            'end_date': end_date,
             'week_num': i + 1
-        }
-        schedules.append(schedule_info)
-
-    # 更新下一個月的起始室友索引
-    next_roommate_index = (current_roommate_index + len(weeks)) % len(ROOMMATES)
-    config['next_roommate_index'] = next_roommate_index
-    config['last_updated_year'] = year
-    config['last_updated_month'] = month
-    save_config(config)
-
-    # 寫入該月排程
-    schedules_all[key] = {
-        'schedules': schedules
-    }
-    save_schedules(schedules_all)
+        })
+        cursor = (index + 1) % len(roommates)
+    return schedules, cursor
+
+def _count_weeks(counts, schedules, delta=1):
+    for schedule in schedules:
+        counts[schedule['roommate']] = counts.get(schedule['roommate'], 0) + delta
+
+def _load_duty_counts(tx, config):
+    """租戶每位室友累計的輪值週數（存在設定的 duty_counts，每次排班時增量更新）
+
+    舊資料還沒有計數時掃描一次全部歷史建立，之後不需要再讀歷史。
+    """
+    counts = config.get('duty_counts')
+    if counts is None:
+        counts = {}
+        for entry in tx.load_schedules().values():
+            _count_weeks(counts, entry['schedules'])
+        config['duty_counts'] = counts
+    return counts
+
+def next_month(year, month):
+    if month == 12:
+        return year + 1, 1
+    return year, month + 1
+
+def add_months(year, month, count):
+    total = year * 12 + (month - 1) + count
+    return total // 12, total % 12 + 1
+
+def rotation_anchor(config, default_year, default_month):
+    """輪值的錨點 (year, month, 起始室友索引)：下一個要產生的月份從哪個室友開始
+
+    尚未產生過任何排程時，以 (default_year, default_month) 作為下一個要產生的月份。
+    """
+    if config['last_updated_year'] is None or config['last_updated_month'] is None:
+        return default_year, default_month, config['next_roommate_index']
+    year, month = next_month(config['last_updated_year'], config['last_updated_month'])
+    return year, month, config['next_roommate_index']
+
+@timed(stage('schedule_project'))
+def project_schedules(config, start_year, start_month, count, default_year=None, default_month=None):
+    """不需依序產生中間月份，直接以閉合公式算出連續 count 個月的輪值
+
+    某週的室友 = (錨點室友 + 錨點月初到該月初的累計週數 + 週次 - 1) % 室友數，
+    累計週數由週次索引的前綴和取得，因此每個月都是 O(1)，一次可算出一年或十年。
+    回傳 [(year, month, schedules), ...]
+    """
+    anchor_year, anchor_month, anchor_index = rotation_anchor(
+        config, default_year or start_year, default_month or start_month
+    )
+    roommates = get_roommates(config)
+    months = [add_months(start_year, start_month, i) for i in range(count)]
+    balanced = {}
+    if SCHEDULE_MODE == 'balanced':
+        balanced = _project_balanced(config, roommates, anchor_year, anchor_month, anchor_index, months)
+    return [
+        (year, month, balanced[(year, month)] if (year, month) in balanced else _build_month_schedules(
+            week_ranges(year, month),
+            (anchor_index + weeks_between(anchor_year, anchor_month, year, month)) % len(roommates),
+            roommates
+        ))
+        for year, month in months
+    ]
+
+def _project_balanced(config, roommates, anchor_year, anchor_month, anchor_index, months):
+    """平衡模式的推算：取決於累計週數，沒有閉合公式，只能從錨點逐月模擬到最後一個要查看的月份
+
+    錨點之前的月份不在回傳結果中（沿用依序輪流的公式）。
+    """
+    counts = dict(config.get('duty_counts') or {})
+    credit = config.get('duty_credit') or {}
+    wanted = set(months)
+    last = max(months)
+    projected = {}
+    year, month, index = anchor_year, anchor_month, anchor_index
+    while (year, month) <= last:
+        schedules, index = _build_balanced_schedules(week_ranges(year, month), index, roommates, counts, credit)
+        if (year, month) in wanted:
+            projected[(year, month)] = schedules
+        year, month = next_month(year, month)
+    return projected
+
+def get_future_schedule(year, month, today, tenant_id=DEFAULT_TENANT):
+    """查看某個月的排程：已產生的月份直接讀取，未來的月份即時推算（不寫入）
+
+    回傳 (schedules, 是否為推算結果)
+    """
+    existing = load_month_schedule(year, month, tenant_id)
+    config = load_config(tenant_id)
+    if existing is not None:
+        return existing['schedules'], False
+    [(_, _, schedules)] = project_schedules(config, year, month, 1, today.year, today.month)
+    return schedules, True
+
+@timed(stage('schedule_generate'))
+@retry_on_conflict
+def generate_schedule(year, month, tenant_id=DEFAULT_TENANT):
+    """產生排程（只在第一次產生該月時才寫入，否則直接讀取）"""
+    with transaction(tenant_id) as tx:
+        existing = tx.load_month(year, month)
+        config = tx.load_config()
+
+        # 若該月已存在，直接回傳
+        if existing is not None:
+            return existing['schedules'], config
+
+        weeks = week_ranges(year, month)
+        if not weeks:
+            return "本月沒有符合條件的週次", config
+
+        roommates = get_roommates(config)
+        current_roommate_index = config['next_roommate_index']
+        counts = _load_duty_counts(tx, config)
+        if SCHEDULE_MODE == 'balanced':
+            schedules, next_roommate_index = _build_balanced_schedules(
+                weeks, current_roommate_index, roommates, counts, config.get('duty_credit') or {}
+            )
+        else:
+            schedules = _build_month_schedules(weeks, current_roommate_index, roommates)
+            next_roommate_index = (current_roommate_index + len(weeks)) % len(roommates)
+            _count_weeks(counts, schedules)
+
+        # 更新下一個月的起始室友索引
+        config['next_roommate_index'] = next_roommate_index
+        config['last_updated_year'] = year
+        config['last_updated_month'] = month
+        tx.save_config(config)
+        tx.log('generated', year=year, month=month, start_index=current_roommate_index)
+
+        # 寫入該月排程
+        tx.save_month(year, month, {
+            'schedules': schedules
+        })
     return schedules, config
 
-def set_next_roommate_index(roommate_index):
+@retry_on_conflict
+def set_next_roommate_index(roommate_index, tenant_id=DEFAULT_TENANT):
     """設定下一個輪到的室友"""
-    config = load_config()
-    if 0 <= roommate_index < len(ROOMMATES):
+    with transaction(tenant_id) as tx:
+        config = tx.load_config()
+        roommates = get_roommates(config)
+        if not 0 <= roommate_index < len(roommates):
+            raise ValueError("無效的室友索引")
         config['next_roommate_index'] = roommate_index
-        save_config(config)
-        return ROOMMATES[roommate_index]
-    else:
-        raise ValueError("無效的室友索引")
+        tx.save_config(config)
+        tx.log('next_roommate_set', roommate=roommates[roommate_index])
+    return roommates[roommate_index]
 
-def update_schedules_for_weeks(year, month, week_roommate_map):
+@retry_on_conflict
+def set_roommates(roommates, tenant_id=DEFAULT_TENANT):
+    """設定群組自己的室友名單（已產生的排程不受影響）"""
+    if not roommates or len(set(roommates)) != len(roommates):
+        raise ValueError("室友名單不可為空或重複")
+    with transaction(tenant_id) as tx:
+        config = tx.load_config()
+        counts = _load_duty_counts(tx, config)
+        credit = config.get('duty_credit') or {}
+        previous = get_roommates(config)
+        staying = [name for name in roommates if name in previous]
+        if staying:
+            # 新加入的室友補到目前最少的人的週數，平衡模式才不會連續排給他好幾週
+            floor = min(counts.get(name, 0) + credit.get(name, 0) for name in staying)
+            for name in roommates:
+                if name not in previous:
+                    credit[name] = max(0, floor - counts.get(name, 0))
+        config['duty_credit'] = {name: credit[name] for name in roommates if credit.get(name)}
+        config['roommates'] = list(roommates)
+        if config['next_roommate_index'] >= len(roommates):
+            config['next_roommate_index'] = 0
+        tx.save_config(config)
+        tx.log('roommates_set', roommates=list(roommates))
+    return roommates
+
+@retry_on_conflict
+def update_schedules_for_weeks(year, month, week_roommate_map, tenant_id=DEFAULT_TENANT):
     """一次更改多個週次的排程室友，不影響下個月的起始室友
     week_roommate_map: dict {週次: 室友}
     """
-    schedules_all = load_schedules()
-    key = f"{year}-{month}"
-    if key not in schedules_all:
-        # 若該月份尚未產生排程，則立即建立本月排程
-        generate_schedule(year, month)
-        schedules_all = load_schedules()
-        
-    schedules = schedules_all[key]['schedules']
-    print(schedules)
-    for schedule in schedules:
-        week_num = schedule['week_num']
-        if week_num in week_roommate_map:
-            schedule['roommate'] = week_roommate_map[week_num]
-    
-    print(schedules)
-    schedules_all[key]['schedules'] = schedules
-    save_schedules(schedules_all)
-    return schedules
\ No newline at end of file
+    with transaction(tenant_id) as tx:
+        entry = tx.load_month(year, month)
+        if entry is None:
+            # 若該月份尚未產生排程，則立即建立本月排程
+            generate_schedule(year, month, tenant_id)
+            entry = tx.load_month(year, month)
+
+        # 先取得計數（可能需要掃描歷史），再改動排程
+        config = tx.load_config()
+        counts = _load_duty_counts(tx, config)
+        schedules = entry['schedules']
+        changes = []
+        for schedule in schedules:
+            week_num = schedule['week_num']
+            if week_num in week_roommate_map:
+                if schedule['roommate'] != week_roommate_map[week_num]:
+                    changes.append([week_num, schedule['roommate'], week_roommate_map[week_num]])
+                schedule['roommate'] = week_roommate_map[week_num]
+
+        entry['schedules'] = schedules
+        tx.save_month(year, month, entry)
+        if changes:
+            for week_num, old, new in changes:
+                counts[old] = counts.get(old, 0) - 1
+                counts[new] = counts.get(new, 0) + 1
+            tx.save_config(config)
+        tx.log('weeks_reassigned', year=year, month=month, changes=changes)
+    return schedules
+
+@retry_on_conflict
+def duty_statistics(tenant_id=DEFAULT_TENANT):
+    """每位室友累計的輪值週數，直接讀取增量維護的計數，成本只與室友人數有關
+
+    回傳 (目前的室友名單, {室友: 週數})，計數中可能包含已不在名單上的室友。
+    """
+    config = load_config(tenant_id)
+    if config.get('duty_counts') is None:
+        with transaction(tenant_id) as tx:
+            config = tx.load_config()
+            if config.get('duty_counts') is None:
+                _load_duty_counts(tx, config)
+                tx.save_config(config)
+    return get_roommates(config), dict(config['duty_counts'])
+
+@retry_on_conflict
+def import_schedules(assignments, tenant_id=DEFAULT_TENANT):
+    """一次匯入多個月份的輪值，全部在同一個交易內完成，結束時只寫回一次
+
+    assignments: {(year, month): {週次: 室友}}；尚未產生的月份先照一般流程產生（或推算），再套用指定的週次。
+    任何一筆無效就丟出 ValueError，整批都不會寫入。回傳實際變更的週數。
+    """
+    with transaction(tenant_id) as tx:
+        config = tx.load_config()
+        roommates = get_roommates(config)
+        counts = _load_duty_counts(tx, config)
+        changed = 0
+        for (year, month), weeks in sorted(assignments.items()):
+            entry = tx.load_month(year, month)
+            anchor = rotation_anchor(config, year, month)[:2]
+            if entry is None and anchor <= (year, month):
+                # 輪到或超過下一個要產生的月份：從錨點依序照一般流程產生到這個月，
+                # 中間沒有匯入的月份也一起產生，輪值才會接續，下個月的起始室友也會跟著前進
+                while anchor <= (year, month):
+                    generate_schedule(*anchor, tenant_id)
+                    anchor = next_month(*anchor)
+                entry = tx.load_month(year, month)
+            elif entry is None:
+                [(_, _, schedules)] = project_schedules(config, year, month, 1)
+                entry = {'schedules': schedules}
+                _count_weeks(counts, schedules)
+            by_week = {schedule['week_num']: schedule for schedule in entry['schedules']}
+            for week_num, roommate in weeks.items():
+                if week_num not in by_week:
+                    raise ValueError(f"{year}/{month} 沒有第 {week_num} 週")
+                if roommate not in roommates:
+                    raise ValueError(f"{year}/{month} 第 {week_num} 週：未知的室友「{roommate}」")
+                old = by_week[week_num]['roommate']
+                if old != roommate:
+                    counts[old] = counts.get(old, 0) - 1
+                    counts[roommate] = counts.get(roommate, 0) + 1
+                    by_week[week_num]['roommate'] = roommate
+                    changed += 1
+            tx.save_month(year, month, entry)
+        tx.save_config(config)
+        tx.log('imported', months=[f"{year}/{month}" for year, month in sorted(assignments)], weeks=changed)
+    return changed
@@ -0,0 +1,54 @@
+"""冷啟動最佳化（FAST_START=1）
+
+Fly 機器閒置時會停止，第一個 webhook 要等程序重新啟動。入口程式只載入開始接受連線所需的模組，
+LINE SDK 等較重的模組延後到第一次使用時才載入；開啟 FAST_START 時，開始接受連線的同時
+在背景執行緒預先載入它們，並從快照還原儲存快取，第一個請求就不用再等。
+"""
+import atexit
+import signal
+import sys
+import threading
+
+from .db import load_snapshot, save_snapshot
+from .tracing import warn
+from config import SNAPSHOT_FILE
+
+
+def _run(loaders):
+    for loader in loaders:
+        try:
+            loader()
+        except Exception as e:
+            warn("預先載入失敗", e)
+
+def start(*loaders):
+    """還原快照、在背景依序執行 loaders，並在結束時寫回快照"""
+    if SNAPSHOT_FILE:
+        load_snapshot(SNAPSHOT_FILE)
+        atexit.register(_save)
+        _exit_on_sigterm()
+    thread = threading.Thread(target=_run, args=(loaders,), name="warmup", daemon=True)
+    thread.start()
+    return thread
+
+def _save():
+    try:
+        save_snapshot(SNAPSHOT_FILE)
+    except Exception as e:
+        warn("快照寫入失敗", e)
+
+def _exit_on_sigterm():
+    """SIGTERM 預設會直接結束程序、不執行 atexit；伺服器沒有自己處理時改為正常結束以寫回快照"""
+    if threading.current_thread() is not threading.main_thread():
+        return
+    if signal.getsignal(signal.SIGTERM) is signal.SIG_DFL:
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+def prepare_commands():
+    """載入指令處理（連帶 linebot.models）並建立常用的索引與選單"""
+    from .calendar_index import get_index
+    from .ui import create_main_menu
+    from . import commands  # noqa: F401
+
+    get_index()
+    create_main_menu()
@@ -1,60 +1,14 @@
-import calendar
-from datetime import date, timedelta
-import json
-import os
-
-roommates = ['室友A', '室友B', '室友C']
-CONFIG_FILE = 'roommate_config.json'
+"""手動驗證輪值規則的互動式工具
 
-def load_config():
-    """載入設定檔，如果不存在則建立預設設定"""
-    default_config = {
-        'next_roommate_index': 0,  # 下一個輪到的室友索引
-        'last_updated_month': None,  # 最後更新的月份
-        'last_updated_year': None   # 最後更新的年份
-    }
-    
-    if os.path.exists(CONFIG_FILE):
-        try:
-            with open(CONFIG_FILE, 'r', encoding='utf-8') as f:
-                config = json.load(f)
-                # 確保所有必要的鍵都存在
-                for key in default_config:
-                    if key not in config:
-                        config[key] = default_config[key]
-                return config
-        except:
-            pass
-    
-    return default_config
+週次與設定檔的讀寫直接使用 core 的實作，與 LINE Bot 的行為一致。
+效能量測請見 bench/。
+"""
+import calendar
 
-def save_config(config):
-    """儲存設定檔"""
-    try:
-        with open(CONFIG_FILE, 'w', encoding='utf-8') as f:
-            json.dump(config, f, ensure_ascii=False, indent=2)
-    except Exception as e:
-        print(f"警告：無法儲存設定檔: {e}")
+from core.db import load_config, save_config
+from core.utils import get_weeks_of_month
 
-def get_weeks_of_month(year, month):
-    """取得一個月的週次，根據新規則過濾"""
-    c = calendar.Calendar(firstweekday=calendar.MONDAY)
-    all_weeks = []
-    
-    for week in c.monthdatescalendar(year, month):
-        # 檢查這週是否應該包含在本月
-        week_start = week[0]
-        week_end = week[-1]
-        
-        # 如果週的開始日期在上個月，則跳過（第一週規則）
-        if week_start.month < month or (week_start.month == 12 and month == 1):
-            continue
-            
-        # 如果這週有任何一天在這個月，就納入（包含跨到下個月的最後一週）
-        if any(day.month == month for day in week):
-            all_weeks.append(week)
-    
-    return all_weeks
+roommates = ['室友A', '室友B', '室友C']
 
 def generate_schedule(year, month, show_debug=False):
     """產生排程並更新下一個輪到的室友"""
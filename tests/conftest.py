@@ -0,0 +1,12 @@
+import pytest
+
+from core import db
+
+
+@pytest.fixture
+def storage(tmp_path, monkeypatch):
+    """在暫存目錄中使用不經過快取與封存的 JSON 後端"""
+    monkeypatch.chdir(tmp_path)
+    db.set_backend(db.JsonBackend())
+    yield db.get_backend()
+    db.set_backend(None)
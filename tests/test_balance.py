@@ -0,0 +1,19 @@
+from core import utils
+from core.db import load_config, save_config
+from core.utils import duty_statistics, generate_schedule, set_roommates
+
+
+def test_null_credit_and_counts(storage, monkeypatch):
+    monkeypatch.setattr(utils, 'SCHEDULE_MODE', 'balanced')
+    set_roommates(['A', 'B'])
+    config = load_config()
+    config.update(duty_credit=None, duty_counts=None)
+    save_config(config)
+
+    assert duty_statistics() == (['A', 'B'], {})
+    set_roommates(['A', 'B', 'C'])
+    config = load_config()
+    config['duty_credit'] = None
+    save_config(config)
+    schedules, _ = generate_schedule(2025, 6)
+    assert {week['roommate'] for week in schedules} <= {'A', 'B', 'C'}
@@ -0,0 +1,16 @@
+from datetime import date
+
+from core.commands import handle_text, router
+from core.db import load_config
+from core.utils import set_roommates
+
+
+def test_set_roommates_needs_separator(storage):
+    set_roommates(['A', 'B'])
+    assert router.match('設定室友們好') is None
+    assert handle_text('設定室友們好', date(2025, 6, 1), '') is None
+
+    replies = handle_text('設定室友', date(2025, 6, 1), '')
+    assert replies[0].text.startswith('❌')
+    handle_text('設定室友　C D', date(2025, 6, 1), '')
+    assert load_config()['roommates'] == ['C', 'D']
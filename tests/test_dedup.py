@@ -0,0 +1,15 @@
+import sqlite3
+
+from core.dedup import EventDeduplicator
+
+
+def test_unavailable_store_lets_event_through(tmp_path, monkeypatch):
+    dedup = EventDeduplicator(path=str(tmp_path / 'dedup.db'))
+
+    def locked(*args):
+        raise sqlite3.OperationalError('database is locked')
+
+    monkeypatch.setattr(dedup, '_claim_persistent', locked)
+    assert dedup.seen('e:1') is False
+    # 同一個程序內仍以記憶體辨識重送
+    assert dedup.seen('e:1') is True
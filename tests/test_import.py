@@ -0,0 +1,19 @@
+from core.db import load_config, load_month_schedule
+from core.utils import generate_schedule, import_schedules, project_schedules, set_roommates
+
+
+def test_import_with_gap_keeps_rotation_continuous(storage):
+    set_roommates(['A', 'B', 'C'])
+    expected = {
+        (year, month): schedules
+        for year, month, schedules in project_schedules(load_config(), 2025, 1, 4, 2025, 1)
+    }
+
+    # 2 月沒有匯入：要依序產生，3 月才會接著 2 月輪下去
+    import_schedules({(2025, 1): {1: 'C'}, (2025, 3): {2: 'A'}})
+    generate_schedule(2025, 4)
+
+    expected[(2025, 1)][0]['roommate'] = 'C'
+    expected[(2025, 3)][1]['roommate'] = 'A'
+    for (year, month), schedules in expected.items():
+        assert load_month_schedule(year, month)['schedules'] == schedules, (year, month)
@@ -0,0 +1,20 @@
+from core import db
+from core.db import DEFAULT_TENANT, load_config, transaction
+from core.journal import JournalBackend
+from core.utils import set_roommates
+
+
+def test_undo_first_roster_removes_new_keys(storage):
+    journal = JournalBackend()
+    db.set_backend(journal)
+    before = load_config()
+
+    set_roommates(['A', 'B', 'C'])
+    with transaction():
+        journal.undo(DEFAULT_TENANT)
+    # 原本沒有的欄位要刪除，不能留下 null
+    assert load_config() == before
+    assert JournalBackend().load_config(DEFAULT_TENANT) == before
+
+    set_roommates(['A', 'B'])
+    assert load_config()['roommates'] == ['A', 'B']
@@ -0,0 +1,34 @@
+import pytest
+
+from core.db import _default_config, month_key
+from core.model import ScheduleHistory
+from core.utils import project_schedules
+
+
+def history_of(roommates, months=3):
+    config = _default_config()
+    config['roommates'] = roommates
+    return {
+        month_key(year, month): {'schedules': schedules}
+        for year, month, schedules in project_schedules(config, 2025, 1, months)
+    }
+
+
+@pytest.mark.parametrize('roommates', [[''], ['', 'A'], ['A', ''], ['A', '', 'B'], ['室友A', '室友B']])
+def test_round_trip(roommates):
+    schedules = history_of(roommates)
+    data = ScheduleHistory.from_dict(schedules).encode()
+    decoded = ScheduleHistory.decode(data)
+    assert decoded.to_dict() == schedules
+    assert decoded.encode() == data
+
+def test_round_trip_keeps_irregular_months():
+    schedules = history_of(['A', 'B'])
+    schedules['2024-12'] = {'schedules': [], 'note': '手動編輯'}
+    decoded = ScheduleHistory.decode(ScheduleHistory.from_dict(schedules).encode())
+    assert decoded.to_dict() == schedules
+
+def test_decode_rejects_truncated_data():
+    data = ScheduleHistory.from_dict(history_of(['A', 'B'])).encode()
+    with pytest.raises(ValueError):
+        ScheduleHistory.decode(data[:-1])
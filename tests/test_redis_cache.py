@@ -0,0 +1,48 @@
+import pytest
+
+from bench.redis_standin import RedisStandIn
+from core import db
+from core.db import CachedBackend, DEFAULT_TENANT, transaction
+from core.redis_store import RedisBackend
+from core.utils import set_next_roommate_index, set_roommates
+
+
+@pytest.fixture(scope='module')
+def redis_url():
+    return RedisStandIn().start().url
+
+
+@pytest.fixture
+def replicas(redis_url, request):
+    """兩台共用同一個 Redis 的機器，各自有自己的快取"""
+    prefix = f'test-{request.node.name}'
+    yield CachedBackend(RedisBackend(redis_url, prefix)), CachedBackend(RedisBackend(redis_url, prefix))
+    db.set_backend(None)
+
+
+def test_write_from_other_replica_after_exec_is_not_lost(replicas, monkeypatch):
+    a, b = replicas
+    db.set_backend(a)
+    set_roommates(['A', 'B', 'C'])
+
+    # A 的 EXEC 完成後、取得新版本前，B 寫入了 next_roommate_index
+    apply = a.backend.apply
+
+    def apply_then_other_replica_writes(*args, **kwargs):
+        version = apply(*args, **kwargs)
+        monkeypatch.setattr(a.backend, 'apply', apply)
+        config = b.load_config(DEFAULT_TENANT)
+        config['next_roommate_index'] = 2
+        b.save_config(DEFAULT_TENANT, config)
+        return version
+
+    monkeypatch.setattr(a.backend, 'apply', apply_then_other_replica_writes)
+    set_next_roommate_index(1)
+
+    # A 的快取不能把 B 寫入前的內容當成最新
+    assert db.load_config()['next_roommate_index'] == 2
+    with transaction() as tx:
+        config = tx.load_config()
+        config['duty_credit'] = {'A': 1}
+        tx.save_config(config)
+    assert b.load_config(DEFAULT_TENANT)['next_roommate_index'] == 2
@@ -0,0 +1,41 @@
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+from core.db import load_config
+from core.reminders import ReminderScheduler
+from core.utils import set_roommates
+
+
+class FlakyDelivery:
+    def __init__(self, failing):
+        self.failing = set(failing)
+        self.sent = []
+
+    def send_pushes(self, pushes):
+        failed = {}
+        for to, messages in pushes:
+            if to in self.failing:
+                failed[to] = ConnectionError('LINE API 無法連線')
+            else:
+                self.sent.append(to)
+        return failed
+
+
+def test_failed_push_is_released_and_retried(storage):
+    for tenant_id in ('Cgood', 'Cbad'):
+        set_roommates(['A', 'B'], tenant_id)
+    now = [datetime(2025, 6, 2, 10, tzinfo=ZoneInfo('Asia/Taipei')).timestamp()]
+    delivery = FlakyDelivery(['Cbad'])
+    scheduler = ReminderScheduler(delivery, hour=9, timezone='Asia/Taipei', clock=lambda: now[0])
+
+    assert scheduler.run_due() == 1
+    assert delivery.sent == ['Cgood']
+    assert load_config('Cgood')['last_reminded'] == '2025-06-02'
+    # 沒送出的租戶不算已提醒
+    assert load_config('Cbad').get('last_reminded') is None
+
+    delivery.failing.clear()
+    now[0] += ReminderScheduler.RETRY_DELAY
+    assert scheduler.run_due() == 1
+    assert delivery.sent == ['Cgood', 'Cbad']
+    assert load_config('Cbad')['last_reminded'] == '2025-06-02'
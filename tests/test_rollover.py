@@ -0,0 +1,16 @@
+from core.db import load_config
+from core.rollover import next_month_starter
+from core.utils import generate_schedule, set_roommates
+
+
+def test_next_month_starter_after_pregeneration(storage):
+    set_roommates(['A', 'B', 'C'])
+    generate_schedule(2025, 6)
+    # 還沒產生下個月：由設定推算，與之後實際產生的結果相同
+    projected = next_month_starter(2025, 6, load_config())
+
+    # 背景預先產生 7 月後，設定的起始室友已經指向 8 月
+    schedules, config = generate_schedule(2025, 7)
+    assert schedules[0]['roommate'] == projected
+    assert next_month_starter(2025, 6, config) == projected
+    assert config['roommates'][config['next_roommate_index']] != projected
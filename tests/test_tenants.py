@@ -0,0 +1,17 @@
+import os
+
+from config import TENANT_DIR
+from core.db import load_config, load_month_schedule
+from core.utils import generate_schedule, set_roommates
+
+
+def test_reads_do_not_create_tenant_directory(storage):
+    assert load_config('Cquiet')['next_roommate_index'] == 0
+    assert load_month_schedule(2025, 6, 'Cquiet') is None
+    assert not os.path.exists(os.path.join(TENANT_DIR, 'Cquiet'))
+
+def test_first_write_creates_tenant_directory(storage):
+    set_roommates(['A', 'B'], 'Cnew')
+    schedules, _ = generate_schedule(2025, 6, 'Cnew')
+    assert load_month_schedule(2025, 6, 'Cnew')['schedules'] == schedules
+    assert os.path.isdir(os.path.join(TENANT_DIR, 'Cnew'))